@@ -0,0 +1,68 @@
+# Shared helpers for the benchmark scripts. Run a benchmark from the project root, e.g.
+# 'python -m benchmarks.map_bbox'
+import os
+import statistics
+import time
+import uuid
+from contextlib import contextmanager
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "photoGraph.settings")
+
+import django
+
+django.setup()
+
+from django.db import connection
+from django.contrib.auth.models import User
+from main import geo
+from main.models import Post, UserProfile
+
+
+@contextmanager
+def scratch_database():
+    # Benchmarks run against a throwaway test database so they never touch db.sqlite3
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def create_profile(username="benchmark"):
+    return UserProfile.objects.create(user=User.objects.create(username=username))
+
+
+def bulk_create_posts(profile, coordinates, batch_size=5000, **fields):
+    # bulk_create skips Post.save(), so no reverse geocoding happens here
+    fields = dict({"caption": "Benchmark post", "photo": "post_photos/benchmark.jpg", "location_name": "Benchmark location"}, **fields)
+    posts = []
+    for latitude, longitude in coordinates:
+        slug_uuid = uuid.uuid4()
+        posts.append(
+            Post(
+                created_by=profile,
+                slug=str(slug_uuid),
+                slug_uuid=slug_uuid,
+                latitude=latitude,
+                longitude=longitude,
+                geohash=geo.encode(latitude, longitude),
+                **fields,
+            )
+        )
+
+        if len(posts) >= batch_size:
+            Post.objects.bulk_create(posts)
+            posts = []
+
+    if posts:
+        Post.objects.bulk_create(posts)
+
+
+def measure(function, repeat=20):
+    """Run function repeat times and return the median wall time in milliseconds."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
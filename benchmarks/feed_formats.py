@@ -0,0 +1,51 @@
+# Compares the size and serialisation time of get_posts_json's response formats.
+# Usage: python -m benchmarks.feed_formats [--posts 500] [--users 50] [--locations 40]
+import argparse
+import gzip
+import random
+
+from benchmarks.common import bulk_create_posts, create_profile, measure, scratch_database
+from django.test import RequestFactory
+from main import views
+
+VIEWPORT = {"nwLat": 55.875, "nwLon": -4.31, "seLat": 55.855, "seLon": -4.24}
+FORMATS = ["grouped", "stream", "columnar"]
+
+
+def response_body(request):
+    response = views.posts_json_response(request)
+    return b"".join(response.streaming_content) if response.streaming else response.content
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--posts", type=int, default=views.POSTS_MAX_LIMIT)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--locations", type=int, default=40)
+    args = parser.parse_args()
+
+    rng = random.Random(2024)
+    factory = RequestFactory()
+    views.POSTS_MAX_LIMIT = max(views.POSTS_MAX_LIMIT, args.posts)
+
+    with scratch_database():
+        profiles = [create_profile(f"photographer{i}") for i in range(args.users)]
+        locations = [f"{rng.randint(1, 200)} Sauchiehall Street, Glasgow, G2 3JD, United Kingdom" for _ in range(args.locations)]
+        for i in range(args.posts):
+            bulk_create_posts(
+                rng.choice(profiles),
+                [(rng.uniform(55.855, 55.875), rng.uniform(-4.31, -4.24))],
+                location_name=rng.choice(locations),
+                like_count=rng.randint(0, 100),
+            )
+
+        print(f"{'format':>10} {'bytes':>10} {'gzipped':>10} {'ms':>8}")
+        for response_format in FORMATS:
+            request = factory.get("/", dict(VIEWPORT, limit=args.posts, format=response_format))
+            body = response_body(request)
+            ms = measure(lambda: response_body(request), repeat=10)
+            print(f"{response_format:>10} {len(body):>10} {len(gzip.compress(body)):>10} {ms:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# Compares the offline gazetteer geocoder with the HTTP (Nominatim) geocoder.
+# The HTTP numbers are against a local fake server, so they are a lower bound - real Nominatim adds network
+# latency and only allows one request per second.
+# Usage: python -m benchmarks.geocoder_backends [--places 150000] [--lookups 2000]
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.common import measure
+from main.fake_geocoder import FakeNominatimServer
+from main.gazetteer import Gazetteer, to_unit_vector
+from main.geocoding import GazetteerGeocoder, NominatimGeocoder
+
+
+def write_gazetteer(path, count, rng):
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(count):
+            latitude, longitude = rng.uniform(-60, 70), rng.uniform(-180, 180)
+            f.write(f"{i}\tPlace {i}\tPlace {i}\t\t{latitude:.5f}\t{longitude:.5f}\tP\tPPL\tXX\n")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--places", type=int, default=150_000)
+    parser.add_argument("--lookups", type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = random.Random(2024)
+    queries = [(rng.uniform(-60, 70), rng.uniform(-180, 180)) for _ in range(args.lookups)]
+
+    fd, path = tempfile.mkstemp(suffix=".txt")
+    os.close(fd)
+    try:
+        write_gazetteer(path, args.places, rng)
+
+        start = time.perf_counter()
+        gazetteer = Gazetteer.from_file(path)
+        print(f"Loaded {len(gazetteer)} places in {time.perf_counter() - start:.2f}s")
+
+        geocoder = GazetteerGeocoder(path, max_distance=float("inf"))
+        geocoder.reverse(0, 0)
+        kd_ms = measure(lambda: [geocoder.reverse(latitude, longitude) for latitude, longitude in queries], repeat=5)
+
+        # Brute force over the same arrays, to check the tree is worth having
+        xs, ys, zs = gazetteer.tree.coordinates
+
+        def brute_force(latitude, longitude):
+            x, y, z = to_unit_vector(latitude, longitude)
+            return min(range(len(xs)), key=lambda i: (xs[i] - x) ** 2 + (ys[i] - y) ** 2 + (zs[i] - z) ** 2)
+
+        brute_queries = queries[:20]
+        brute_ms = measure(lambda: [brute_force(latitude, longitude) for latitude, longitude in brute_queries], 3)
+
+        with FakeNominatimServer() as server:
+            http_geocoder = NominatimGeocoder(url=server.url)
+            http_queries = queries[:200]
+            http_ms = measure(
+                lambda: [http_geocoder.reverse(latitude, longitude) for latitude, longitude in http_queries], 3
+            )
+    finally:
+        os.remove(path)
+
+    print(f"{'backend':>22} {'per lookup (us)':>16}")
+    print(f"{'gazetteer k-d tree':>22} {kd_ms * 1000 / len(queries):>16.1f}")
+    print(f"{'gazetteer brute force':>22} {brute_ms * 1000 / len(brute_queries):>16.1f}")
+    print(f"{'HTTP (local fake)':>22} {http_ms * 1000 / len(http_queries):>16.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# Compares the size and encode time of each rendition's JPEG with its WebP and AVIF variants, across the test
+# image fixtures and a corpus of generated photo-like images.
+# Usage: python -m benchmarks.image_formats [--generated 12] [--fixtures tests/photoGraph/test_images]
+import argparse
+import os
+import random
+
+from benchmarks.common import measure
+from main import renditions
+from PIL import Image, ImageChops, ImageDraw, ImageFilter
+
+
+def generated_image(seed, size=(3000, 2250)):
+    # A sky-like gradient, blurred shapes for subjects and some sensor noise, closer to a photo than pure noise
+    rng = random.Random(seed)
+    width, height = size
+    channels = []
+    for _ in range(3):
+        low, high = rng.randint(0, 80), rng.randint(150, 255)
+        gradient = Image.linear_gradient("L").rotate(rng.uniform(-30, 30)).resize(size)
+        channels.append(gradient.point([low + value * (high - low) // 255 for value in range(256)]))
+    image = Image.merge("RGB", channels)
+
+    draw = ImageDraw.Draw(image)
+    for _ in range(rng.randint(10, 40)):
+        x, y = rng.randrange(width), rng.randrange(height)
+        radius = rng.randint(width // 40, width // 6)
+        fill = tuple(rng.randrange(256) for _ in range(3))
+        shape = draw.ellipse if rng.random() < 0.5 else draw.rectangle
+        shape([x - radius, y - radius, x + radius, y + radius], fill=fill)
+    image = image.filter(ImageFilter.GaussianBlur(rng.uniform(1, 6)))
+
+    noise = Image.merge("RGB", [Image.effect_noise(size, rng.uniform(4, 16)) for _ in range(3)])
+    return ImageChops.add(image, noise, scale=1, offset=-128)
+
+
+def corpus(fixtures, generated):
+    for name in sorted(os.listdir(fixtures)):
+        with open(os.path.join(fixtures, name), "rb") as f:
+            yield name, renditions.open_scaled(f, *[max(renditions.RENDITIONS.values())] * 2)
+    for seed in range(generated):
+        yield f"generated {seed}", generated_image(seed)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fixtures", default="tests/photoGraph/test_images")
+    parser.add_argument("--generated", type=int, default=12)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    formats = [("JPEG", {"quality": renditions.JPEG_QUALITY, "optimize": True})]
+    formats += [(image_format, options) for _, _, image_format, options in renditions.encodable_variants()]
+    for media_type, _, image_format, _ in renditions.VARIANTS:
+        if image_format not in dict(formats):
+            print(f"{image_format} skipped, this Pillow can't encode {media_type}")
+
+    # (size, format) -> [total bytes, total milliseconds]
+    totals = {}
+    images = 0
+    for name, image in corpus(args.fixtures, args.generated):
+        images += 1
+        for size, pixels in sorted(renditions.RENDITIONS.items(), key=lambda item: item[1], reverse=True):
+            image.thumbnail((pixels, pixels), Image.LANCZOS)
+            for image_format, options in formats:
+                data = renditions.encode(image, image_format, **options)
+                ms = measure(lambda: renditions.encode(image, image_format, **options), repeat=args.repeat)
+                total = totals.setdefault((size, image_format), [0, 0])
+                total[0] += len(data)
+                total[1] += ms
+
+    print(f"{images} images")
+    print(f"{'rendition':>10} {'format':>6} {'bytes/image':>12} {'vs JPEG':>8} {'encode (ms)':>12} {'vs JPEG':>8}")
+    for size in sorted(renditions.RENDITIONS, key=renditions.RENDITIONS.get):
+        jpeg_bytes, jpeg_ms = totals[(size, "JPEG")]
+        for image_format, _ in formats:
+            total_bytes, total_ms = totals[(size, image_format)]
+            print(
+                f"{size:>10} {image_format:>6} {total_bytes // images:>12} {total_bytes / jpeg_bytes - 1:>+8.0%} "
+                f"{total_ms / images:>12.1f} {total_ms / jpeg_ms:>7.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+# Measures the get_posts_json bounding box query as the posts table grows.
+# Usage: python -m benchmarks.map_bbox [--sizes 10000 100000 1000000]
+import argparse
+import random
+
+from benchmarks.common import bulk_create_posts, create_profile, measure, scratch_database
+from main.models import Post
+
+# A city centre sized viewport around Glasgow
+VIEWPORT = (55.855, -4.31, 55.875, -4.24)
+VIEWPORT_POSTS = 200
+
+
+def random_coordinates(count, rng):
+    south, west, north, east = VIEWPORT
+    while count > 0:
+        latitude, longitude = rng.uniform(-60, 70), rng.uniform(-180, 180)
+        if south <= latitude <= north and west <= longitude <= east:
+            continue
+        count -= 1
+        yield latitude, longitude
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    args = parser.parse_args()
+
+    rng = random.Random(2024)
+    south, west, north, east = VIEWPORT
+
+    with scratch_database():
+        profile = create_profile()
+        bulk_create_posts(
+            profile,
+            [(rng.uniform(south, north), rng.uniform(west, east)) for _ in range(VIEWPORT_POSTS)],
+        )
+
+        print(f"{'posts':>10} {'in viewport':>12} {'geohash (ms)':>13} {'lat/lon scan (ms)':>18}")
+        for size in sorted(args.sizes):
+            bulk_create_posts(profile, random_coordinates(size - Post.objects.count(), rng))
+
+            indexed = Post.objects.in_bbox(south, west, north, east)
+            scan = Post.objects.filter(
+                latitude__gte=south, latitude__lte=north, longitude__gte=west, longitude__lte=east
+            )
+            assert indexed.count() == scan.count() == VIEWPORT_POSTS
+
+            indexed_ms = measure(lambda: list(indexed.all()))
+            scan_ms = measure(lambda: list(scan.all()), repeat=5)
+            print(f"{size:>10} {VIEWPORT_POSTS:>12} {indexed_ms:>13.2f} {scan_ms:>18.2f}")
+
+
+if __name__ == "__main__":
+    main()
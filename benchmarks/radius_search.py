@@ -0,0 +1,56 @@
+# Measures the radius search behind show_location?lat=...&lon=...&radius_m=... as the posts table grows,
+# against computing the distance to every post.
+# Usage: python -m benchmarks.radius_search [--sizes 10000 100000 1000000] [--radius 1000]
+import argparse
+import random
+
+from benchmarks.common import bulk_create_posts, create_profile, measure, scratch_database
+from benchmarks.map_bbox import random_coordinates
+from main import nearby
+from main.models import Post
+
+CENTRE = (55.8642, -4.2518)
+# Posts scattered over roughly 10km around the centre, the rest are spread over the world
+LOCAL_POSTS = 5000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--radius", type=float, default=1000)
+    args = parser.parse_args()
+
+    rng = random.Random(2024)
+    latitude, longitude = CENTRE
+    print(f"NumPy distances: {'yes' if nearby.numpy is not None else 'no (not installed)'}")
+
+    with scratch_database():
+        profile = create_profile()
+        bulk_create_posts(
+            profile,
+            [(latitude + rng.uniform(-0.05, 0.05), longitude + rng.uniform(-0.08, 0.08)) for _ in range(LOCAL_POSTS)],
+        )
+
+        print(f"{'posts':>10} {'in radius':>10} {'prefiltered (ms)':>17} {'first page (ms)':>16} {'every post (ms)':>16}")
+        for size in sorted(args.sizes):
+            bulk_create_posts(profile, random_coordinates(size - Post.objects.count(), rng))
+
+            def every_post():
+                candidates = list(Post.objects.values_list("id", "latitude", "longitude"))
+                ids, latitudes, longitudes = zip(*candidates)
+                distances = nearby.distances_m(latitude, longitude, latitudes, longitudes)
+                return sorted((d, i) for i, d in zip(ids, distances) if d <= args.radius)
+
+            matches = nearby.posts_within_radius(latitude, longitude, args.radius)
+            assert len(matches) == len(every_post())
+
+            prefiltered_ms = measure(lambda: nearby.posts_within_radius(latitude, longitude, args.radius))
+            page_ms = measure(
+                lambda: nearby.load_posts(nearby.posts_within_radius(latitude, longitude, args.radius)[:20])
+            )
+            every_post_ms = measure(every_post, repeat=3)
+            print(f"{size:>10} {len(matches):>10} {prefiltered_ms:>17.2f} {page_ms:>16.2f} {every_post_ms:>16.2f}")
+
+
+if __name__ == "__main__":
+    main()
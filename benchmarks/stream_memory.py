@@ -0,0 +1,58 @@
+# Compares peak Python memory of get_posts_json's grouped response with format=stream as the number of posts
+# in the response grows. The grouped response is normally capped at POSTS_MAX_LIMIT, the cap is lifted here.
+# Usage: python -m benchmarks.stream_memory [--sizes 1000 10000 50000]
+import argparse
+import random
+import time
+import tracemalloc
+
+from benchmarks.common import bulk_create_posts, create_profile, scratch_database
+from django.test import RequestFactory
+from main import views
+from main.models import Post
+
+VIEWPORT = {"nwLat": 55.875, "nwLon": -4.31, "seLat": 55.855, "seLon": -4.24}
+
+
+def measure_response(request):
+    """Return (peak memory in MB, seconds, bytes) for producing and reading the whole response."""
+    tracemalloc.start()
+    start = time.perf_counter()
+
+    response = views.posts_json_response(request)
+    size = 0
+    for chunk in response.streaming_content if response.streaming else [response.content]:
+        size += len(chunk)
+
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 2 ** 20, seconds, size
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10_000, 50_000])
+    args = parser.parse_args()
+
+    rng = random.Random(2024)
+    factory = RequestFactory()
+    views.POSTS_MAX_LIMIT = max(args.sizes)
+    views.POSTS_STREAM_MAX_LIMIT = max(args.sizes)
+
+    with scratch_database():
+        profile = create_profile()
+        print(f"{'posts':>8} {'grouped peak (MB)':>18} {'stream peak (MB)':>17} {'grouped (s)':>12} {'stream (s)':>11}")
+        for size in sorted(args.sizes):
+            bulk_create_posts(
+                profile,
+                [(rng.uniform(55.855, 55.875), rng.uniform(-4.31, -4.24)) for _ in range(size - Post.objects.count())],
+            )
+
+            grouped = measure_response(factory.get("/", dict(VIEWPORT, limit=size)))
+            streamed = measure_response(factory.get("/", dict(VIEWPORT, limit=size, format="stream")))
+            print(f"{size:>8} {grouped[0]:>18.1f} {streamed[0]:>17.1f} {grouped[1]:>12.2f} {streamed[1]:>11.2f}")
+
+
+if __name__ == "__main__":
+    main()
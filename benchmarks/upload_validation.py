@@ -0,0 +1,87 @@
+# Compares how long Django's ImageField and HeaderCheckedImageField take to check uploads of growing size, and
+# what decoding each upload they accept then costs the upload processing workers.
+# Usage: python -m benchmarks.upload_validation [--megapixels 12 48 100] [--png-megapixels 16]
+import argparse
+import struct
+import warnings
+import zlib
+from io import BytesIO
+
+from benchmarks.common import measure
+from django import forms
+from django.core.files.uploadedfile import SimpleUploadedFile
+from main.forms import HeaderCheckedImageField
+from PIL import Image
+
+
+def synthetic_image(megapixels, image_format):
+    # Noise at 4:3, grayscale so even 100 megapixels fits in memory while it's encoded
+    width = int((megapixels * 10 ** 6 * 4 / 3) ** 0.5)
+    image = Image.effect_noise((width, width * 3 // 4), 16)
+    buffer = BytesIO()
+    image.save(buffer, image_format)
+    return buffer.getvalue()
+
+
+def bomb_png(width, height):
+    # A PNG header claiming width x height with next to no data behind it
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 1, 0, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(b"\x00" * 64))
+        + chunk(b"IEND", b"")
+    )
+
+
+def check(field, filename, data):
+    """Return (accepted, milliseconds) for field checking an upload of data."""
+
+    def clean():
+        try:
+            field.clean(SimpleUploadedFile(filename, data))
+        except forms.ValidationError:
+            return False
+        return True
+
+    return clean(), measure(clean, repeat=5)
+
+
+def decode_ms(data):
+    def decode():
+        with Image.open(BytesIO(data)) as image:
+            image.load()
+
+    try:
+        return measure(decode, repeat=3)
+    except Image.DecompressionBombError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--megapixels", type=int, nargs="+", default=[12, 48, 100])
+    # ImageField reads all of a PNG to verify its checksums
+    parser.add_argument("--png-megapixels", type=int, nargs="+", default=[16])
+    args = parser.parse_args()
+    warnings.simplefilter("ignore", Image.DecompressionBombWarning)
+
+    uploads = [(f"{mp} MP JPEG", "photo.jpg", synthetic_image(mp, "JPEG")) for mp in args.megapixels]
+    uploads += [(f"{mp} MP PNG", "photo.png", synthetic_image(mp, "PNG")) for mp in args.png_megapixels]
+    uploads.append(("2.5 GP PNG bomb", "bomb.png", bomb_png(50000, 50000)))
+
+    print(f"{'upload':>16} {'bytes':>10} {'ImageField':>16} {'header check':>16} {'decode (ms)':>12}")
+    for name, filename, data in uploads:
+        results = []
+        for field in (forms.ImageField(), HeaderCheckedImageField()):
+            accepted, ms = check(field, filename, data)
+            results.append(f"{'ok' if accepted else 'rejected'} {ms:.2f}ms")
+        decode = decode_ms(data)
+        decode = "bomb" if decode is None else f"{decode:.0f}"
+        print(f"{name:>16} {len(data):>10} {results[0]:>16} {results[1]:>16} {decode:>12}")
+
+
+if __name__ == "__main__":
+    main()
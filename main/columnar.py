@@ -0,0 +1,65 @@
+from django.core.files.storage import default_storage
+from django.urls import reverse
+from main import cursors, renditions
+from main.streaming import POST_FIELDS
+
+
+def url_templates():
+    # Placeholders are swapped for {name} after reversing, so the URL patterns stay the only source of the URLs
+    return {
+        "post": reverse("main:view_post", args=["USER-SLUG", "POST-SLUG"])
+        .replace("USER-SLUG", "{user}")
+        .replace("POST-SLUG", "{slug}"),
+        "user": reverse("main:show_user_profile", args=["USER-SLUG"]).replace("USER-SLUG", "{user}"),
+        "location": reverse("main:show_location") + "?location_name={location}",
+        "photo": default_storage.url("PHOTO").replace("PHOTO", "{photo}"),
+    }
+
+
+def columnar_posts(posts, order, limit, cursor=None):
+    """
+    Return up to limit posts in order as parallel arrays, one per field, rather than an object per post.
+
+    Users and locations are listed once each and referred to by their index, and URLs are left for the client to
+    fill in from url_templates, photos still being processed have none. Ranked and paged like the other formats,
+    next_cursor is None on the last page.
+    """
+    rows = list(cursors.after_cursor(posts, order, cursor)[: limit + 1].values(*POST_FIELDS))
+    next_cursor = cursors.encode_cursor(order, rows[limit - 1]) if len(rows) > limit else None
+    rows = rows[:limit]
+
+    users, locations = {}, {}
+    columns = {
+        "id": [],
+        "slug": [],
+        "lat": [],
+        "lon": [],
+        "user": [],
+        "location": [],
+        "likes": [],
+        "date": [],
+        "caption": [],
+        "photo": [],
+        "icon": [],
+    }
+    for row in rows:
+        location_name = row["location__name"] if row["location__name"] is not None else row["location_name"]
+        columns["id"].append(row["id"])
+        columns["slug"].append(row["slug"])
+        columns["lat"].append(row["latitude"])
+        columns["lon"].append(row["longitude"])
+        columns["user"].append(users.setdefault(row["created_by__slug"], len(users)))
+        columns["location"].append(locations.setdefault(location_name, len(locations)))
+        columns["likes"].append(row["like_count"])
+        columns["date"].append(row["created_time"])
+        columns["caption"].append(row["caption"])
+        columns["photo"].append(renditions.rendition_file(row["photo"], "card", row["photo_status"]))
+        columns["icon"].append(renditions.rendition_file(row["photo"], "icon", row["photo_status"]))
+
+    return {
+        "url_templates": url_templates(),
+        "users": list(users),
+        "locations": list(locations),
+        "posts": columns,
+        "next_cursor": next_cursor,
+    }
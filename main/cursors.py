@@ -0,0 +1,65 @@
+import base64
+import json
+
+from django.db.models import Q
+
+# Orderings posts can be paged through, each ends with the primary key so every post has a distinct position.
+# Descending on every field, so the most liked or most recent posts come first.
+ORDERINGS = {
+    "likes": ("like_count", "id"),
+    "recent": ("id",),
+}
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(order, post):
+    # post can be a Post or a row from .values()
+    if isinstance(post, dict):
+        position = [post[field] for field in ORDERINGS[order]]
+    else:
+        position = [getattr(post, field) for field in ORDERINGS[order]]
+    return base64.urlsafe_b64encode(json.dumps([order] + position).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor, order):
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError as e:
+        raise InvalidCursor("Malformed cursor") from e
+
+    if not isinstance(data, list) or data[:1] != [order] or len(data) != len(ORDERINGS[order]) + 1:
+        raise InvalidCursor("Cursor is for a different ordering")
+    if not all(isinstance(value, int) for value in data[1:]):
+        raise InvalidCursor("Malformed cursor")
+    return data[1:]
+
+
+def after_cursor(posts, order, cursor=None):
+    """Order posts and skip the ones up to and including cursor."""
+    fields = ORDERINGS[order]
+    posts = posts.order_by(*[f"-{field}" for field in fields])
+
+    if cursor is not None:
+        position = decode_cursor(cursor, order)
+        # (a, b) < (x, y) written out as a < x OR (a = x AND b < y), which every database can use an index for
+        after = Q()
+        for i, field in enumerate(fields):
+            after |= Q(**dict(zip(fields[:i], position[:i])), **{f"{field}__lt": position[i]})
+        posts = posts.filter(after)
+
+    return posts
+
+
+def keyset_page(posts, order, limit, cursor=None):
+    """
+    Return (page, next_cursor) for up to limit posts in order, starting after cursor.
+
+    Pages are found by comparing against the last post's position rather than with an OFFSET, so a page is an
+    index range scan however deep into the results it is. next_cursor is None on the last page.
+    """
+    page = list(after_cursor(posts, order, cursor)[: limit + 1])
+    next_cursor = encode_cursor(order, page[limit - 1]) if len(page) > limit else None
+    return page[:limit], next_cursor
@@ -0,0 +1,63 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+class FakeNominatimServer:
+    """
+    A local stand-in for Nominatim's /reverse endpoint, for running the geocoding worker and its tests offline.
+
+    Every coordinate gets a made-up place name unless place_name is replaced, and status can be set to make the
+    server fail. Use it as a context manager, the geocoder URL is in server.url.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.requests = []
+        self.status = 200
+        self.place_name = lambda latitude, longitude: f"Fake place {latitude:.3f}, {longitude:.3f}"
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlsplit(self.path)
+                query = parse_qs(url.query)
+                server.requests.append(self.path)
+
+                if url.path != "/reverse" or server.status != 200:
+                    self.send_response(server.status if server.status != 200 else 404)
+                    self.end_headers()
+                    return
+
+                latitude, longitude = float(query["lat"][0]), float(query["lon"][0])
+                name = server.place_name(latitude, longitude)
+                body = json.dumps({"display_name": name} if name else {"error": "Unable to geocode"}).encode()
+
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.url = f"http://{host}:{self.httpd.server_address[1]}"
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -1,8 +1,61 @@
 from django.contrib.auth.password_validation import validate_password
+from django.conf import settings
 from django.core.exceptions import ValidationError
 from django import forms
 from django.contrib.auth.models import User
 from main.models import UserProfile, Group, Comment, Post, PostReport, UserReport, ContactUs
+from PIL import Image
+import warnings
+
+
+class HeaderCheckedImageField(forms.ImageField):
+    """
+    An ImageField that only reads an upload's header, for its format and dimensions, rather than having Pillow
+    verify the whole file.
+
+    Uploads bigger than UPLOAD_MAX_BYTES or UPLOAD_MAX_PIXELS are turned down before any of the image is read or
+    decoded, so checking one costs the same however big it claims to be. Accepted uploads are decoded later by the
+    upload processing workers, see main.processing.
+    """
+
+    default_error_messages = {
+        "too_large": "Images can be at most %(max)d MB.",
+        "too_many_pixels": "Images can be at most %(max)d megapixels.",
+    }
+    formats = ("JPEG", "PNG", "WEBP", "GIF")
+
+    def to_python(self, data):
+        f = forms.FileField.to_python(self, data)
+        if f is None:
+            return None
+
+        if f.size > settings.UPLOAD_MAX_BYTES:
+            raise ValidationError(
+                self.error_messages["too_large"], code="too_large", params={"max": settings.UPLOAD_MAX_BYTES // 2 ** 20}
+            )
+
+        too_many_pixels = ValidationError(
+            self.error_messages["too_many_pixels"],
+            code="too_many_pixels",
+            params={"max": settings.UPLOAD_MAX_PIXELS // 10 ** 6},
+        )
+        try:
+            # Pillow only reads as far as the dimensions when opening an image, the pixels are read on first use
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", Image.DecompressionBombWarning)
+                image = Image.open(f, formats=self.formats)
+        except Image.DecompressionBombError as e:
+            raise too_many_pixels from e
+        except (OSError, ValueError) as e:
+            raise ValidationError(self.error_messages["invalid_image"], code="invalid_image") from e
+
+        if image.width * image.height > settings.UPLOAD_MAX_PIXELS:
+            raise too_many_pixels
+
+        f.image = image
+        f.content_type = Image.MIME.get(image.format)
+        f.seek(0)
+        return f
 
 
 class UserForm(forms.ModelForm):
@@ -43,7 +96,7 @@ class UserForm(forms.ModelForm):
         return cleaned_data
 
 class UserProfileForm(forms.ModelForm):
-    profile_picture = forms.ImageField()
+    profile_picture = HeaderCheckedImageField()
     biography = forms.CharField(max_length=100, required=False, label="Biography (optional)")
 
     class Meta:
@@ -68,7 +121,7 @@ class GroupForm(forms.ModelForm):
 
 class PostForm(forms.ModelForm):
     caption = forms.CharField(label="Caption", max_length=255)
-    photo = forms.ImageField(label="Photo")
+    photo = HeaderCheckedImageField(label="Photo")
     group = forms.ModelChoiceField(label="Group (optional)", queryset=None, required=False)
     latitude = forms.DecimalField(label="Latitude")
     longitude = forms.DecimalField(label="Longitude")
@@ -133,7 +186,7 @@ class UserReportForm(forms.ModelForm):
 class ChangePost(forms.ModelForm):
 
     caption = forms.CharField(label="Caption", max_length=255)
-    photo = forms.ImageField(label="Photo")
+    photo = HeaderCheckedImageField(label="Photo")
 
     class Meta:
         model = Post
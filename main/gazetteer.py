@@ -0,0 +1,125 @@
+import csv
+import math
+import threading
+from array import array
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Columns of a GeoNames dump (e.g. cities1000.txt from https://download.geonames.org/export/dump/)
+NAME_COLUMN = 1
+LATITUDE_COLUMN = 4
+LONGITUDE_COLUMN = 5
+COUNTRY_COLUMN = 8
+
+
+def to_unit_vector(latitude, longitude):
+    # Straight line distance between unit vectors grows with great circle distance, so the tree can use
+    # plain euclidean distance and still handle the poles and the antimeridian
+    latitude, longitude = math.radians(float(latitude)), math.radians(float(longitude))
+    cos_latitude = math.cos(latitude)
+    return cos_latitude * math.cos(longitude), cos_latitude * math.sin(longitude), math.sin(latitude)
+
+
+def chord_to_km(chord):
+    return 2 * EARTH_RADIUS_KM * math.asin(min(chord / 2, 1.0))
+
+
+class KDTree:
+    """
+    Static 3d tree over unit vectors, stored as flat arrays in tree order.
+
+    The node for the range [low, high) is at its middle index and splits on axis depth % 3, the two halves of
+    the range are its children. There are no node objects, so a few hundred thousand places fit in a few MB.
+    """
+
+    def __init__(self, points):
+        order = list(range(len(points)))
+        coordinates = [array("d", (point[axis] for point in points)) for axis in range(3)]
+
+        stack = [(0, len(order), 0)]
+        while stack:
+            low, high, axis = stack.pop()
+            if high - low <= 1:
+                continue
+            order[low:high] = sorted(order[low:high], key=coordinates[axis].__getitem__)
+            middle = (low + high) // 2
+            stack.append((low, middle, (axis + 1) % 3))
+            stack.append((middle + 1, high, (axis + 1) % 3))
+
+        self.order = array("l", order)
+        self.coordinates = [array("d", (axis_values[i] for i in order)) for axis_values in coordinates]
+
+    def __len__(self):
+        return len(self.order)
+
+    def nearest(self, point):
+        """Return (index, chord distance) of the point nearest to point, index is into the original points."""
+        xs, ys, zs = self.coordinates
+        best = [-1, math.inf]
+
+        def search(low, high, axis):
+            if low >= high:
+                return
+            middle = (low + high) // 2
+            dx, dy, dz = xs[middle] - point[0], ys[middle] - point[1], zs[middle] - point[2]
+            distance = dx * dx + dy * dy + dz * dz
+            if distance < best[1]:
+                best[0], best[1] = middle, distance
+
+            difference = (dx, dy, dz)[axis]
+            next_axis = (axis + 1) % 3
+            # Search the side of the split the point is on first, the other side only if it could be closer
+            if difference > 0:
+                search(low, middle, next_axis)
+                if difference * difference < best[1]:
+                    search(middle + 1, high, next_axis)
+            else:
+                search(middle + 1, high, next_axis)
+                if difference * difference < best[1]:
+                    search(low, middle, next_axis)
+
+        search(0, len(self.order), 0)
+        if best[0] < 0:
+            return None, math.inf
+        return self.order[best[0]], math.sqrt(best[1])
+
+
+class Gazetteer:
+    def __init__(self, places):
+        self.names = [name for name, _, _ in places]
+        self.tree = KDTree([to_unit_vector(latitude, longitude) for _, latitude, longitude in places])
+
+    @classmethod
+    def from_file(cls, path):
+        places = []
+        with open(path, encoding="utf-8", newline="") as f:
+            for row in csv.reader(f, delimiter="\t", quoting=csv.QUOTE_NONE):
+                if not row or row[0].startswith("#"):
+                    continue
+                name = row[NAME_COLUMN]
+                if len(row) > COUNTRY_COLUMN and row[COUNTRY_COLUMN]:
+                    name = f"{name}, {row[COUNTRY_COLUMN]}"
+                places.append((name, float(row[LATITUDE_COLUMN]), float(row[LONGITUDE_COLUMN])))
+        return cls(places)
+
+    def __len__(self):
+        return len(self.names)
+
+    def nearest(self, latitude, longitude):
+        """Return (place name, distance in km) of the nearest place."""
+        index, chord = self.tree.nearest(to_unit_vector(latitude, longitude))
+        if index is None:
+            return None, math.inf
+        return self.names[index], chord_to_km(chord)
+
+
+_gazetteers = {}
+_gazetteers_lock = threading.Lock()
+
+
+def load_gazetteer(path):
+    """Load the gazetteer at path once per process."""
+    with _gazetteers_lock:
+        if path not in _gazetteers:
+            _gazetteers[path] = Gazetteer.from_file(path)
+        return _gazetteers[path]
@@ -0,0 +1,231 @@
+import math
+
+# Geohash alphabet - it is in ASCII order, so comparing geohash strings compares the cells they describe
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+# Precision stored on each post (~5m x 5m cells)
+GEOHASH_PRECISION = 9
+
+# Upper bound on the number of cells a bounding box is split into before lowering the precision
+MAX_BBOX_CELLS = 32
+
+
+def clamp_bbox(south, west, north, east):
+    south, north = max(-90.0, float(south)), min(90.0, float(north))
+    west, east = max(-180.0, float(west)), min(180.0, float(east))
+    return south, west, north, east
+
+
+def _cell_bits(precision):
+    # Geohashes interleave longitude and latitude bits, starting with longitude
+    total = 5 * precision
+    return (total + 1) // 2, total // 2
+
+
+def _cell_index(value, low, high, bits):
+    index = int((value - low) / (high - low) * (1 << bits))
+    return min(max(index, 0), (1 << bits) - 1)
+
+
+def _interleave(lon_index, lat_index, lon_bits, lat_bits):
+    value = 0
+    for bit in range(lon_bits + lat_bits):
+        value <<= 1
+        if bit % 2 == 0:
+            value |= (lon_index >> (lon_bits - 1 - bit // 2)) & 1
+        else:
+            value |= (lat_index >> (lat_bits - 1 - bit // 2)) & 1
+    return value
+
+
+def _to_string(value, precision):
+    chars = []
+    for _ in range(precision):
+        chars.append(GEOHASH_ALPHABET[value & 31])
+        value >>= 5
+    return "".join(reversed(chars))
+
+
+def encode(latitude, longitude, precision=GEOHASH_PRECISION):
+    lon_bits, lat_bits = _cell_bits(precision)
+    lon_index = _cell_index(float(longitude), -180.0, 180.0, lon_bits)
+    lat_index = _cell_index(float(latitude), -90.0, 90.0, lat_bits)
+    return _to_string(_interleave(lon_index, lat_index, lon_bits, lat_bits), precision)
+
+
+def decode_bbox(geohash):
+    """Return the (south, west, north, east) bounds of a geohash cell."""
+    value = 0
+    for char in geohash:
+        value = (value << 5) | GEOHASH_ALPHABET.index(char)
+
+    lon_bits, lat_bits = _cell_bits(len(geohash))
+    lon_index = lat_index = 0
+    for bit in range(lon_bits + lat_bits):
+        bit_value = (value >> (lon_bits + lat_bits - 1 - bit)) & 1
+        if bit % 2 == 0:
+            lon_index = (lon_index << 1) | bit_value
+        else:
+            lat_index = (lat_index << 1) | bit_value
+
+    lon_size = 360.0 / (1 << lon_bits)
+    lat_size = 180.0 / (1 << lat_bits)
+    south = -90.0 + lat_index * lat_size
+    west = -180.0 + lon_index * lon_size
+    return south, west, south + lat_size, west + lon_size
+
+
+def _cell_span(south, west, north, east, precision):
+    lon_bits, lat_bits = _cell_bits(precision)
+    lon_range = (_cell_index(west, -180.0, 180.0, lon_bits), _cell_index(east, -180.0, 180.0, lon_bits))
+    lat_range = (_cell_index(south, -90.0, 90.0, lat_bits), _cell_index(north, -90.0, 90.0, lat_bits))
+    return lon_range, lat_range
+
+
+def bbox_precision(south, west, north, east, max_cells=MAX_BBOX_CELLS):
+    """Finest precision at which the bounding box is covered by at most max_cells cells."""
+    south, west, north, east = clamp_bbox(south, west, north, east)
+    best = 1
+    for precision in range(1, GEOHASH_PRECISION + 1):
+        (lon_lo, lon_hi), (lat_lo, lat_hi) = _cell_span(south, west, north, east, precision)
+        if (lon_hi - lon_lo + 1) * (lat_hi - lat_lo + 1) > max_cells:
+            break
+        best = precision
+    return best
+
+
+def bbox_cells(south, west, north, east, precision):
+    south, west, north, east = clamp_bbox(south, west, north, east)
+    if south > north or west > east:
+        return []
+
+    lon_bits, lat_bits = _cell_bits(precision)
+    (lon_lo, lon_hi), (lat_lo, lat_hi) = _cell_span(south, west, north, east, precision)
+    return sorted(
+        _interleave(lon_index, lat_index, lon_bits, lat_bits)
+        for lon_index in range(lon_lo, lon_hi + 1)
+        for lat_index in range(lat_lo, lat_hi + 1)
+    )
+
+
+def quantize_bbox(south, west, north, east):
+    """Grow a bounding box outwards to a grid of about an eighth of its size, so boxes that nearly match snap together."""
+    step = 10 ** math.floor(math.log10(max(north - south, east - west, 1e-6) / 8))
+    return tuple(
+        round(snap(round(value / step, 6)) * step, 9)
+        for value, snap in ((south, math.floor), (west, math.floor), (north, math.ceil), (east, math.ceil))
+    )
+
+
+def bbox_difference(box, removed):
+    """
+    Return box minus every box in removed, as a list of non-overlapping (south, west, north, east) boxes.
+
+    Each removed box splits what is left of box into at most four strips around it: below, above, and either
+    side between them.
+    """
+    pieces = [tuple(box)]
+    for r_south, r_west, r_north, r_east in removed:
+        remaining = []
+        for south, west, north, east in pieces:
+            if r_south >= north or r_north <= south or r_west >= east or r_east <= west:
+                remaining.append((south, west, north, east))
+                continue
+            if r_south > south:
+                remaining.append((south, west, r_south, east))
+            if r_north < north:
+                remaining.append((r_north, west, north, east))
+            middle_south, middle_north = max(south, r_south), min(north, r_north)
+            if r_west > west:
+                remaining.append((middle_south, west, middle_north, r_west))
+            if r_east < east:
+                remaining.append((middle_south, r_east, middle_north, east))
+        pieces = remaining
+    return pieces
+
+
+def bbox_geohashes(south, west, north, east, max_cells=MAX_BBOX_CELLS, max_precision=GEOHASH_PRECISION):
+    """The cells covering a bounding box at the finest precision (up to max_precision) with at most max_cells."""
+    precision = min(bbox_precision(south, west, north, east, max_cells), max_precision)
+    return [_to_string(cell, precision) for cell in bbox_cells(south, west, north, east, precision)]
+
+
+def bbox_ranges(south, west, north, east, max_cells=MAX_BBOX_CELLS):
+    """
+    Cover a bounding box with geohash cells and return them as a list of (low, high) string ranges.
+
+    A stored geohash lies in the box's cover when low <= geohash < high (high is None for the last cell
+    on the globe). Neighbouring cells that are adjacent in geohash order are merged into one range, so
+    each range is a single index scan.
+    """
+    precision = bbox_precision(south, west, north, east, max_cells)
+    cells = bbox_cells(south, west, north, east, precision)
+
+    ranges = []
+    for cell in cells:
+        if ranges and ranges[-1][1] == cell:
+            ranges[-1][1] = cell + 1
+        else:
+            ranges.append([cell, cell + 1])
+
+    last_cell = 1 << (5 * precision)
+    return [
+        (_to_string(low, precision), _to_string(high, precision) if high < last_cell else None)
+        for low, high in ranges
+    ]
+
+
+def zoom_precision(zoom):
+    """Geohash precision used to cluster posts at a map zoom level, giving cells about half a map tile wide."""
+    precision = 1
+    while precision < GEOHASH_PRECISION and _cell_bits(precision + 1)[0] <= int(zoom) + 1:
+        precision += 1
+    return precision
+
+
+def tile_bbox(zoom, x, y):
+    """Return the (south, west, north, east) bounds of a slippy map (Web Mercator) tile."""
+    n = 1 << zoom
+    west = x / n * 360.0 - 180.0
+    east = (x + 1) / n * 360.0 - 180.0
+    north = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    south = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return south, west, north, east
+
+
+def tile_for(latitude, longitude, zoom):
+    n = 1 << zoom
+    latitude = min(max(float(latitude), -85.0511), 85.0511)
+    x = int((float(longitude) + 180.0) / 360.0 * n)
+    y = int((1 - math.asinh(math.tan(math.radians(latitude))) / math.pi) / 2 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+EARTH_RADIUS_M = 6371008.8
+
+
+def haversine_m(latitude1, longitude1, latitude2, longitude2):
+    """Great circle distance in metres."""
+    latitude1, longitude1 = math.radians(latitude1), math.radians(longitude1)
+    latitude2, longitude2 = math.radians(latitude2), math.radians(longitude2)
+    a = (
+        math.sin((latitude2 - latitude1) / 2) ** 2
+        + math.cos(latitude1) * math.cos(latitude2) * math.sin((longitude2 - longitude1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_M * math.asin(min(math.sqrt(a), 1.0))
+
+
+def radius_bbox(latitude, longitude, radius_m):
+    """Return a (south, west, north, east) box containing every point within radius_m metres of the coordinates."""
+    latitude, longitude = float(latitude), float(longitude)
+    angle = math.degrees(radius_m / EARTH_RADIUS_M)
+    south, north = latitude - angle, latitude + angle
+
+    # Near the poles, or across the antimeridian, the circle can span every longitude
+    if south <= -90.0 or north >= 90.0:
+        return max(south, -90.0), -180.0, min(north, 90.0), 180.0
+    longitude_angle = math.degrees(math.asin(min(math.sin(math.radians(angle)) / math.cos(math.radians(latitude)), 1.0)))
+    west, east = longitude - longitude_angle, longitude + longitude_angle
+    if west < -180.0 or east > 180.0:
+        west, east = -180.0, 180.0
+    return south, west, north, east
@@ -0,0 +1,296 @@
+import http.client
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from urllib.parse import urlencode, urlsplit
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import Q
+from django.utils import timezone
+from main import regions, tiles
+from main.gazetteer import load_gazetteer
+from main.models import GeocodeCache, Location, Post
+
+logger = logging.getLogger(__name__)
+
+
+class GeocodingError(Exception):
+    pass
+
+
+class NominatimGeocoder:
+    def __init__(self, url=None, timeout=None, user_agent=None, rate_limiter=None):
+        url = urlsplit(url or settings.GEOCODER_URL)
+        self.connection_class = http.client.HTTPSConnection if url.scheme == "https" else http.client.HTTPConnection
+        self.host = url.netloc
+        self.path = url.path.rstrip("/") + "/reverse"
+        self.timeout = timeout or settings.GEOCODER_TIMEOUT
+        self.user_agent = user_agent or settings.GEOCODER_USER_AGENT
+        self.rate_limiter = rate_limiter
+
+    def reverse(self, latitude, longitude):
+        """Return the place name at the coordinates, or None if there isn't one."""
+        if self.rate_limiter is not None:
+            self.rate_limiter.wait()
+
+        query = urlencode({"lat": latitude, "lon": longitude, "format": "json"})
+        connection = self.connection_class(self.host, timeout=self.timeout)
+        try:
+            # User agent is required so that they don't block us because they don't know what we're doing!
+            connection.request("GET", f"{self.path}?{query}", headers={"User-Agent": self.user_agent})
+            response = connection.getresponse()
+            body = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            raise GeocodingError(f"Geocoder request failed: {e}") from e
+        finally:
+            connection.close()
+
+        if response.status != 200:
+            raise GeocodingError(f"Geocoder responded with HTTP {response.status}")
+
+        try:
+            return json.loads(body).get("display_name")
+        except ValueError as e:
+            raise GeocodingError("Geocoder returned invalid JSON") from e
+
+
+class GazetteerGeocoder:
+    """
+    Offline geocoder that names coordinates after the nearest place in a local GeoNames gazetteer file.
+
+    The file is loaded into a k-d tree on the first lookup and shared by the whole process. Coordinates further
+    than max_distance km from any place get no name.
+    """
+
+    def __init__(self, path=None, max_distance=None):
+        self.path = path or settings.GEOCODER_GAZETTEER_PATH
+        self.max_distance = settings.GEOCODER_GAZETTEER_MAX_DISTANCE if max_distance is None else max_distance
+        if not self.path:
+            raise ImproperlyConfigured("The gazetteer geocoder needs GEOCODER_GAZETTEER_PATH to be set.")
+
+    def reverse(self, latitude, longitude):
+        try:
+            gazetteer = load_gazetteer(self.path)
+        except (OSError, ValueError, IndexError) as e:
+            raise GeocodingError(f"Couldn't load gazetteer {self.path}: {e}") from e
+
+        name, distance = gazetteer.nearest(latitude, longitude)
+        return name if distance <= self.max_distance else None
+
+
+class GeocoderChain:
+    """
+    Tries each geocoder in turn until one finds a place name.
+
+    Failing geocoders are skipped, the error is only raised if no place was found and a geocoder failed, so
+    the lookup can be retried later.
+    """
+
+    def __init__(self, geocoders):
+        self.geocoders = geocoders
+
+    def reverse(self, latitude, longitude):
+        error = None
+        for geocoder in self.geocoders:
+            try:
+                location_name = geocoder.reverse(latitude, longitude)
+            except GeocodingError as e:
+                error = e
+                continue
+            if location_name:
+                return location_name
+
+        if error is not None:
+            raise error
+        return None
+
+
+def build_geocoder(backends=None, url=None, rate_limiter=None):
+    """Build the geocoder for the backends named in settings.GEOCODER_BACKENDS, in the order they are tried."""
+    geocoders = []
+    for backend in settings.GEOCODER_BACKENDS if backends is None else backends:
+        if backend == "nominatim":
+            geocoders.append(NominatimGeocoder(url=url, rate_limiter=rate_limiter))
+        elif backend == "gazetteer":
+            geocoders.append(GazetteerGeocoder())
+        else:
+            raise ImproperlyConfigured(f"Unknown geocoder backend {backend!r}.")
+
+    if not geocoders:
+        raise ImproperlyConfigured("GEOCODER_BACKENDS is empty.")
+    return geocoders[0] if len(geocoders) == 1 else GeocoderChain(geocoders)
+
+
+class RateLimiter:
+    def __init__(self, min_interval):
+        self.min_interval = min_interval
+        self.last_call = None
+
+    def wait(self):
+        if self.last_call is not None:
+            delay = self.last_call + self.min_interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        self.last_call = time.monotonic()
+
+
+class LRUCache:
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.items:
+                return default
+            self.items.move_to_end(key)
+            return self.items[key]
+
+    def set(self, key, value):
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+
+class CachedGeocoder:
+    """
+    Wraps another geocoder with a cache of place names keyed by coordinates rounded to precision decimal places.
+
+    Lookups go through an in-process LRU, then the GeocodeCache table and only then the wrapped geocoder.
+    Entries older than ttl seconds are looked up again. Hits and misses are counted in stats.
+    """
+
+    def __init__(self, geocoder, precision=None, ttl=None, lru_size=None):
+        self.geocoder = geocoder
+        self.precision = settings.GEOCODE_CACHE_PRECISION if precision is None else precision
+        self.ttl = timedelta(seconds=settings.GEOCODE_CACHE_TTL if ttl is None else ttl)
+        self.lru = LRUCache(settings.GEOCODE_CACHE_LRU_SIZE if lru_size is None else lru_size)
+        self.stats = {"memory_hits": 0, "database_hits": 0, "misses": 0}
+
+    def key(self, latitude, longitude):
+        return f"{float(latitude):.{self.precision}f},{float(longitude):.{self.precision}f}"
+
+    def cached(self, latitude, longitude):
+        """Return (found, location_name) from the cache, without calling the wrapped geocoder."""
+        key = self.key(latitude, longitude)
+        now = timezone.now()
+
+        entry = self.lru.get(key)
+        if entry is not None and entry[1] > now:
+            self.stats["memory_hits"] += 1
+            return True, entry[0]
+
+        entry = GeocodeCache.objects.filter(key=key, updated_time__gt=now - self.ttl).first()
+        if entry is not None:
+            self.stats["database_hits"] += 1
+            self.lru.set(key, (entry.location_name, entry.updated_time + self.ttl))
+            return True, entry.location_name
+
+        self.stats["misses"] += 1
+        return False, None
+
+    def reverse(self, latitude, longitude):
+        found, location_name = self.cached(latitude, longitude)
+        if found:
+            return location_name
+
+        location_name = self.geocoder.reverse(latitude, longitude)
+        if location_name:
+            location_name = location_name[: GeocodeCache._meta.get_field("location_name").max_length]
+
+        key = self.key(latitude, longitude)
+        GeocodeCache.objects.update_or_create(key=key, defaults={"location_name": location_name})
+        self.lru.set(key, (location_name, timezone.now() + self.ttl))
+        return location_name
+
+    def hit_rate(self):
+        lookups = sum(self.stats.values())
+        return (self.stats["memory_hits"] + self.stats["database_hits"]) / lookups if lookups else 0.0
+
+
+_default_geocoder = None
+
+
+def default_geocoder():
+    global _default_geocoder
+    if _default_geocoder is None:
+        _default_geocoder = CachedGeocoder(build_geocoder())
+    return _default_geocoder
+
+
+# After this many lookups in a row fail the geocoder is taken to be down, and the rest of the batch is left for later
+MAX_CONSECUTIVE_ERRORS = 3
+
+# A post whose lookup fails is tried again after this long, twice as long after each failure up to the maximum
+LOCATION_RETRY_DELAY = timedelta(minutes=1)
+LOCATION_RETRY_MAX_DELAY = timedelta(days=1)
+
+
+def location_retry_delay(attempts):
+    return min(LOCATION_RETRY_DELAY * 2 ** min(attempts - 1, 20), LOCATION_RETRY_MAX_DELAY)
+
+
+def resolve_pending_locations(geocoder, batch_size=50):
+    """
+    Reverse geocode up to batch_size posts whose location is still pending and return how many were resolved.
+
+    Posts whose lookup fails stay pending and are backed off, so one that always fails doesn't hold up the rest.
+    Stops early if the geocoder seems to be down, the remaining posts stay pending for the next batch.
+    """
+    now = timezone.now()
+    posts = (
+        Post.objects.filter(location_status=Post.LOCATION_PENDING)
+        .filter(Q(location_retry_time__isnull=True) | Q(location_retry_time__lte=now))
+        .order_by("id")[:batch_size]
+    )
+
+    resolved = 0
+    errors = 0
+    for post in posts:
+        try:
+            location_name = geocoder.reverse(post.latitude, post.longitude)
+        except GeocodingError as e:
+            logger.warning("Couldn't geocode post %s: %s", post.pk, e)
+            attempts = post.location_attempts + 1
+            Post.objects.filter(pk=post.pk).update(
+                location_attempts=attempts, location_retry_time=timezone.now() + location_retry_delay(attempts)
+            )
+            errors += 1
+            if errors >= MAX_CONSECUTIVE_ERRORS:
+                break
+            continue
+
+        errors = 0
+        old_location_id = post.location_id
+        post.set_location(location_name)
+        # Lookups can be slow, the post is skipped if a save has moved or located it since it was loaded
+        located = Post.objects.filter(
+            pk=post.pk,
+            latitude=post.latitude,
+            longitude=post.longitude,
+            location_id=old_location_id,
+            location_status=Post.LOCATION_PENDING,
+        ).update(location=post.location, location_name=post.location_name, location_status=post.location_status)
+        if not located:
+            continue
+
+        # update() sends no signals, so what saving the post would have updated is updated here
+        if old_location_id is not None:
+            Location.objects.remove_post(old_location_id, post.latitude, post.longitude)
+        Location.objects.add_post(post.location_id, post.latitude, post.longitude)
+        tiles.invalidate_tiles(post.latitude, post.longitude)
+        regions.bump(post.latitude, post.longitude)
+        resolved += 1
+
+    return resolved
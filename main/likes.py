@@ -0,0 +1,22 @@
+from main.models import Like
+
+
+def liked_post_ids(request, posts):
+    """
+    Return the IDs of the posts in posts that the request's user has liked.
+
+    Posts not seen before in this request are looked up together in one query, and the answers are kept on
+    the request so later listings and tags on the same page don't query for them again.
+    """
+    if request is None or not request.user.is_authenticated:
+        return set()
+
+    known = request.__dict__.setdefault("_liked_posts", {})
+    missing = [post.pk for post in posts if post.pk not in known]
+
+    if missing:
+        liked = set(Like.objects.filter(user__user=request.user, post_id__in=missing).values_list("post_id", flat=True))
+        for post_id in missing:
+            known[post_id] = post_id in liked
+
+    return {post_id for post_id, is_liked in known.items() if is_liked}
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from main import geo
+from main.models import Post
+
+
+class Command(BaseCommand):
+    help = "Fills in the geohash spatial index column for posts that are missing it."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true", help="Recompute the geohash of every post.")
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        posts = Post.objects.only("id", "latitude", "longitude", "geohash").order_by("id")
+        if not options["all"]:
+            posts = posts.filter(geohash="")
+
+        updated = 0
+        last_id = 0
+        while True:
+            # Post.save() is bypassed on purpose, it would reverse geocode every post again
+            batch = list(posts.filter(id__gt=last_id)[: options["batch_size"]])
+            if not batch:
+                break
+
+            for post in batch:
+                post.geohash = geo.encode(post.latitude, post.longitude)
+            Post.objects.bulk_update(batch, ["geohash"])
+
+            updated += len(batch)
+            last_id = batch[-1].id
+
+        self.stdout.write(self.style.SUCCESS(f"Updated the geohash of {updated} posts."))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from main.fake_geocoder import FakeNominatimServer
+
+
+class Command(BaseCommand):
+    help = "Runs a fake Nominatim server so the geocode_posts worker can be run offline."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--port", type=int, default=8080)
+
+    def handle(self, *args, **options):
+        server = FakeNominatimServer(port=options["port"])
+        self.stdout.write(f"Fake geocoder running at {server.url}, use geocode_posts --url {server.url}")
+        try:
+            server.httpd.serve_forever()
+        except KeyboardInterrupt:
+            server.httpd.server_close()
@@ -0,0 +1,51 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from main.geocoding import CachedGeocoder, RateLimiter, build_geocoder, resolve_pending_locations
+
+
+class Command(BaseCommand):
+    help = "Reverse geocodes posts whose location name is still pending."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--daemon", action="store_true", help="Keep running and wait for new posts.")
+        parser.add_argument("--batch-size", type=int, default=50)
+        parser.add_argument(
+            "--interval", type=float, default=10.0, help="Seconds to sleep when there is nothing to geocode."
+        )
+        parser.add_argument(
+            "--min-interval",
+            type=float,
+            default=settings.GEOCODER_MIN_INTERVAL,
+            help="Minimum seconds between geocoder requests.",
+        )
+        parser.add_argument("--url", help="Geocoder URL, defaults to the GEOCODER_URL setting.")
+        parser.add_argument(
+            "--backend",
+            action="append",
+            dest="backends",
+            choices=["nominatim", "gazetteer"],
+            help="Geocoder backend to use, can be repeated to fall back. Defaults to the GEOCODER_BACKENDS setting.",
+        )
+
+    def handle(self, *args, **options):
+        # Only requests that miss the cache are rate limited
+        geocoder = CachedGeocoder(
+            build_geocoder(options["backends"], url=options["url"], rate_limiter=RateLimiter(options["min_interval"]))
+        )
+
+        while True:
+            resolved = resolve_pending_locations(geocoder, options["batch_size"])
+            if resolved:
+                stats = geocoder.stats
+                self.stdout.write(
+                    f"Geocoded {resolved} posts. Cache hit rate {geocoder.hit_rate():.0%} "
+                    f"({stats['memory_hits']} memory, {stats['database_hits']} database, {stats['misses']} misses)."
+                )
+
+            if resolved < options["batch_size"]:
+                if not options["daemon"]:
+                    break
+                # Either everything is geocoded or the geocoder is unavailable, wait before trying again
+                time.sleep(options["interval"])
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from main.models import Like, Post
+
+
+class Command(BaseCommand):
+    help = "Checks the denormalised Post.like_count column against the Like table and rebuilds it."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check", action="store_true", help="Only report posts with a wrong like count, without fixing them."
+        )
+
+    def handle(self, *args, **options):
+        wrong_counts = (
+            Post.objects.annotate(actual_likes=Count("like"))
+            .exclude(like_count=F("actual_likes"))
+            .values_list("id", "like_count", "actual_likes")
+        )
+
+        mismatches = list(wrong_counts)
+        for post_id, like_count, actual_likes in mismatches:
+            self.stdout.write(f"Post {post_id} has like_count {like_count} but {actual_likes} likes.")
+
+        if options["check"]:
+            if mismatches:
+                raise CommandError(f"{len(mismatches)} posts have a wrong like count.")
+            self.stdout.write(self.style.SUCCESS("All like counts are correct."))
+            return
+
+        likes = Like.objects.filter(post=OuterRef("pk")).order_by().values("post").annotate(count=Count("id"))
+        Post.objects.update(like_count=Coalesce(Subquery(likes.values("count")), 0))
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt like counts, {len(mismatches)} were wrong."))
@@ -0,0 +1,73 @@
+import os
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from main import processing, renditions, storage
+from main.models import Post, StoredFile, UserProfile
+
+
+class Command(BaseCommand):
+    help = (
+        "Renders the photos and profile pictures uploaded before renditions were made at upload time, "
+        "processes uploads the worker pool didn't finish and deletes stored files nothing uses."
+    )
+
+    # Uploads still waiting this long after they were made were lost by a worker or by the server stopping
+    STUCK_AFTER = timedelta(minutes=10)
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true", help="Render every photo again, not just unrendered ones.")
+        parser.add_argument("--batch-size", type=int, default=100)
+
+    def handle(self, *args, **options):
+        for model, field in [(Post, "photo"), (UserProfile, "profile_picture")]:
+            self.process_stuck_uploads(model, field)
+
+            objects = model.objects.only("id", field, f"{field}_status").order_by("id")
+            unprocessed = [renditions.STATUS_PROCESSING, renditions.STATUS_FAILED]
+            objects = objects.exclude(**{f"{field}_status__in": unprocessed})
+            if not options["all"]:
+                objects = objects.filter(**{f"{field}_status": renditions.STATUS_ORIGINAL})
+
+            rendered = 0
+            last_id = 0
+            while True:
+                # save() is bypassed, it only processes uploads
+                batch = list(objects.filter(id__gt=last_id)[: options["batch_size"]])
+                if not batch:
+                    break
+
+                for instance in batch:
+                    setattr(instance, f"{field}_status", renditions.render(getattr(instance, field)))
+                    rendered += getattr(instance, f"{field}_status") == renditions.STATUS_RENDERED
+                model.objects.bulk_update(batch, [f"{field}_status"])
+                last_id = batch[-1].id
+
+            self.stdout.write(self.style.SUCCESS(f"Rendered {rendered} {model._meta.verbose_name_plural}."))
+
+        self.delete_unused_content()
+
+    def process_stuck_uploads(self, model, field):
+        uploads = processing.upload_storage()
+        processed = 0
+        for pk, name in model.objects.filter(**{f"{field}_status": renditions.STATUS_PROCESSING}).values_list("id", field):
+            if uploads.exists(name) and uploads.get_modified_time(name) < timezone.now() - self.STUCK_AFTER:
+                processing.finish(model, pk, field, name, processing.process_upload(name))
+                processed += 1
+
+        if processed:
+            self.stdout.write(f"Processed {processed} stuck {model._meta.verbose_name_plural}.")
+
+    def delete_unused_content(self):
+        root = storage.content_storage.path("")
+        deleted = 0
+        for directory, _, file_names in os.walk(os.path.join(root, storage.CONTENT_DIR)):
+            for file_name in file_names:
+                # Temporary files are still being written, see ContentAddressedStorage.save
+                if not file_name.endswith(".tmp"):
+                    name = os.path.relpath(os.path.join(directory, file_name), root).replace(os.sep, "/")
+                    deleted += StoredFile.objects.delete_if_unused(name)
+
+        if deleted:
+            self.stdout.write(f"Deleted {deleted} unused stored files.")
@@ -0,0 +1,128 @@
+import os
+import re
+
+from main import renditions, storage
+
+# Content-addressed files and their renditions never change, see main.storage
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+# Other files are checked again after this long, which costs a 304 if they haven't changed
+MUTABLE_MAX_AGE = 60 * 60
+
+BYTE_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def is_immutable(name):
+    # Renditions are named renditions/<size>/<name of the file they were made from>
+    if name.startswith("renditions/"):
+        name = name.split("/", 2)[-1]
+    return storage.is_content_name(name)
+
+
+def etag(name, stat):
+    """
+    A strong ETag for the media file name. Content-addressed files use the hash in their name, and their renditions
+    that hash with their size and format, since a rendition's variants are sent from the same URL. Other files use
+    their modification time and size.
+    """
+    if storage.is_content_name(name):
+        return '"%s"' % os.path.splitext(os.path.basename(name))[0]
+    if is_immutable(name):
+        _, size, source = name.split("/", 2)
+        root, extension = os.path.splitext(os.path.basename(source))
+        return '"%s-%s-%s"' % (root, size, extension.lstrip("."))
+    return '"%x-%x"' % (stat.st_mtime_ns, stat.st_size)
+
+
+def has_variants(name):
+    return name.startswith("renditions/") and name.endswith(".jpg")
+
+
+def accepted_types(accept):
+    """The media types an Accept header lists by name, leaving out those with q=0."""
+    types = set()
+    for item in accept.split(","):
+        media_type, *parameters = [part.strip() for part in item.split(";")]
+        quality = 1
+        for parameter in parameters:
+            key, _, value = parameter.partition("=")
+            if key.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0
+        if quality > 0:
+            types.add(media_type.lower())
+    return types
+
+
+def candidates(name, accept):
+    """
+    Return the (name, media type) of the files that could be sent for the media file name, best first: the
+    variants of a rendition the Accept header lists, then the file itself with a media type of None.
+
+    Only types listed by name count, browsers that send */* or image/* don't necessarily decode WebP or AVIF.
+    """
+    accepted = accepted_types(accept) if has_variants(name) else set()
+    variants = [
+        (renditions.variant_name(name, extension), media_type)
+        for media_type, extension, _, _ in renditions.VARIANTS
+        if media_type in accepted
+    ]
+    return variants + [(name, None)]
+
+
+class UnsatisfiableRange(ValueError):
+    pass
+
+
+def byte_range(header, size):
+    """
+    Return the (start, end) of the byte range in a Range header for a file of size bytes, end included, or None to
+    send the whole file.
+
+    Requests for several ranges are sent the whole file, which HTTP allows. Raises UnsatisfiableRange if the range
+    starts after the end of the file.
+    """
+    match = BYTE_RANGE.match(header or "")
+    if match is None or match.groups() == ("", ""):
+        return None
+
+    first, last = match.groups()
+    if first == "":
+        # The last bytes of the file
+        if int(last) == 0:
+            raise UnsatisfiableRange(header)
+        return max(size - int(last), 0), size - 1
+
+    start, end = int(first), size - 1 if last == "" else min(int(last), size - 1)
+    if last != "" and int(last) < start:
+        return None
+    if start >= size:
+        raise UnsatisfiableRange(header)
+    return start, end
+
+
+class FileRange:
+    """
+    Reads length bytes of file f from its current position.
+
+    fileno() is passed through, so WSGI servers that send files with sendfile() still can, they send as many bytes
+    as the response's Content-Length from the file's position.
+    """
+
+    def __init__(self, f, length):
+        self.file = f
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,131 @@
+# Generated by Django 2.2.28 on 2026-10-18 16:11
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContactUs',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('email', models.EmailField(max_length=254)),
+                ('subject', models.CharField(max_length=200)),
+                ('message', models.TextField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Group',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('slug', models.SlugField(unique=True)),
+                ('about', models.CharField(blank=True, max_length=100, null=True)),
+                ('created_time', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Post',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slug', models.SlugField(unique=True)),
+                ('slug_uuid', models.UUIDField(default=uuid.uuid4)),
+                ('caption', models.CharField(blank=True, max_length=100, null=True)),
+                ('photo', models.ImageField(upload_to='post_photos/')),
+                ('latitude', models.FloatField()),
+                ('longitude', models.FloatField()),
+                ('created_time', models.DateTimeField(auto_now_add=True)),
+                ('location_name', models.CharField(default='Unknown', editable=False, max_length=100)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='UserProfile',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slug', models.SlugField(unique=True)),
+                ('biography', models.CharField(blank=True, max_length=100, null=True)),
+                ('profile_picture', models.ImageField(default='../static/default.jpg', upload_to='profile_pictures/')),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='created_by', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='UserReport',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('reason', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('reporter', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.UserProfile')),
+                ('user_id', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'User Reports',
+            },
+        ),
+        migrations.CreateModel(
+            name='PostReport',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('reason', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('post_id', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.Post')),
+                ('reporter', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.UserProfile')),
+            ],
+            options={
+                'verbose_name_plural': 'Post Reports',
+            },
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='created_by',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='posts', to='main.UserProfile'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='group',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='posts', to='main.Group'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='liked_by',
+            field=models.ManyToManyField(related_name='liked_posts', to='main.UserProfile'),
+        ),
+        migrations.CreateModel(
+            name='Like',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.Post')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.UserProfile')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='group',
+            name='created_by',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.UserProfile'),
+        ),
+        migrations.AddField(
+            model_name='group',
+            name='members',
+            field=models.ManyToManyField(related_name='groups_members', to='main.UserProfile'),
+        ),
+        migrations.CreateModel(
+            name='Comment',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('comment', models.CharField(max_length=100)),
+                ('created_time', models.DateTimeField(auto_now_add=True)),
+                ('created_by', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.UserProfile')),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='comments', to='main.Post')),
+            ],
+        ),
+    ]
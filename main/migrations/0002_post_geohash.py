@@ -0,0 +1,30 @@
+# Generated by Django 2.2.28 on 2026-10-18 16:14
+
+from django.db import migrations, models
+from main import geo
+
+
+def backfill_geohash(apps, schema_editor):
+    Post = apps.get_model("main", "Post")
+
+    posts = []
+    for post in Post.objects.only("id", "latitude", "longitude").iterator():
+        post.geohash = geo.encode(post.latitude, post.longitude)
+        posts.append(post)
+    Post.objects.bulk_update(posts, ["geohash"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='geohash',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=9),
+        ),
+        migrations.RunPython(backfill_geohash, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 2.2.28 on 2026-10-18 16:52
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_likes(apps, schema_editor):
+    Post = apps.get_model("main", "Post")
+    Like = apps.get_model("main", "Like")
+
+    likes = Like.objects.filter(post=OuterRef("pk")).order_by().values("post").annotate(count=Count("id"))
+    Post.objects.update(like_count=Coalesce(Subquery(likes.values("count")), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0002_post_geohash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='like_count',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.RunPython(count_likes, migrations.RunPython.noop),
+    ]
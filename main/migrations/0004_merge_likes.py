@@ -0,0 +1,47 @@
+# Generated by Django 2.2.28 on 2026-10-18 16:20
+
+from django.db import migrations
+from django.db.models import Count, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def merge_likes(apps, schema_editor):
+    Post = apps.get_model("main", "Post")
+    Like = apps.get_model("main", "Like")
+    LikedBy = Post.liked_by.through
+
+    # Likes that were only recorded through Post.liked_by become Like rows
+    existing = set(Like.objects.values_list("post_id", "user_id"))
+    Like.objects.bulk_create(
+        [
+            Like(post_id=post_id, user_id=user_id)
+            for post_id, user_id in LikedBy.objects.values_list("post_id", "userprofile_id")
+            if (post_id, user_id) not in existing
+        ],
+        batch_size=1000,
+    )
+
+    # Keep the oldest of any duplicated likes
+    duplicates = (
+        Like.objects.values("post_id", "user_id")
+        .annotate(first_id=Min("id"), count=Count("id"))
+        .filter(count__gt=1)
+    )
+    for duplicate in duplicates:
+        Like.objects.filter(post_id=duplicate["post_id"], user_id=duplicate["user_id"]).exclude(
+            id=duplicate["first_id"]
+        ).delete()
+
+    likes = Like.objects.filter(post=OuterRef("pk")).order_by().values("post").annotate(count=Count("id"))
+    Post.objects.update(like_count=Coalesce(Subquery(likes.values("count")), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0003_post_like_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_likes, migrations.RunPython.noop),
+    ]
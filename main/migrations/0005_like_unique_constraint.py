@@ -0,0 +1,21 @@
+# Generated by Django 2.2.28 on 2026-10-18 16:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0004_merge_likes'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='post',
+            name='liked_by',
+        ),
+        migrations.AddConstraint(
+            model_name='like',
+            constraint=models.UniqueConstraint(fields=('post', 'user'), name='unique_like'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 2.2.28 on 2026-10-18 16:24
+
+from django.db import migrations, models
+
+
+def mark_geocoded_posts(apps, schema_editor):
+    Post = apps.get_model("main", "Post")
+
+    # Posts whose name is still the "lat, lon" fallback were never geocoded, they stay pending for the worker
+    resolved = [
+        post.id
+        for post in Post.objects.only("id", "latitude", "longitude", "location_name").iterator()
+        if post.location_name not in ("Unknown", f"{post.latitude}, {post.longitude}")
+    ]
+    for start in range(0, len(resolved), 500):
+        Post.objects.filter(id__in=resolved[start : start + 500]).update(location_status="resolved")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0005_like_unique_constraint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='location_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('resolved', 'Resolved'), ('failed', 'Failed')], db_index=True, default='pending', editable=False, max_length=8),
+        ),
+        migrations.RunPython(mark_geocoded_posts, migrations.RunPython.noop),
+    ]
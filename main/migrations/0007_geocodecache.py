@@ -0,0 +1,22 @@
+# Generated by Django 2.2.28 on 2026-10-18 16:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0006_post_location_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GeocodeCache',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=32, unique=True)),
+                ('location_name', models.CharField(blank=True, max_length=100, null=True)),
+                ('updated_time', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
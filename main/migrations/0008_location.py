@@ -0,0 +1,57 @@
+# Generated by Django 2.2.28 on 2026-10-18 16:31
+
+from django.db import migrations, models
+from django.db.models import Avg, Count, OuterRef, Subquery
+import django.db.models.deletion
+
+
+def create_locations(apps, schema_editor):
+    Location = apps.get_model("main", "Location")
+    Post = apps.get_model("main", "Post")
+
+    # Pending posts don't have a real name yet, the geocode_posts worker gives them a location later
+    located = Post.objects.exclude(location_status="pending")
+    names = located.order_by().values("location_name").annotate(
+        post_count=Count("id"), latitude=Avg("latitude"), longitude=Avg("longitude")
+    )
+    Location.objects.bulk_create(
+        [
+            Location(
+                name=row["location_name"],
+                latitude=row["latitude"],
+                longitude=row["longitude"],
+                post_count=row["post_count"],
+            )
+            for row in names.iterator()
+        ],
+        batch_size=500,
+    )
+
+    locations = Location.objects.filter(name=OuterRef("location_name")).values("id")
+    located.update(location=Subquery(locations[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0007_geocodecache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Location',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('latitude', models.FloatField(default=0)),
+                ('longitude', models.FloatField(default=0)),
+                ('post_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='location',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='posts', to='main.Location'),
+        ),
+        migrations.RunPython(create_locations, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 2.2.28 on 2026-10-18 16:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0008_location'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='post',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['like_count', 'id'], name='post_like_rank'),
+        ),
+    ]
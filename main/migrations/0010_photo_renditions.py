@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0009_post_like_rank_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='photo_status',
+            field=models.CharField(choices=[('original', 'Original only'), ('rendered', 'Rendered')], default='original', editable=False, max_length=8),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='profile_picture_status',
+            field=models.CharField(choices=[('original', 'Original only'), ('rendered', 'Rendered')], default='original', editable=False, max_length=8),
+        ),
+    ]
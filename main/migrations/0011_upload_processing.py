@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0010_photo_renditions'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='post',
+            name='photo_status',
+            field=models.CharField(choices=[('processing', 'Processing'), ('original', 'Original only'), ('rendered', 'Rendered')], default='original', editable=False, max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='userprofile',
+            name='profile_picture_status',
+            field=models.CharField(choices=[('processing', 'Processing'), ('original', 'Original only'), ('rendered', 'Rendered')], default='original', editable=False, max_length=10),
+        ),
+    ]
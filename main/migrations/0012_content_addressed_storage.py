@@ -0,0 +1,32 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:13
+
+from django.db import migrations, models
+import main.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0011_upload_processing'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredFile',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('references', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='photo',
+            field=models.ImageField(storage=main.storage.ContentAddressedStorage(), upload_to='post_photos/'),
+        ),
+        migrations.AlterField(
+            model_name='userprofile',
+            name='profile_picture',
+            field=models.ImageField(default='../static/default.jpg', storage=main.storage.ContentAddressedStorage(), upload_to='profile_pictures/'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0012_content_addressed_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='location_attempts',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='location_retry_time',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
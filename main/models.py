@@ -1,10 +1,10 @@
-from django.db import models
-from django.db.models.signals import post_save
+from django.db import IntegrityError, models, transaction
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
 from django.template.defaultfilters import slugify
+from django.utils import timezone
 from django.contrib.auth.models import User
-import http.client
-import json
+from main import geo, processing, regions, renditions, storage, tiles
 import uuid
 
 
@@ -13,11 +13,37 @@ class UserProfile(models.Model):
 
     slug = models.SlugField(unique=True)
     biography = models.CharField(max_length=100, blank=True, null=True)
-    profile_picture = models.ImageField(upload_to="profile_pictures/", default="../static/default.jpg")
+    profile_picture = models.ImageField(
+        upload_to="profile_pictures/", storage=storage.content_storage, default="../static/default.jpg"
+    )
+    profile_picture_status = models.CharField(
+        max_length=10, choices=renditions.STATUSES, editable=False, default=renditions.STATUS_ORIGINAL
+    )
+
+    _loaded_profile_picture = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        user_profile = super(UserProfile, cls).from_db(db, field_names, values)
+        # Remember the stored file so save() can tell when it's been replaced, see StoredFile
+        user_profile._loaded_profile_picture = user_profile.__dict__.get("profile_picture")
+        return user_profile
+
+    def refresh_from_db(self, using=None, fields=None):
+        super(UserProfile, self).refresh_from_db(using, fields)
+        if fields is None or "profile_picture" in fields:
+            self._loaded_profile_picture = self.profile_picture.name
+
+    def rendition_url(self, size):
+        return renditions.rendition_url(self.profile_picture.name, size, self.profile_picture_status)
 
     def save(self, *args, **kwargs):
         self.slug = slugify(self.user.username)
+        uploaded = processing.stash_if_uploaded(self, "profile_picture")
         super(UserProfile, self).save(*args, **kwargs)
+        self._loaded_profile_picture = self.profile_picture.name
+        if uploaded:
+            processing.process_later(self, "profile_picture")
 
     def __str__(self):
         return self.user.username
@@ -50,49 +76,234 @@ def group_creator_is_owner(instance: Group, **kwargs):
     instance.members.add(instance.created_by)
 
 
+class LocationQuerySet(models.QuerySet):
+    # Counts and centroids are kept up to date with F() updates, so concurrent saves don't overwrite each other
+    def add_post(self, location_id, latitude, longitude):
+        self.filter(pk=location_id).update(
+            latitude=(models.F("latitude") * models.F("post_count") + latitude) / (models.F("post_count") + 1),
+            longitude=(models.F("longitude") * models.F("post_count") + longitude) / (models.F("post_count") + 1),
+            post_count=models.F("post_count") + 1,
+        )
+
+    def remove_post(self, location_id, latitude, longitude):
+        # The last post leaves its centroid behind rather than dividing by zero
+        def without_post(expression, default, output_field):
+            return models.Case(models.When(post_count__gt=1, then=expression), default=default, output_field=output_field)
+
+        self.filter(pk=location_id).update(
+            latitude=without_post(
+                (models.F("latitude") * models.F("post_count") - latitude) / (models.F("post_count") - 1),
+                models.F("latitude"),
+                models.FloatField(),
+            ),
+            longitude=without_post(
+                (models.F("longitude") * models.F("post_count") - longitude) / (models.F("post_count") - 1),
+                models.F("longitude"),
+                models.FloatField(),
+            ),
+            post_count=without_post(models.F("post_count") - 1, models.Value(0), models.PositiveIntegerField()),
+        )
+
+
+class Location(models.Model):
+    name = models.CharField(max_length=100, unique=True)
+
+    # Centroid of the location's posts
+    latitude = models.FloatField(default=0)
+    longitude = models.FloatField(default=0)
+    post_count = models.PositiveIntegerField(default=0)
+
+    objects = LocationQuerySet.as_manager()
+
+    def __str__(self):
+        return self.name
+    class Meta:
+        app_label = 'main'
+
+
+class PostQuerySet(models.QuerySet):
+    def for_listing(self):
+        # Everything post_template.html and post.html show about a post, fetched with the posts themselves
+        return self.select_related("created_by__user", "group", "location")
+
+    @staticmethod
+    def bbox_q(south, west, north, east):
+        south, west, north, east = geo.clamp_bbox(south, west, north, east)
+
+        # Indexed geohash range scans narrow the search down to the cells covering the box,
+        # the exact coordinate checks then trim the edges of those cells
+        cells = models.Q()
+        for low, high in geo.bbox_ranges(south, west, north, east):
+            cell = models.Q(geohash__gte=low)
+            if high is not None:
+                cell &= models.Q(geohash__lt=high)
+            cells |= cell
+
+        return cells & models.Q(
+            latitude__gte=south,
+            latitude__lte=north,
+            longitude__gte=west,
+            longitude__lte=east,
+        )
+
+    def in_bbox(self, south, west, north, east):
+        return self.filter(self.bbox_q(south, west, north, east))
+
+    def in_bboxes(self, boxes):
+        if not boxes:
+            return self.none()
+        q = models.Q()
+        for box in boxes:
+            q |= self.bbox_q(*box)
+        return self.filter(q)
+
+
 class Post(models.Model):
     created_by = models.ForeignKey(UserProfile, on_delete=models.CASCADE, related_name="posts")
-    liked_by = models.ManyToManyField(UserProfile, related_name="liked_posts")
     group = models.ForeignKey(Group, on_delete=models.CASCADE, null=True, blank=True, related_name="posts")
 
     slug = models.SlugField(unique=True)
     slug_uuid = models.UUIDField(default=uuid.uuid4)
     caption = models.CharField(max_length=100, blank=True, null=True)
-    photo = models.ImageField(upload_to="post_photos/")
+    photo = models.ImageField(upload_to="post_photos/", storage=storage.content_storage)
+    photo_status = models.CharField(
+        max_length=10, choices=renditions.STATUSES, editable=False, default=renditions.STATUS_ORIGINAL
+    )
 
     latitude = models.FloatField(blank=False)
     longitude = models.FloatField(blank=False)
 
     created_time = models.DateTimeField(auto_now_add=True)
 
+    LOCATION_PENDING = "pending"
+    LOCATION_RESOLVED = "resolved"
+    LOCATION_FAILED = "failed"
+    LOCATION_STATUSES = (
+        (LOCATION_PENDING, "Pending"),
+        (LOCATION_RESOLVED, "Resolved"),
+        (LOCATION_FAILED, "Failed"),
+    )
+
+    location = models.ForeignKey(
+        Location, on_delete=models.SET_NULL, null=True, blank=True, editable=False, related_name="posts"
+    )
     location_name = models.CharField(max_length=100, editable=False, default="Unknown")
+    location_status = models.CharField(
+        max_length=8, choices=LOCATION_STATUSES, editable=False, db_index=True, default=LOCATION_PENDING
+    )
+    # Failed lookups of a pending location are retried later and later, see main.geocoding
+    location_attempts = models.PositiveSmallIntegerField(editable=False, default=0)
+    location_retry_time = models.DateTimeField(editable=False, null=True, blank=True)
+    geohash = models.CharField(max_length=geo.GEOHASH_PRECISION, editable=False, db_index=True, default="")
+    like_count = models.PositiveIntegerField(editable=False, default=0)
+
+    objects = PostQuerySet.as_manager()
+
+    _loaded_coordinates = None
+    _loaded_location_id = None
+    _loaded_photo = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        post = super(Post, cls).from_db(db, field_names, values)
+        # Remember where the post was loaded from so save() can tell when it has been moved
+        post._loaded_coordinates = (post.__dict__.get("latitude"), post.__dict__.get("longitude"))
+        post._loaded_location_id = post.__dict__.get("location_id")
+        post._loaded_photo = post.__dict__.get("photo")
+        return post
+
+    def refresh_from_db(self, using=None, fields=None):
+        super(Post, self).refresh_from_db(using, fields)
+        if fields is None or {"latitude", "longitude"} <= set(fields):
+            self._loaded_coordinates = (self.latitude, self.longitude)
+        if fields is None or "photo" in fields:
+            self._loaded_photo = self.photo.name
+
+    def set_location(self, location_name):
+        if location_name:
+            self.location_name = location_name[: self._meta.get_field("location_name").max_length]
+            self.location_status = Post.LOCATION_RESOLVED
+        else:
+            self.location_name = f"{self.latitude}, {self.longitude}"
+            self.location_status = Post.LOCATION_FAILED
+        self.location = Location.objects.get_or_create(name=self.location_name)[0]
+
+    def rendition_url(self, size):
+        return renditions.rendition_url(self.photo.name, size, self.photo_status)
 
     def save(self, *args, **kwargs):
         self.slug = slugify(self.slug_uuid)
-
-        # Get a place name from OpenStreetMap API
-        try:
-            conn = http.client.HTTPSConnection("nominatim.openstreetmap.org")
-
-            # User agent is required so that they don't block us because they don't know what we're doing!
-            conn.request(
-                "GET",
-                f"/reverse?lat={self.latitude}&lon={self.longitude}&format=json",
-                headers={"User-Agent": "PhotoGraph/1.0 (University of Glasgow student project)"},
-            )
-
-            response = json.loads(conn.getresponse().read())
-
-            self.location_name = response["display_name"]
-
-            print(response)
-        except Exception as e:
-            print(e)
-            self.location_name = f"{self.latitude}, {self.longitude}"
+        self.geohash = geo.encode(self.latitude, self.longitude)
+        uploaded = processing.stash_if_uploaded(self, "photo")
+
+        # like_count is only changed through F() updates, saving a stale copy of it would lose likes
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            kwargs["update_fields"] = [
+                field.name for field in self._meta.concrete_fields if not field.primary_key and field.name != "like_count"
+            ]
+
+        # New and moved posts are reverse geocoded later by the geocode_posts worker, see main.geocoding,
+        # unless the place name is already cached
+        if self._state.adding or self._loaded_coordinates != (self.latitude, self.longitude):
+            from main.geocoding import default_geocoder
+
+            found, location_name = default_geocoder().cached(self.latitude, self.longitude)
+            if found:
+                self.set_location(location_name)
+            else:
+                self.location_status = Post.LOCATION_PENDING
+                self.location_attempts = 0
+                self.location_retry_time = None
+                # Moved away from the location it was saved with, unless it has been given a new one
+                if self.location_id is not None and self.location_id == self._loaded_location_id:
+                    self.location = None
+                    self.location_name = self._meta.get_field("location_name").default
 
         super(Post, self).save(*args, **kwargs)
+        self._loaded_coordinates = (self.latitude, self.longitude)
+        self._loaded_location_id = self.location_id
+        self._loaded_photo = self.photo.name
+        if uploaded:
+            processing.process_later(self, "photo")
     class Meta:
         app_label = 'main'
+        indexes = [
+            # Most liked posts first, and keyset pagination through them, see main.cursors
+            models.Index(fields=["like_count", "id"], name="post_like_rank"),
+        ]
+
+@receiver(pre_save, sender=Post)
+def post_moved_invalidates_tiles(instance: Post, **kwargs):
+    # Posts not loaded from the database, or loaded without their coordinates, have no old position to clear
+    old_coordinates = instance._loaded_coordinates
+    if old_coordinates is None or None in old_coordinates:
+        return
+    if old_coordinates != (instance.latitude, instance.longitude):
+        tiles.invalidate_tiles(*old_coordinates)
+        regions.bump(*old_coordinates)
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def post_changed_invalidates_tiles(instance: Post, **kwargs):
+    tiles.invalidate_tiles(instance.latitude, instance.longitude)
+    regions.bump(instance.latitude, instance.longitude)
+
+@receiver(post_save, sender=Post)
+def post_located_counts_post(instance: Post, **kwargs):
+    # Runs before save() updates the loaded location and coordinates, so they still describe the saved row
+    old_coordinates = instance._loaded_coordinates
+    new_coordinates = (instance.latitude, instance.longitude)
+    if (instance._loaded_location_id, old_coordinates) == (instance.location_id, new_coordinates):
+        return
+    if instance._loaded_location_id is not None:
+        Location.objects.remove_post(instance._loaded_location_id, *old_coordinates)
+    if instance.location_id is not None:
+        Location.objects.add_post(instance.location_id, *new_coordinates)
+
+@receiver(post_delete, sender=Post)
+def post_removed_counts_post(instance: Post, **kwargs):
+    if instance._loaded_location_id is not None:
+        Location.objects.remove_post(instance._loaded_location_id, *instance._loaded_coordinates)
 
 class Comment(models.Model):
     created_by = models.ForeignKey(UserProfile, on_delete=models.CASCADE)
@@ -127,14 +338,144 @@ class UserReport(models.Model):
         verbose_name_plural = "User Reports"
         app_label = 'main'
 
+class LikeQuerySet(models.QuerySet):
+    def toggle(self, post, user_profile):
+        # Delete-or-insert against the unique (post, user) constraint, so concurrent toggles can never
+        # leave duplicate likes behind. Returns whether the user now likes the post.
+        # The like count follows the rows this request actually deleted or inserted. The Like signals are bypassed,
+        # post_delete is sent even for a like another request has already deleted.
+        with transaction.atomic():
+            unliked = self.filter(post=post, user=user_profile)._raw_delete(self.db)
+            if unliked:
+                liked, change = False, -unliked
+            else:
+                try:
+                    with transaction.atomic():
+                        self.bulk_create([self.model(post=post, user=user_profile)])
+                except IntegrityError:
+                    # Another request liked the post between our delete and insert
+                    return True
+                liked, change = True, 1
+            Post.objects.filter(pk=post.pk).update(like_count=models.F("like_count") + change)
+        regions.bump_geohash(post.geohash)
+        return liked
+
+
 class Like(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE)
     user = models.ForeignKey(UserProfile, on_delete=models.CASCADE)
 
+    objects = LikeQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.user} likes {self.post.slug}"
     class Meta:
         app_label = 'main'
+        constraints = [
+            models.UniqueConstraint(fields=["post", "user"], name="unique_like"),
+        ]
+
+# Likes added and removed outside LikeQuerySet.toggle, in the admin or deleted with their user, are counted here
+@receiver(post_save, sender=Like)
+def like_added_counts_like(instance: Like, created, **kwargs):
+    if created:
+        Post.objects.filter(pk=instance.post_id).update(like_count=models.F("like_count") + 1)
+
+@receiver(post_delete, sender=Like)
+def like_removed_counts_like(instance: Like, **kwargs):
+    Post.objects.filter(pk=instance.post_id).update(like_count=models.F("like_count") - 1)
+
+@receiver(post_save, sender=Like)
+@receiver(post_delete, sender=Like)
+def like_changed_bumps_region(instance: Like, **kwargs):
+    # Tiles aren't dropped for likes, their like counts can be up to TILE_CACHE_TIMEOUT old. The posts JSON is
+    # revalidated by region version, so it has to change, found from the post's geohash without loading the post.
+    if Like.post.is_cached(instance):
+        geohash = instance.post.geohash
+    else:
+        geohash = Post.objects.filter(pk=instance.post_id).values_list("geohash", flat=True).first()
+    if geohash:
+        regions.bump_geohash(geohash)
+
+class GeocodeCache(models.Model):
+    # Coordinates rounded to settings.GEOCODE_CACHE_PRECISION decimal places, e.g. "55.8724,-4.2900"
+    key = models.CharField(max_length=32, unique=True)
+    location_name = models.CharField(max_length=100, null=True, blank=True)
+    updated_time = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.key}: {self.location_name}"
+    class Meta:
+        app_label = 'main'
+
+class StoredFileQuerySet(models.QuerySet):
+    def acquire(self, name):
+        # Counted up in place, since release() may delete the row of a file that has just stopped being used. If
+        # there's no row to count up one is made, unless another save made it first, then that's counted up.
+        while not self.filter(name=name).update(references=models.F("references") + 1):
+            try:
+                with transaction.atomic():
+                    self.create(name=name, references=1)
+                return
+            except IntegrityError:
+                pass
+
+    def release(self, name):
+        self.filter(name=name, references__gt=0).update(references=models.F("references") - 1)
+        # Whoever takes the count to zero deletes the file, once the deletion of its last user is committed
+        if self.filter(name=name, references=0).delete()[0]:
+            transaction.on_commit(lambda: self.delete_if_unused(name))
+
+    def delete_if_unused(self, name):
+        """
+        Delete the stored file name and its renditions if nothing uses it, and return whether it was deleted.
+
+        Files saved within storage.UNUSED_CONTENT_GRACE are kept, an identical upload being processed may be about
+        to use them. 'manage.py render_photos' deletes them once they're older.
+        """
+        if self.filter(name=name).exists():
+            return False
+        content = storage.content_storage
+        if content.exists(name) and content.get_modified_time(name) > timezone.now() - storage.UNUSED_CONTENT_GRACE:
+            return False
+        storage.delete_content(name)
+        return True
+
+
+class StoredFile(models.Model):
+    """How many posts and profiles use each file in main.storage.content_storage, which identical uploads share."""
+
+    name = models.CharField(max_length=100, unique=True)
+    references = models.PositiveIntegerField(default=0)
+
+    objects = StoredFileQuerySet.as_manager()
+
+    def __str__(self):
+        return f"{self.name} ({self.references})"
+    class Meta:
+        app_label = 'main'
+
+STORED_FILE_FIELDS = {Post: "photo", UserProfile: "profile_picture"}
+
+@receiver(post_save, sender=Post)
+@receiver(post_save, sender=UserProfile)
+def stored_file_replaced_counts_reference(sender, instance, **kwargs):
+    # Runs before save() updates the loaded file, so it still names the one that was saved before
+    field_name = STORED_FILE_FIELDS[sender]
+    old_name, new_name = getattr(instance, f"_loaded_{field_name}"), getattr(instance, field_name).name
+    if old_name == new_name:
+        return
+    if storage.is_content_name(new_name):
+        StoredFile.objects.acquire(new_name)
+    if storage.is_content_name(old_name):
+        StoredFile.objects.release(old_name)
+
+@receiver(post_delete, sender=Post)
+@receiver(post_delete, sender=UserProfile)
+def stored_file_released(sender, instance, **kwargs):
+    old_name = getattr(instance, f"_loaded_{STORED_FILE_FIELDS[sender]}")
+    if storage.is_content_name(old_name):
+        StoredFile.objects.release(old_name)
 
 class ContactUs(models.Model):
     name = models.CharField(max_length = 100)
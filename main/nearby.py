@@ -0,0 +1,103 @@
+import math
+
+from django.core.cache import cache
+from main import geo, regions
+from main.models import Post
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Below this many candidates converting them to NumPy arrays costs more than it saves
+NUMPY_MIN_CANDIDATES = 1000
+
+NEARBY_COUNT = 6
+
+# The nearest posts are searched for in growing circles, starting small since most posts are in busy areas
+NEARBY_START_RADIUS_M = 500
+NEARBY_MAX_RADIUS_M = 200000
+
+NEARBY_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def distances_m(latitude, longitude, latitudes, longitudes):
+    """Haversine distances in metres from the coordinates to each of latitudes/longitudes."""
+    if numpy is not None and len(latitudes) >= NUMPY_MIN_CANDIDATES:
+        latitudes = numpy.radians(numpy.asarray(latitudes, dtype=float))
+        longitudes = numpy.radians(numpy.asarray(longitudes, dtype=float))
+        latitude, longitude = math.radians(latitude), math.radians(longitude)
+        a = (
+            numpy.sin((latitudes - latitude) / 2) ** 2
+            + math.cos(latitude) * numpy.cos(latitudes) * numpy.sin((longitudes - longitude) / 2) ** 2
+        )
+        return (2 * geo.EARTH_RADIUS_M * numpy.arcsin(numpy.minimum(numpy.sqrt(a), 1.0))).tolist()
+
+    return [geo.haversine_m(latitude, longitude, lat, lon) for lat, lon in zip(latitudes, longitudes)]
+
+
+def posts_within_radius(latitude, longitude, radius_m, posts=None):
+    """
+    Return (post id, distance in metres) for every post within radius_m metres of the coordinates, nearest first.
+
+    The geohash index narrows the search down to the circle's bounding box, only the coordinates of the posts in
+    the box are fetched and their exact distances worked out here.
+    """
+    posts = Post.objects.all() if posts is None else posts
+    candidates = list(
+        posts.in_bbox(*geo.radius_bbox(latitude, longitude, radius_m)).values_list("id", "latitude", "longitude")
+    )
+    if not candidates:
+        return []
+
+    ids, latitudes, longitudes = zip(*candidates)
+    distances = distances_m(float(latitude), float(longitude), latitudes, longitudes)
+    return sorted(
+        ((post_id, distance) for post_id, distance in zip(ids, distances) if distance <= radius_m),
+        key=lambda match: (match[1], match[0]),
+    )
+
+
+def load_posts(matches):
+    """Fetch the posts for (post id, distance) pairs for listing, in the same order with their distance set."""
+    posts = Post.objects.for_listing().in_bulk([post_id for post_id, _ in matches])
+    result = []
+    for post_id, distance in matches:
+        if post_id in posts:
+            post = posts[post_id]
+            post.distance = distance
+            result.append(post)
+    return result
+
+
+def nearest_posts(latitude, longitude, count, posts=None):
+    """
+    Return (matches, radius) for the count posts nearest to the coordinates, matches as in posts_within_radius.
+
+    Every post within the returned radius was considered, so a post only gets nearer than the last match if one
+    is added inside that circle. Posts further than NEARBY_MAX_RADIUS_M away aren't found.
+    """
+    radius_m = NEARBY_START_RADIUS_M
+    while True:
+        matches = posts_within_radius(latitude, longitude, radius_m, posts)
+        if len(matches) >= count or radius_m >= NEARBY_MAX_RADIUS_M:
+            return matches[:count], radius_m
+        radius_m = min(radius_m * 4, NEARBY_MAX_RADIUS_M)
+
+
+def nearby_posts(post, count=NEARBY_COUNT):
+    """
+    The count posts nearest to post, for listing, with their distance set.
+
+    Results are cached per post along with the versions of the regions the search covered, so they are
+    recomputed as soon as a post is added, moved or deleted in that area.
+    """
+    key = f"nearby-posts:{post.pk}:{post.geohash}:{count}"
+    entry = cache.get(key)
+    if entry is None or regions.versions(entry["cells"]) != entry["versions"]:
+        matches, radius_m = nearest_posts(post.latitude, post.longitude, count, Post.objects.exclude(pk=post.pk))
+        cells = regions.region_cells(*geo.radius_bbox(post.latitude, post.longitude, radius_m))
+        entry = {"matches": matches, "cells": cells, "versions": regions.versions(cells)}
+        cache.set(key, entry, NEARBY_CACHE_TIMEOUT)
+
+    return load_posts(entry["matches"])
@@ -0,0 +1,152 @@
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+import django
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db import close_old_connections, connection, transaction
+from PIL import Image, ImageOps
+from main import renditions, storage
+
+# The full size public copy is re-encoded too, at a quality close enough to the upload's to look the same
+PUBLIC_JPEG_QUALITY = 95
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def upload_storage():
+    # Uploads wait here, outside MEDIA_ROOT, so they're never served with their metadata
+    return FileSystemStorage(location=settings.UPLOAD_PROCESSING_DIR)
+
+
+def pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Workers started with spawn rather than fork need Django setting up again
+            _pool = ProcessPoolExecutor(settings.UPLOAD_PROCESSING_WORKERS, initializer=django.setup)
+        return _pool
+
+
+def reset_pool(broken):
+    """Shut down the pool broken, which can't be used again once a worker has died, so pool() starts another."""
+    global _pool
+    with _pool_lock:
+        if _pool is broken:
+            _pool = None
+    broken.shutdown(wait=False)
+
+
+def stash_upload(field_file):
+    """Save a new upload for processing, its public copy is named after its contents, see main.storage."""
+    name = field_file.field.generate_filename(field_file.instance, field_file.name)
+    field_file.name = upload_storage().save(name, field_file.file)
+    field_file._committed = True
+
+
+def stash_if_uploaded(instance, field_name):
+    """
+    Stash instance.field_name for processing if it's a new upload, and return whether it was. Call process_later()
+    once instance is saved.
+
+    Files set by name rather than uploaded are shown as they are.
+    """
+    field_file = getattr(instance, field_name)
+    if not field_file or field_file._committed:
+        return False
+    stash_upload(field_file)
+    setattr(instance, f"{field_name}_status", renditions.STATUS_PROCESSING)
+    return True
+
+
+def process_upload(name):
+    """
+    Make the public copy of the stashed upload name and its renditions, and return (public name, status).
+
+    Runs in a worker process. The public copy is turned the way up its EXIF orientation says and saved without any
+    metadata, so the location it was taken at isn't given away. Files Pillow can't decode are never published, they
+    can't have their metadata removed, and are kept where they were stashed with a status of failed.
+    """
+    uploads = upload_storage()
+    try:
+        with uploads.open(name) as f:
+            image = Image.open(f)
+            image_format = image.format
+            image = ImageOps.exif_transpose(image)
+    except renditions.DECODE_ERRORS:
+        return name, renditions.STATUS_FAILED
+
+    buffer = BytesIO()
+    image.save(buffer, image_format, quality=PUBLIC_JPEG_QUALITY, icc_profile=image.info.get("icc_profile"))
+    public_name = storage.content_storage.save(name, ContentFile(buffer.getvalue()))
+    # Identical uploads share their public copy, and so their renditions
+    if not all(default_storage.exists(renditions.rendition_name(public_name, size)) for size in renditions.RENDITIONS):
+        renditions.save_renditions(default_storage, public_name, image.convert("RGB"))
+
+    uploads.delete(name)
+    return public_name, renditions.STATUS_RENDERED
+
+
+def finish(model, pk, field_name, name, result):
+    public_name, status = result
+    # Skipped if the object was deleted, or given another upload, while this one was being processed. Its public
+    # copy is deleted by 'manage.py render_photos' if nothing else uses it, see StoredFile.objects.delete_if_unused
+    instance = model.objects.filter(pk=pk, **{field_name: name}).first()
+    if instance is not None:
+        getattr(instance, field_name).name = public_name
+        setattr(instance, f"{field_name}_status", status)
+        instance.save(update_fields=[field_name, f"{field_name}_status"])
+
+
+def process_later(instance, field_name):
+    """
+    Process the upload stashed in instance.field_name once the transaction saving it commits.
+
+    It's processed by a pool of UPLOAD_PROCESSING_WORKERS processes, so requests don't wait for it and large images
+    don't hold up the server, or in the committing thread if that's 0.
+    """
+    model, pk, name = type(instance), instance.pk, getattr(instance, field_name).name
+
+    def done(future, executor, retries):
+        exception = future.exception()
+        if isinstance(exception, BrokenProcessPool) and retries:
+            # A worker died, not necessarily with this upload, and took the pool with it
+            reset_pool(executor)
+            submit(retries - 1)
+            return
+
+        # Runs in a thread of the pool rather than a request, which has to look after its own database connection
+        close_old_connections()
+        try:
+            if exception is None:
+                result = future.result()
+            else:
+                # Kept private, the upload still has its metadata
+                logger.error("Processing upload %s failed", name, exc_info=exception)
+                result = name, renditions.STATUS_FAILED
+            finish(model, pk, field_name, name, result)
+        finally:
+            connection.close()
+
+    def submit(retries=1):
+        if not settings.UPLOAD_PROCESSING_WORKERS:
+            finish(model, pk, field_name, name, process_upload(name))
+            return
+
+        executor = pool()
+        try:
+            future = executor.submit(process_upload, name)
+        except BrokenProcessPool:
+            reset_pool(executor)
+            executor = pool()
+            future = executor.submit(process_upload, name)
+        future.add_done_callback(lambda future: done(future, executor, retries))
+
+    transaction.on_commit(submit)
@@ -0,0 +1,47 @@
+import uuid
+
+from django.core.cache import cache
+from main import geo
+
+# Every post change gives the geohash cells containing it a new version, at each of these precisions, so anything
+# cached about an area can tell whether it is still current. Precision 6 cells are about 1km across.
+MIN_REGION_PRECISION = 1
+MAX_REGION_PRECISION = 6
+
+# Areas are described by at most this many cells, coarser cells are used for larger areas
+MAX_REGION_CELLS = 8
+
+
+def version_key(geohash):
+    return f"region-version:{geohash}"
+
+
+def region_cells(south, west, north, east):
+    return geo.bbox_geohashes(south, west, north, east, MAX_REGION_CELLS, MAX_REGION_PRECISION)
+
+
+def bump(latitude, longitude):
+    bump_geohash(geo.encode(latitude, longitude, MAX_REGION_PRECISION))
+
+
+def bump_geohash(geohash):
+    """Give the cells containing the point geohash, at least MAX_REGION_PRECISION characters long, new versions."""
+    cache.set_many(
+        {
+            version_key(geohash[:precision]): uuid.uuid4().hex
+            for precision in range(MIN_REGION_PRECISION, MAX_REGION_PRECISION + 1)
+        },
+        None,
+    )
+
+
+def versions(cells):
+    """Return the current versions of cells, in the same order."""
+    keys = [version_key(cell) for cell in cells]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            # A version that was evicted must not come back as a value something was already cached with
+            cache.add(key, uuid.uuid4().hex, None)
+            found[key] = cache.get(key)
+    return [found[key] for key in keys]
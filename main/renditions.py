@@ -0,0 +1,149 @@
+import math
+import os
+from io import BytesIO
+
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.templatetags.static import static
+from PIL import ExifTags, Image, ImageOps
+
+try:
+    # Adds AVIF to Pillow older than 11.2
+    import pillow_avif  # noqa: F401
+except ImportError:
+    pass
+
+# Longest side of each rendition in pixels, twice the size it's shown at so it stays sharp on high density screens
+RENDITIONS = {
+    "icon": 140,  # Map markers
+    "card": 500,  # Post cards and map popups
+    "full": 1600,  # The post page and profile pictures
+}
+JPEG_QUALITY = 85
+
+# Smaller encodings saved next to each rendition's JPEG, sent in its place to browsers whose Accept header lists
+# them, most preferred first. Formats this Pillow can't encode are skipped, AVIF needs Pillow 11.2 or
+# pillow-avif-plugin.
+VARIANTS = [
+    ("image/avif", ".avif", "AVIF", {"quality": 60}),
+    ("image/webp", ".webp", "WEBP", {"quality": 80, "method": 4}),
+]
+
+STATUS_PROCESSING = "processing"
+STATUS_ORIGINAL = "original"
+STATUS_RENDERED = "rendered"
+STATUS_FAILED = "failed"
+STATUSES = (
+    (STATUS_PROCESSING, "Processing"),
+    (STATUS_ORIGINAL, "Original only"),
+    (STATUS_RENDERED, "Rendered"),
+    (STATUS_FAILED, "Failed"),
+)
+
+# Shown in place of uploads that are still being processed, or that couldn't be, see main.processing
+PROCESSING_PLACEHOLDER = "processing.svg"
+FAILED_PLACEHOLDER = "failed.svg"
+
+
+def rendition_name(name, size):
+    root = os.path.splitext(name)[0]
+    return f"renditions/{size}/{root}.jpg"
+
+
+def variant_name(rendition, extension):
+    return os.path.splitext(rendition)[0] + extension
+
+
+def encodable_variants():
+    Image.init()
+    return [variant for variant in VARIANTS if variant[2] in Image.SAVE]
+
+
+def rendition_file(name, size, status):
+    """
+    The size rendition of the stored file name, the file itself if it hasn't been rendered, or None while it's
+    being processed or if processing it failed.
+    """
+    if status in (STATUS_PROCESSING, STATUS_FAILED):
+        return None
+    return rendition_name(name, size) if status == STATUS_RENDERED else name
+
+
+def rendition_url(name, size, status):
+    if status == STATUS_PROCESSING:
+        return static(PROCESSING_PLACEHOLDER)
+    if status == STATUS_FAILED:
+        return static(FAILED_PLACEHOLDER)
+    return default_storage.url(rendition_file(name, size, status))
+
+
+# Raised by open_scaled for files that aren't images Pillow can decode
+DECODE_ERRORS = (OSError, ValueError, Image.DecompressionBombError)
+
+
+def open_scaled(f, width, height):
+    """
+    Decode the image in file f as RGB, at no less than the size it would be scaled to to fit in width x height, and
+    turn it the way up its EXIF orientation says.
+
+    JPEGs are decoded in draft mode, which lets the decoder scale down by up to 8x as it goes rather than decoding
+    every pixel.
+    """
+    image = Image.open(f)
+    if image.getexif().get(ExifTags.Base.Orientation) in (5, 6, 7, 8):
+        # Turned on its side once decoded
+        width, height = height, width
+    # Draft mode only scales down while both sides stay at least the requested size
+    scale = min(width / image.width, height / image.height, 1)
+    image.draft("RGB", (math.ceil(image.width * scale), math.ceil(image.height * scale)))
+    return ImageOps.exif_transpose(image.convert("RGB"))
+
+
+def encode(image, image_format, **options):
+    buffer = BytesIO()
+    image.save(buffer, image_format, **options)
+    return buffer.getvalue()
+
+
+def encode_jpeg(image):
+    return encode(image, "JPEG", quality=JPEG_QUALITY, optimize=True)
+
+
+def render(field_file):
+    """
+    Save a JPEG of the image in field_file at every size in RENDITIONS and return the file's new status.
+
+    The image is decoded once at the largest size, each smaller size is scaled down from the one above it.
+    """
+    largest = max(RENDITIONS.values())
+    try:
+        with field_file.storage.open(field_file.name) as f:
+            image = open_scaled(f, largest, largest)
+    except DECODE_ERRORS + (SuspiciousFileOperation,):
+        return STATUS_ORIGINAL
+
+    save_renditions(default_storage, field_file.name, image)
+    return STATUS_RENDERED
+
+
+def save_renditions(storage, name, image):
+    """Save the RGB image at every size in RENDITIONS and its VARIANTS, each size scaled down from the one above it."""
+    variants = encodable_variants()
+    for size, pixels in sorted(RENDITIONS.items(), key=lambda item: item[1], reverse=True):
+        image.thumbnail((pixels, pixels), Image.LANCZOS)
+
+        rendition = rendition_name(name, size)
+        storage.delete(rendition)
+        storage.save(rendition, ContentFile(encode_jpeg(image)))
+        for _, extension, image_format, options in variants:
+            storage.delete(variant_name(rendition, extension))
+            storage.save(variant_name(rendition, extension), ContentFile(encode(image, image_format, **options)))
+
+
+def delete_renditions(storage, name):
+    for size in RENDITIONS:
+        rendition = rendition_name(name, size)
+        storage.delete(rendition)
+        for _, extension, _, _ in VARIANTS:
+            storage.delete(variant_name(rendition, extension))
@@ -0,0 +1,166 @@
+import os
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.utils._os import safe_join
+from PIL import Image
+from main import renditions
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+# Raised by resized() for names that aren't images in media storage
+RESIZE_ERRORS = renditions.DECODE_ERRORS + (SuspiciousFileOperation,)
+
+# Windows can't wait for a lock, it's tried again this often
+LOCK_POLL_INTERVAL = 0.05
+
+# The cache's size is counted in the shared cache as images are added, it's only walked to delete images once it's
+# over RESIZED_MEDIA_CACHE_MAX_BYTES, and then cut down to this fraction of it so that doesn't happen on every miss
+CACHE_SIZE_KEY = "resized-media-cache-bytes"
+EVICT_TO = 0.9
+EVICTING_KEY = "resized-media-cache-evicting"
+# Long enough for an eviction to finish, the flag is cleared after this if its process died part way through
+EVICTING_TIMEOUT = 30
+
+
+def cache_path(width, height, name):
+    # safe_join stops names containing .. from reaching outside the cache
+    return safe_join(settings.RESIZED_MEDIA_CACHE_DIR, f"{width}x{height}", name)
+
+
+def touch(path):
+    # The cache is least recently used first, going by modification time
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+@contextmanager
+def lock(path):
+    """
+    Hold a lock on path across threads and processes.
+
+    The lock is taken on a lock file with flock(), or msvcrt.locking() on Windows, which the OS lets go of if the
+    process holding it dies, so a lock is never left behind. Lock files are kept, one deleted while it's waited on
+    would let a process lock a file the others can no longer open.
+    """
+    lock_path = path + ".lock"
+    os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+    with open(lock_path, "wb") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+                    break
+                except OSError:
+                    time.sleep(LOCK_POLL_INTERVAL)
+
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def open_cached(path):
+    # An open file can still be read once it's evicted
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return None
+    touch(path)
+    return f
+
+
+def open_resized(width, height, name):
+    """
+    Return an open JPEG of the media file name scaled down to fit in width x height.
+
+    It's made the first time it's asked for and cached on disk. Requests for an image that's already being made
+    wait for it rather than making it again.
+    """
+    if not default_storage.exists(name):
+        raise FileNotFoundError(name)
+
+    path = cache_path(width, height, name)
+    f = open_cached(path)
+    if f is not None:
+        return f
+
+    with lock(path):
+        f = open_cached(path)
+        if f is not None:
+            return f
+
+        with default_storage.open(name) as source:
+            image = renditions.open_scaled(source, width, height)
+        image.thumbnail((width, height), Image.LANCZOS)
+        data = renditions.encode_jpeg(image)
+
+        # Written under another name first so the file is never seen half written
+        with open(path + ".tmp", "wb") as tmp:
+            tmp.write(data)
+        os.replace(path + ".tmp", path)
+        f = open(path, "rb")
+
+    added(len(data))
+    return f
+
+
+def added(size):
+    # Counts can be lost by concurrent increments or cache evictions, each eviction counts the cache again
+    try:
+        total = cache.incr(CACHE_SIZE_KEY, size)
+    except ValueError:
+        total = None
+    if total is None or total > settings.RESIZED_MEDIA_CACHE_MAX_BYTES:
+        # One process evicts at a time, the others carry on
+        if cache.add(EVICTING_KEY, True, EVICTING_TIMEOUT):
+            try:
+                evict(int(settings.RESIZED_MEDIA_CACHE_MAX_BYTES * EVICT_TO))
+            finally:
+                cache.delete(EVICTING_KEY)
+
+
+def evict(max_bytes):
+    """Delete the least recently used images until the cache is no bigger than max_bytes."""
+    files = []
+    for directory, _, names in os.walk(settings.RESIZED_MEDIA_CACHE_DIR):
+        for name in names:
+            if name.endswith((".lock", ".tmp")):
+                continue
+            path = os.path.join(directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            # On Windows, still open for a response
+            continue
+        total -= size
+    cache.set(CACHE_SIZE_KEY, total, None)
@@ -0,0 +1,70 @@
+import hashlib
+import os
+import uuid
+from datetime import timedelta
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.utils.deconstruct import deconstructible
+from main import renditions
+
+CONTENT_DIR = "content"
+
+# Unused files are kept for this long after they were last saved, see StoredFile.objects.delete_if_unused
+UNUSED_CONTENT_GRACE = timedelta(minutes=10)
+
+
+def content_name(digest, extension):
+    # Two levels of directories named after the start of the hash, 65536 in all, so none of them gets too big
+    return f"{CONTENT_DIR}/{digest[:2]}/{digest[2:4]}/{digest}{extension}"
+
+
+def is_content_name(name):
+    return bool(name) and name.startswith(CONTENT_DIR + "/")
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    A FileSystemStorage that names files after the SHA-256 of their contents rather than the name they're saved
+    with, keeping only its extension.
+
+    Saving a file that's already stored returns the stored file's name without writing anything, so identical
+    uploads are stored once. Files are shared, see StoredFile for how many objects use each.
+    """
+
+    def save(self, name, content, max_length=None):
+        if not hasattr(content, "chunks"):
+            content = File(content, name)
+
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        name = content_name(digest.hexdigest(), os.path.splitext(name)[1].lower())
+        try:
+            # Touched so it isn't deleted as unused before whatever saved it starts using it
+            os.utime(self.path(name))
+            return name
+        except FileNotFoundError:
+            pass
+
+        # Written under another name first, a concurrent save of the same file replaces it with the same bytes
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temporary_path, "wb") as f:
+            for chunk in content.chunks():
+                f.write(chunk)
+        if self.file_permissions_mode is not None:
+            os.chmod(temporary_path, self.file_permissions_mode)
+        os.replace(temporary_path, path)
+        return name
+
+
+content_storage = ContentAddressedStorage()
+
+
+def delete_content(name):
+    """Delete a stored file that's no longer used, and its renditions."""
+    content_storage.delete(name)
+    renditions.delete_renditions(default_storage, name)
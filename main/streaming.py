@@ -0,0 +1,86 @@
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.urls import reverse
+from main import cursors, renditions
+
+# Only the columns the map needs, fetched as plain dicts rather than Post instances
+POST_FIELDS = (
+    "id",
+    "slug",
+    "latitude",
+    "longitude",
+    "caption",
+    "photo",
+    "photo_status",
+    "like_count",
+    "created_time",
+    "created_by__slug",
+    "location_name",
+    "location__name",
+)
+
+# Rows fetched from the database and posts written to the response at a time
+CHUNK_SIZE = 500
+
+
+class PostURLs:
+    """Builds post, user and location URLs from templates reversed once, rather than reverse() for every post."""
+
+    def __init__(self):
+        self.view_post = reverse("main:view_post", args=["USER-SLUG", "POST-SLUG"])
+        self.user_profile = reverse("main:show_user_profile", args=["USER-SLUG"])
+        self.location = reverse("main:show_location") + "?location_name="
+
+    def post_json(self, row):
+        # Same fields as views.post_json()
+        location_name = row["location__name"] if row["location__name"] is not None else row["location_name"]
+        user_slug = row["created_by__slug"]
+        return {
+            "lat": row["latitude"],
+            "lon": row["longitude"],
+            "user_name": user_slug,
+            "location_name": location_name,
+            "location_url": self.location + location_name,
+            "likes": row["like_count"],
+            "date": row["created_time"],
+            "caption": row["caption"],
+            "photo_url": renditions.rendition_url(row["photo"], "card", row["photo_status"]),
+            "icon_url": renditions.rendition_url(row["photo"], "icon", row["photo_status"]),
+            "user_url": self.user_profile.replace("USER-SLUG", user_slug),
+            "post_url": self.view_post.replace("USER-SLUG", user_slug).replace("POST-SLUG", row["slug"]),
+        }
+
+
+def stream_posts(posts, order, limit, cursor=None):
+    """
+    Yield the JSON for up to limit posts in order as {"posts": [...], "next_cursor": ...}, a chunk at a time.
+
+    Rows are read with a database iterator and written out as they arrive, so memory use doesn't grow with the
+    number of posts. Posts are listed flat rather than grouped by location, since grouping needs every post first.
+    """
+    urls = PostURLs()
+    encoder = DjangoJSONEncoder(separators=(",", ":"))
+    rows = cursors.after_cursor(posts, order, cursor)[: limit + 1].values(*POST_FIELDS).iterator(chunk_size=CHUNK_SIZE)
+
+    yield '{"posts":['
+    chunk = []
+    last_row = None
+    next_cursor = None
+    written = 0
+    for row in rows:
+        if written == limit:
+            # The extra row only tells us there is another page
+            next_cursor = cursors.encode_cursor(order, last_row)
+            break
+
+        chunk.append(encoder.encode(urls.post_json(row)))
+        last_row = row
+        written += 1
+        if len(chunk) == CHUNK_SIZE:
+            yield ("," if written > CHUNK_SIZE else "") + ",".join(chunk)
+            chunk = []
+
+    if chunk:
+        yield ("," if written > len(chunk) else "") + ",".join(chunk)
+    yield f'],"next_cursor":{json.dumps(next_cursor)}}}'
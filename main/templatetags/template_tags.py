@@ -1,12 +1,17 @@
 from django import template
-from main.models import Like, UserProfile
+from main.models import UserProfile
+from main.likes import liked_post_ids
 
 register = template.Library()
 
 
-@register.inclusion_tag("photoGraph/post_template.html")
-def post_template(posts=None, show_user_url=True):
-    return {"posts": posts, "show_user_url": show_user_url}
+@register.inclusion_tag("photoGraph/post_template.html", takes_context=True)
+def post_template(context, posts=None, show_user_url=True):
+    return {
+        "posts": posts,
+        "show_user_url": show_user_url,
+        "liked_post_ids": liked_post_ids(context.get("request"), posts or []),
+    }
 
 
 @register.inclusion_tag("photoGraph/account_detail_template.html")
@@ -19,10 +24,16 @@ def comment_template(comments=None):
     return {"comments": comments}
 
 
+@register.filter
+def rendition(instance, size):
+    # {{ post|rendition:"card" }}, the URL of a post's photo or a user's profile picture at one of the sizes in
+    # main.renditions.RENDITIONS
+    return instance.rendition_url(size)
+
+
 @register.simple_tag
 def get_likes(post=None):
     if post != None:
-        likes = Like.objects.filter(post=post)
-        return len(likes)
+        return post.like_count
     else:
         return 0
@@ -0,0 +1,21 @@
+from django.core.cache import cache
+from main import geo
+
+# Zoom levels the tiled map feed is served at, zoomed out views are sent clusters by get_posts_json instead
+MIN_TILE_ZOOM = 13
+MAX_TILE_ZOOM = 16
+
+TILE_CACHE_TIMEOUT = 60 * 60
+
+
+def tile_cache_key(zoom, x, y):
+    return f"map-tile-page:{zoom}:{x}:{y}"
+
+
+def invalidate_tiles(latitude, longitude):
+    # Only the tiles containing the point are dropped, the rest of the map stays cached
+    keys = []
+    for zoom in range(MIN_TILE_ZOOM, MAX_TILE_ZOOM + 1):
+        x, y = geo.tile_for(latitude, longitude, zoom)
+        keys.append(tile_cache_key(zoom, x, y))
+    cache.delete_many(keys)
@@ -25,6 +25,8 @@ urlpatterns = [
     path("info_change/", views.info_change_view, name="info_change"),
     path("my_posts/edit/<slug:post_slug>/", views.edit_post, name="edit_post"),
     path("get_posts_json", views.get_posts_json, name="get_posts_json"),
+    path("get_posts_near_json", views.get_posts_near_json, name="get_posts_near_json"),
+    path("tiles/<int:zoom>/<int:x>/<int:y>/", views.get_tile_json, name="get_tile_json"),
     path("create_post/", views.create_post, name="create_post"),
     path("update_profile/", views.update_profile, name="update_profile"),
     path("like_toggle/", views.like_toggle, name="like_toggle"),
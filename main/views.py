@@ -4,6 +4,10 @@ from django.http import (
     JsonResponse,
     HttpResponseNotFound,
     HttpResponseBadRequest,
+    HttpResponseForbidden,
+    StreamingHttpResponse,
+    FileResponse,
+    Http404,
 )
 from django.urls import reverse
 from django.contrib.auth import authenticate, login, logout, update_session_auth_hash
@@ -20,9 +24,27 @@ from main.forms import (
     ContactUsForm,
 )
 from django.contrib import messages
-from main.models import UserProfile, Post, Comment, PostReport, User, UserReport, Like, Group
+from main.models import UserProfile, Post, Comment, PostReport, User, UserReport, Like, Group, Location
 from django.views import View
-from django.db.models import Count
+from django.views.decorators.http import condition
+from django.db.models import Avg, Count, OuterRef, Subquery, Value
+from django.db.models.functions import Concat, Substr
+from main import columnar, cursors, geo, media, nearby, regions, resizing, streaming, tiles
+from main.likes import liked_post_ids
+from django.core.paginator import Paginator
+from django.conf import settings
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils._os import safe_join
+from django.utils.http import http_date
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+import hashlib
+import json
+import math
+import mimetypes
+import os
+import stat
 
 
 def index(request):
@@ -37,7 +59,7 @@ def show_user_profile(request, user_profile_slug):
     context_dict = {}
 
     try:
-        user_profile = UserProfile.objects.get(slug=user_profile_slug)
+        user_profile = UserProfile.objects.select_related("user").get(slug=user_profile_slug)
     except UserProfile.DoesNotExist:
         context_dict["user_profile"] = None
     else:
@@ -45,21 +67,57 @@ def show_user_profile(request, user_profile_slug):
             return redirect(reverse("main:my_account"))
 
         context_dict["user_profile"] = user_profile
-        context_dict["posts"] = user_profile.posts.all()
+        context_dict["posts"] = user_profile.posts.for_listing()
 
     return render(request, "photoGraph/user_profile.html", context=context_dict)
 
 
+NEAR_DEFAULT_RADIUS_M = 1000
+NEAR_MAX_RADIUS_M = 50000
+NEAR_PAGE_SIZE = 20
+
+
+def near_query(request):
+    """Parse lat, lon and radius_m from the query string, raising ValueError if they're missing or invalid."""
+    latitude = float(request.GET["lat"])
+    longitude = float(request.GET["lon"])
+    radius_m = float(request.GET.get("radius_m", NEAR_DEFAULT_RADIUS_M))
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180 and 0 < radius_m <= NEAR_MAX_RADIUS_M):
+        raise ValueError("Coordinates or radius out of range")
+    return latitude, longitude, radius_m
+
+
+def near_page(request, latitude, longitude, radius_m):
+    paginator = Paginator(nearby.posts_within_radius(latitude, longitude, radius_m), NEAR_PAGE_SIZE)
+    page = paginator.get_page(request.GET.get("page"))
+    return page, nearby.load_posts(page.object_list)
+
+
 def show_location(request):
+    if "lat" in request.GET:
+        try:
+            latitude, longitude, radius_m = near_query(request)
+        except (KeyError, ValueError):
+            return HttpResponseBadRequest()
+
+        page, posts = near_page(request, latitude, longitude, radius_m)
+        query = request.GET.copy()
+        query.pop("page", None)
+        context_dict = {
+            "location_name": f"Within {radius_m:g}m of {latitude:g}, {longitude:g}",
+            "posts": posts,
+            "page": page,
+            "query": query.urlencode(),
+        }
+        return render(request, "photoGraph/location.html", context=context_dict)
+
     location_name = request.GET.get("location_name", "")
     context_dict = {"location_name": location_name}
 
-    try:
-        location_posts = Post.objects.filter(location_name=location_name)
-        context_dict["posts"] = location_posts
-
-    except Exception:
-        pass
+    location = Location.objects.filter(name=location_name).first()
+    if location is not None:
+        context_dict["location"] = location
+        context_dict["posts"] = location.posts.for_listing()
 
     return render(request, "photoGraph/location.html", context=context_dict)
 
@@ -70,16 +128,12 @@ def view_post(request, user_profile_slug, post_slug):
     context_dict["comment_form"] = CommentForm()
 
     try:
-        post = Post.objects.get(slug=post_slug)
+        post = Post.objects.for_listing().get(slug=post_slug)
         context_dict["post"] = post
-        context_dict["comments"] = post.comments.all()
-
-        if request.user.is_authenticated:
-            has_user_liked = len(Like.objects.filter(post=post, user=request.user.created_by)) > 0
-        else:
-            has_user_liked = False
+        context_dict["comments"] = post.comments.select_related("created_by__user")
 
-        context_dict["has_user_liked"] = has_user_liked
+        context_dict["has_user_liked"] = post.pk in liked_post_ids(request, [post])
+        context_dict["nearby_posts"] = nearby.nearby_posts(post)
     except (UserProfile.DoesNotExist, Post.DoesNotExist):
         context_dict["post"] = None
 
@@ -102,12 +156,12 @@ def show_group(request, group_slug):
     context_dict = {}
 
     try:
-        group = Group.objects.get(slug=group_slug)
+        group = Group.objects.select_related("created_by__user").get(slug=group_slug)
     except Group.DoesNotExist:
         context_dict["group"] = None
         context_dict["group_slug"] = group_slug
     else:
-        context_dict["posts"] = group.posts.all()
+        context_dict["posts"] = group.posts.for_listing()
         context_dict["group"] = group
         if request.user.is_authenticated:
             # context_dict["is_user_member"] = request.user.created_by.groups_members.filter(slug=group_slug).exists()
@@ -116,7 +170,6 @@ def show_group(request, group_slug):
         else:
             context_dict["is_user_member"] = False
             context_dict["user_is_creator"] = False
-        context_dict["posts"] = group.posts.all()
 
     return render(request, "photoGraph/group.html", context=context_dict)
 
@@ -378,7 +431,7 @@ def info_change_view(request):
 def my_account(request):
     if request.user.is_authenticated:
         user_profile = request.user.created_by
-        user_posts = user_profile.posts.all()
+        user_posts = user_profile.posts.for_listing()
         return render(
             request,
             "photoGraph/my_account.html",
@@ -422,76 +475,289 @@ def create_post(request):
 
 POST_FILTER_ON = True
 
+# Below this zoom level the map is sent clusters of posts rather than every post
+CLUSTER_ZOOM = 13
+# Viewports too big for their zoom level, which would cover more cells than this, are clustered more coarsely
+MAX_CLUSTERS = 256
 
-def get_posts_json(request):
+POSTS_DEFAULT_LIMIT = 100
+POSTS_MAX_LIMIT = 500
+POSTS_STREAM_MAX_LIMIT = 50000
+
+MAX_LOADED_BOXES = 16
+
+POSTS_JSON_BBOX_PARAMS = ("nwLat", "nwLon", "seLat", "seLon")
+POSTS_JSON_CACHE_TIMEOUT = 60 * 60
+
+
+def cluster_posts(posts, zoom, viewport):
+    precision = min(geo.zoom_precision(zoom), geo.bbox_precision(*viewport, max_cells=MAX_CLUSTERS))
+
+    # The most liked post of each cell, found with an index range scan over the cell's geohashes
+    top_posts = posts.filter(
+        geohash__gte=OuterRef("cell"), geohash__lt=Concat(OuterRef("cell"), Value("~"))
+    ).order_by("-like_count", "-id")
+    clusters = list(
+        posts.annotate(cell=Substr("geohash", 1, precision))
+        .values("cell")
+        .annotate(
+            count=Count("id"),
+            lat=Avg("latitude"),
+            lon=Avg("longitude"),
+            top_post=Subquery(top_posts.values("id")[:1]),
+        )
+        .order_by("cell")
+    )
+
+    top_posts = Post.objects.select_related("created_by").in_bulk([cluster["top_post"] for cluster in clusters])
+
+    result = []
+    for cluster in clusters:
+        top_post = top_posts[cluster["top_post"]]
+        result.append(
+            {
+                "lat": cluster["lat"],
+                "lon": cluster["lon"],
+                "count": cluster["count"],
+                "bounds": geo.decode_bbox(cluster["cell"]),
+                "photo_url": top_post.rendition_url("card"),
+                "icon_url": top_post.rendition_url("icon"),
+                "post_url": reverse("main:view_post", args=[top_post.created_by.slug, top_post.slug]),
+            }
+        )
+    return result
+
+
+def post_json(post):
+    # Posts still waiting to be geocoded have no location yet and are grouped by their placeholder name
+    location_name = post.location.name if post.location_id is not None else post.location_name
+    return {
+        "lat": post.latitude,
+        "lon": post.longitude,
+        "user_name": post.created_by.slug,
+        "location_name": location_name,
+        "location_url": reverse("main:show_location") + "?location_name=" + location_name,
+        "likes": post.like_count,
+        "date": post.created_time,
+        "caption": post.caption,
+        "photo_url": post.rendition_url("card"),
+        "icon_url": post.rendition_url("icon"),
+        "user_url": reverse("main:show_user_profile", args=[post.created_by.slug]),
+        "post_url": reverse("main:view_post", args=[post.created_by.slug, post.slug]),
+    }
+
+
+def posts_by_location(posts):
     result = {}
 
+    for post in posts:
+        postDict = post_json(post)
+        location_name = postDict["location_name"]
+        if location_name not in result.keys():
+            result[location_name] = [postDict]
+        else:
+            result[location_name].append(postDict)
+
+    return result
+
+
+def posts_json_viewport(request):
+    # Snapped outwards, so that slightly different viewports share a cached response
+    southEast = (float(request.GET["seLat"]), float(request.GET["seLon"]))
+    northWest = (float(request.GET["nwLat"]), float(request.GET["nwLon"]))
+    if not all(math.isfinite(coordinate) for coordinate in southEast + northWest):
+        raise ValueError("Viewport coordinates must be finite")
+    return geo.quantize_bbox(southEast[0], northWest[1], northWest[0], southEast[1])
+
+
+def posts_json_etag(request):
+    """
+    Changes whenever a post or like in the regions the viewport covers changes, see main.regions.
+
+    None for streamed and unfiltered responses, which aren't cached.
+    """
+    if "_posts_json_etag" not in request.__dict__:
+        etag = None
+        if POST_FILTER_ON and request.GET.get("format") != "stream":
+            try:
+                viewport = posts_json_viewport(request)
+            except (KeyError, ValueError):
+                viewport = None
+
+            if viewport is not None:
+                query = sorted((key, values) for key, values in request.GET.lists() if key not in POSTS_JSON_BBOX_PARAMS)
+                versions = regions.versions(regions.region_cells(*viewport))
+                etag = hashlib.sha1(json.dumps([viewport, query, versions]).encode()).hexdigest()
+        request.__dict__["_posts_json_etag"] = etag
+    return request.__dict__["_posts_json_etag"]
+
+
+@condition(etag_func=posts_json_etag)
+def get_posts_json(request):
+    # Unchanged areas are answered with a 304 by the condition decorator, or from the cache without touching the
+    # database or encoding anything
+    etag = posts_json_etag(request)
+    key = f"posts-json:{etag}"
+    if etag is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            payload, next_cursor = cached
+            response = HttpResponse(payload, content_type="application/json")
+            if next_cursor is not None:
+                response["X-Next-Cursor"] = next_cursor
+            return response
+
+    response = posts_json_response(request)
+    if etag is not None and response.status_code == 200:
+        cache.set(key, (response.content, response.get("X-Next-Cursor")), POSTS_JSON_CACHE_TIMEOUT)
+    return response
+
+
+def posts_json_response(request):
     postObjects = []
     # Find bounds
     if POST_FILTER_ON:
-        southEast = (float(request.GET.get("seLat")), float(request.GET.get("seLon")))
-        northWest = (float(request.GET.get("nwLat")), float(request.GET.get("nwLon")))
-
-        postObjects = Post.objects.filter(
-            latitude__gte=southEast[0],
-            latitude__lte=northWest[0],
-            longitude__gte=northWest[1],
-            longitude__lte=southEast[1],
-        )
+        try:
+            viewport = posts_json_viewport(request)
+        except (KeyError, ValueError):
+            return HttpResponseBadRequest()
 
-        postObjects = sorted(postObjects, key=lambda p: len(Like.objects.filter(post=p)), reverse=True)
+        postObjects = Post.objects.for_listing().in_bbox(*viewport)
+
+        if "zoom" in request.GET:
+            try:
+                zoom = int(request.GET["zoom"])
+            except ValueError:
+                return HttpResponseBadRequest()
+
+            # Zoomed out views get a bounded number of clusters however many posts are in view
+            if zoom < CLUSTER_ZOOM:
+                return JsonResponse({"clusters": cluster_posts(postObjects, zoom, viewport)})
+
+        # Clients send the boxes they already have posts for as loaded=south,west,north,east (repeated), and
+        # only get the posts in the part of the viewport outside them
+        if "loaded" in request.GET:
+            try:
+                loaded = [tuple(float(value) for value in box.split(",")) for box in request.GET.getlist("loaded")]
+                if len(loaded) > MAX_LOADED_BOXES or any(len(box) != 4 for box in loaded):
+                    raise ValueError("Too many or malformed loaded boxes")
+                # Inside out boxes would be subtracted as if they were others that aren't loaded
+                for south, west, north, east in loaded:
+                    if not all(math.isfinite(value) for value in (south, west, north, east)):
+                        raise ValueError("Loaded box coordinates must be finite")
+                    if south > north or west > east:
+                        raise ValueError("Loaded boxes must be given south,west,north,east")
+            except ValueError:
+                return HttpResponseBadRequest()
+
+            exposed = geo.bbox_difference(viewport, loaded)
+            # A very fragmented difference would be slower to query than the viewport, the client ignores repeats
+            if len(exposed) <= geo.MAX_BBOX_CELLS:
+                postObjects = Post.objects.for_listing().in_bboxes(exposed)
     else:
-        postObjects = Post.objects.all()
-
-    # Filter posts
-    for post in postObjects:
-        likes = Like.objects.filter(post=post)
-
-        postDict = {
-            "lat": post.latitude,
-            "lon": post.longitude,
-            "user_name": post.created_by.slug,
-            "location_name": post.location_name,
-            "location_url": reverse("main:show_location") + "?location_name=" + post.location_name,
-            "likes": len(likes),
-            "date": post.created_time,
-            "caption": post.caption,
-            "photo_url": post.photo.url,
-            "user_url": reverse("main:show_user_profile", args=[post.created_by.slug]),
-            "post_url": reverse("main:view_post", args=[post.created_by.slug, post.slug]),
-        }
-        if post.location_name not in result.keys():
-            result[post.location_name] = [postDict]
-        else:
-            result[post.location_name].append(postDict)
+        postObjects = Post.objects.for_listing()
+
+    # However busy the view, a request gets at most POSTS_MAX_LIMIT posts, the rest are paged through with the
+    # cursor sent back in the X-Next-Cursor header. Streamed responses hold one chunk of posts in memory at a
+    # time, so they can be much longer.
+    order = request.GET.get("order", "likes")
+    response_format = request.GET.get("format", "grouped")
+    cursor = request.GET.get("cursor")
+    try:
+        max_limit = POSTS_STREAM_MAX_LIMIT if response_format == "stream" else POSTS_MAX_LIMIT
+        limit = min(int(request.GET.get("limit", POSTS_DEFAULT_LIMIT)), max_limit)
+        if limit < 1 or order not in cursors.ORDERINGS or response_format not in ("grouped", "stream", "columnar"):
+            raise ValueError("Invalid limit, order or format")
+        if cursor is not None:
+            cursors.decode_cursor(cursor, order)
+    except ValueError:
+        return HttpResponseBadRequest()
+
+    if response_format == "stream":
+        return StreamingHttpResponse(
+            streaming.stream_posts(postObjects, order, limit, cursor), content_type="application/json"
+        )
 
-    return JsonResponse(result, safe=False)
+    if response_format == "columnar":
+        result = columnar.columnar_posts(postObjects, order, limit, cursor)
+        return HttpResponse(
+            json.dumps(result, cls=DjangoJSONEncoder, separators=(",", ":")), content_type="application/json"
+        )
 
+    postObjects, next_cursor = cursors.keyset_page(postObjects, order, limit, cursor)
 
-def like_toggle(request):
-    if request.user.is_authenticated:
-        post_id = request.GET["post_id"]
+    result = posts_by_location(postObjects)
+
+    response = JsonResponse(result, safe=False)
+    if next_cursor is not None:
+        response["X-Next-Cursor"] = next_cursor
+    return response
+
+
+def get_tile_json(request, zoom, x, y):
+    if not tiles.MIN_TILE_ZOOM <= zoom <= tiles.MAX_TILE_ZOOM or x >= 1 << zoom or y >= 1 << zoom:
+        return HttpResponseNotFound()
+
+    # Dense tiles are paged like the posts JSON, with the cursor sent back in the X-Next-Cursor header
+    cursor = request.GET.get("cursor")
+    if cursor is not None:
         try:
-            post = Post.objects.get(id=int(post_id))
-        except Post.DoesNotExist:
-            return HttpResponseNotFound()
+            cursors.decode_cursor(cursor, "likes")
         except ValueError:
             return HttpResponseBadRequest()
 
-        user_profile = request.user.created_by
+    # First pages are cached already serialised, saving and deleting posts drops the tiles they are in
+    key = tiles.tile_cache_key(zoom, x, y)
+    cached = cache.get(key) if cursor is None else None
+    if cached is None:
+        posts = Post.objects.for_listing().in_bbox(*geo.tile_bbox(zoom, x, y))
+        posts, next_cursor = cursors.keyset_page(posts, "likes", POSTS_MAX_LIMIT, cursor)
 
-        has_user_liked = len(Like.objects.filter(post=post, user=user_profile)) > 0
+        cached = json.dumps(posts_by_location(posts), cls=DjangoJSONEncoder), next_cursor
+        if cursor is None:
+            cache.set(key, cached, tiles.TILE_CACHE_TIMEOUT)
 
-        if has_user_liked:
-            # Unlike
-            Like.objects.get(post=post, user=user_profile).delete()
-        else:
-            # Like
-            Like.objects.update_or_create(post=post, user=user_profile)
+    payload, next_cursor = cached
+    response = HttpResponse(payload, content_type="application/json")
+    if next_cursor is not None:
+        response["X-Next-Cursor"] = next_cursor
+    return response
+
+
+def get_posts_near_json(request):
+    try:
+        latitude, longitude, radius_m = near_query(request)
+    except (KeyError, ValueError):
+        return HttpResponseBadRequest()
+
+    page, posts = near_page(request, latitude, longitude, radius_m)
+    return JsonResponse(
+        {
+            "posts": [dict(post_json(post), distance=round(post.distance, 1)) for post in posts],
+            "page": page.number,
+            "num_pages": page.paginator.num_pages,
+            "count": page.paginator.count,
+        }
+    )
+
+
+def like_toggle(request):
+    if not request.user.is_authenticated:
+        return HttpResponseForbidden()
+
+    post_id = request.GET["post_id"]
+    try:
+        post = Post.objects.get(id=int(post_id))
+    except Post.DoesNotExist:
+        return HttpResponseNotFound()
+    except ValueError:
+        return HttpResponseBadRequest()
 
-    likes = Like.objects.filter(post=post)
+    Like.objects.toggle(post, request.user.created_by)
 
-    return HttpResponse(len(likes))
+    like_count = Post.objects.values_list("like_count", flat=True).get(pk=post.pk)
+
+    return HttpResponse(like_count)
 
 
 def contact_us_view(request):
@@ -504,3 +770,82 @@ def contact_us_view(request):
     else:
         form = ContactUsForm()
     return render(request, "photoGraph/contact_us.html", {"contact_form": form})
+
+
+# Resized images are never changed, their sources are never overwritten
+RESIZED_MEDIA_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def resized_media(request, width, height, path):
+    # Only sizes the site uses, so the cache can't be filled with every possible size of every image
+    if (width, height) not in settings.RESIZED_MEDIA_SIZES:
+        raise Http404
+
+    try:
+        resized = resizing.open_resized(width, height, path)
+    except resizing.RESIZE_ERRORS:
+        raise Http404
+
+    # Sized from the open file rather than its path, which may already have been evicted
+    size = os.fstat(resized.fileno()).st_size
+    response = FileResponse(media.FileRange(resized, size), content_type="image/jpeg")
+    response["Content-Length"] = size
+    patch_cache_control(response, public=True, max_age=RESIZED_MEDIA_MAX_AGE, immutable=True)
+    return response
+
+
+def serve_media(request, path):
+    # Renditions are sent as the smallest format the browser decodes, with no change to their URLs
+    for name, content_type in media.candidates(path, request.META.get("HTTP_ACCEPT", "")):
+        try:
+            full_path = safe_join(settings.MEDIA_ROOT, name)
+            file_stat = os.stat(full_path)
+        except (SuspiciousFileOperation, OSError):
+            continue
+        if stat.S_ISREG(file_stat.st_mode):
+            break
+    else:
+        raise Http404
+
+    etag = media.etag(name, file_stat)
+    last_modified = http_date(file_stat.st_mtime)
+    response = get_conditional_response(request, etag=etag, last_modified=int(file_stat.st_mtime))
+    if response is None:
+        response = media_file_response(request, full_path, file_stat.st_size, etag, last_modified, content_type)
+
+    if media.has_variants(path):
+        patch_vary_headers(response, ["Accept"])
+    response["ETag"] = etag
+    response["Last-Modified"] = last_modified
+    if media.is_immutable(path):
+        patch_cache_control(response, public=True, max_age=media.IMMUTABLE_MAX_AGE, immutable=True)
+    else:
+        patch_cache_control(response, public=True, max_age=media.MUTABLE_MAX_AGE)
+    return response
+
+
+def media_file_response(request, full_path, size, etag, last_modified, content_type=None):
+    content_type = content_type or mimetypes.guess_type(full_path)[0] or "application/octet-stream"
+    # A range of a file that has changed since the client fetched the rest of it would be spliced into the wrong file
+    if_range = request.META.get("HTTP_IF_RANGE")
+    byte_range = None
+    if if_range is None or if_range in (etag, last_modified):
+        try:
+            byte_range = media.byte_range(request.META.get("HTTP_RANGE"), size)
+        except media.UnsatisfiableRange:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{size}"
+            response["Accept-Ranges"] = "bytes"
+            return response
+
+    f = open(full_path, "rb")
+    if byte_range is None:
+        response = FileResponse(f, content_type=content_type)
+    else:
+        start, end = byte_range
+        f.seek(start)
+        response = FileResponse(media.FileRange(f, end - start + 1), status=206, content_type=content_type)
+        response["Content-Length"] = end - start + 1
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+    response["Accept-Ranges"] = "bytes"
+    return response
@@ -94,6 +94,22 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/2.2/topics/cache/
+
+# Region versions (main.regions), map tiles and the posts JSON are invalidated by whichever process changes a post:
+# any web worker, the upload processing workers or 'manage.py geocode_posts'. Every process must use the same cache,
+# so it can't be Django's default per-process local memory cache. The table is made with
+# 'python manage.py createcachetable', memcached or Redis can be used instead.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+        "LOCATION": "photograph_cache",
+        "OPTIONS": {"MAX_ENTRIES": 100000},
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
 
@@ -142,3 +158,51 @@ STATICFILES_DIRS = [
 MEDIA_ROOT = MEDIA_DIR
 
 MEDIA_URL = "/media/"
+
+# Largest photos and profile pictures that can be uploaded, checked before any of the image is decoded
+UPLOAD_MAX_BYTES = 20 * 2 ** 20
+
+UPLOAD_MAX_PIXELS = 50 * 10 ** 6
+
+# Uploaded photos and profile pictures are processed by a pool of this many worker processes, see main.processing,
+# or in the request if it's 0
+UPLOAD_PROCESSING_WORKERS = 2
+
+# Uploads waiting to be processed, kept out of MEDIA_ROOT
+UPLOAD_PROCESSING_DIR = os.path.join(BASE_DIR, "uploads")
+
+# Media images resized on request at MEDIA_URL/resized/<width>x<height>/<path>, only to these sizes
+RESIZED_MEDIA_SIZES = [(140, 140), (500, 500), (1000, 1000), (1600, 1600)]
+
+RESIZED_MEDIA_CACHE_DIR = os.path.join(BASE_DIR, "cache", "resized")
+
+# Least recently used images are deleted once the cache is bigger than this
+RESIZED_MEDIA_CACHE_MAX_BYTES = 512 * 2 ** 20
+
+
+# Reverse geocoding, done in the background by 'python manage.py geocode_posts --daemon'
+
+# Geocoders tried in order: "nominatim" (the HTTP API below) and "gazetteer" (offline, needs GEOCODER_GAZETTEER_PATH)
+GEOCODER_BACKENDS = ["nominatim"]
+
+GEOCODER_URL = "https://nominatim.openstreetmap.org"
+
+GEOCODER_TIMEOUT = 5
+
+GEOCODER_USER_AGENT = "PhotoGraph/1.0 (University of Glasgow student project)"
+
+# Nominatim's usage policy allows at most one request per second
+GEOCODER_MIN_INTERVAL = 1.0
+
+# Place names are cached by coordinates rounded to this many decimal places (4 is roughly 10m)
+GEOCODE_CACHE_PRECISION = 4
+
+GEOCODE_CACHE_TTL = 60 * 60 * 24 * 30
+
+GEOCODE_CACHE_LRU_SIZE = 4096
+
+# A GeoNames dump such as cities1000.txt from https://download.geonames.org/export/dump/
+GEOCODER_GAZETTEER_PATH = None
+
+# The gazetteer geocoder doesn't name coordinates further than this many km from every place
+GEOCODER_GAZETTEER_MAX_DISTANCE = 25
@@ -17,7 +17,6 @@ from django.contrib import admin
 from django.urls import path
 from django.urls import include
 from django.conf import settings
-from django.conf.urls.static import static
 from main import views
 
 
@@ -25,4 +24,7 @@ urlpatterns = [
     path('', views.index, name='index'),
     path('photoGraph/', include('main.urls')),
     path('admin/', admin.site.urls),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    path(settings.MEDIA_URL.lstrip('/') + 'resized/<int:width>x<int:height>/<path:path>', views.resized_media,
+         name='resized_media'),
+    path(settings.MEDIA_URL.lstrip('/') + '<path:path>', views.serve_media, name='media'),
+]
@@ -4,6 +4,12 @@ from main.models import UserProfile, Group, Comment, Post, PostReport, UserRepor
 from main.forms import *
 
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.exceptions import ValidationError
+from django.test import override_settings
+from unittest.mock import patch
+from PIL import Image
+import struct
+import zlib
 
 # run tests with command python - .\manage.py test tests.photoGraph.test_forms
 # all test cases pass as of 22/03/2024 14:30
@@ -191,3 +197,48 @@ class GroupFormTestCase(TestCase):
         }
         form = GroupForm(data=form_data)
         self.assertFalse(form.is_valid(), msg=form.errors)
+
+
+def png_header(width, height):
+    # A PNG claiming to be width x height, with next to no pixel data behind it
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 1, 0, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(b'\x00' * 64)) + chunk(b'IEND', b''))
+
+
+class HeaderCheckedImageFieldTestCase(TestCase):
+    def setUp(self):
+        with open('tests/photoGraph/test_images/test_image.jpg', 'rb') as image_file:
+            self.image = image_file.read()
+
+    def clean(self, name, data):
+        return HeaderCheckedImageField().clean(SimpleUploadedFile(name, data))
+
+    def assertRejected(self, name, data, code):
+        with self.assertRaises(ValidationError) as context:
+            self.clean(name, data)
+        self.assertEqual(context.exception.code, code)
+
+    @patch('PIL.ImageFile.ImageFile.load', side_effect=AssertionError("decoded"))
+    def test_valid_image_not_decoded(self, load):
+        upload = self.clean('test_image.jpg', self.image)
+        self.assertEqual(upload.content_type, 'image/jpeg')
+        self.assertEqual(upload.image.size, (4032, 3024))
+        self.assertEqual(upload.read(2), b'\xff\xd8')
+
+    def test_too_large(self):
+        with override_settings(UPLOAD_MAX_BYTES=len(self.image) - 1):
+            self.assertRejected('test_image.jpg', self.image, 'too_large')
+
+    @patch('PIL.ImageFile.ImageFile.load', side_effect=AssertionError("decoded"))
+    def test_too_many_pixels(self, load):
+        with override_settings(UPLOAD_MAX_PIXELS=4032 * 3024 - 1):
+            self.assertRejected('test_image.jpg', self.image, 'too_many_pixels')
+        # Big enough for Pillow to refuse to open it as a decompression bomb
+        self.assertRejected('bomb.png', png_header(50000, 50000), 'too_many_pixels')
+        self.assertRejected('big.png', png_header(10000, 6000), 'too_many_pixels')
+
+    def test_not_an_image(self):
+        self.assertRejected('notes.jpg', b'not an image', 'invalid_image')
+        self.assertRejected('image.bmp', Image.new('RGB', (10, 10)).tobytes(), 'invalid_image')
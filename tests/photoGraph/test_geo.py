@@ -0,0 +1,62 @@
+from django.test import SimpleTestCase
+from main import geo
+
+# run tests with command - python .\manage.py test tests.photoGraph.test_geo
+
+class GeohashTestCase(SimpleTestCase):
+    def test_encode_known_value(self):
+        self.assertEqual(geo.encode(57.64911, 10.40744, 11), 'u4pruydqqvj')
+
+    def test_decode_bbox_contains_point(self):
+        south, west, north, east = geo.decode_bbox(geo.encode(55.8724, -4.2900))
+        self.assertTrue(south <= 55.8724 <= north)
+        self.assertTrue(west <= -4.2900 <= east)
+
+    def test_bbox_ranges_cover_points_inside_box(self):
+        ranges = geo.bbox_ranges(55.86, -4.30, 55.88, -4.27)
+        self.assertLessEqual(len(ranges), geo.MAX_BBOX_CELLS)
+
+        for latitude, longitude in [(55.86, -4.30), (55.88, -4.27), (55.8712, -4.2851)]:
+            geohash = geo.encode(latitude, longitude)
+            self.assertTrue(any(low <= geohash and (high is None or geohash < high) for low, high in ranges))
+
+    def test_bbox_ranges_whole_world(self):
+        self.assertEqual(geo.bbox_ranges(-90, -180, 90, 180), [('0', None)])
+
+
+class DistanceTestCase(SimpleTestCase):
+    def test_haversine(self):
+        # Glasgow to Edinburgh is about 67km
+        self.assertAlmostEqual(geo.haversine_m(55.8642, -4.2518, 55.9533, -3.1883) / 1000, 67.1, places=0)
+        self.assertEqual(geo.haversine_m(55.0, -4.0, 55.0, -4.0), 0)
+
+    def test_radius_bbox_contains_circle(self):
+        south, west, north, east = geo.radius_bbox(55.8724, -4.29, 1000)
+        for bearing_point in [(south, -4.29), (north, -4.29), (55.8724, west), (55.8724, east)]:
+            self.assertAlmostEqual(geo.haversine_m(55.8724, -4.29, *bearing_point), 1000, delta=10)
+
+    def test_radius_bbox_across_antimeridian_and_poles(self):
+        self.assertEqual(geo.radius_bbox(0.0, 179.999, 1000)[1::2], (-180.0, 180.0))
+        self.assertEqual(geo.radius_bbox(89.999, 0.0, 1000)[1:], (-180.0, 90.0, 180.0))
+
+
+class BboxDifferenceTestCase(SimpleTestCase):
+    def area(self, boxes):
+        return sum((north - south) * (east - west) for south, west, north, east in boxes)
+
+    def test_pan(self):
+        # Panning east by a quarter of the view exposes a strip on the east side
+        self.assertEqual(geo.bbox_difference((0, 0.25, 1, 1.25), [(0, 0, 1, 1)]), [(0, 1, 1, 1.25)])
+
+    def test_fully_loaded(self):
+        self.assertEqual(geo.bbox_difference((0, 0, 1, 1), [(-1, -1, 2, 2)]), [])
+
+    def test_disjoint(self):
+        self.assertEqual(geo.bbox_difference((0, 0, 1, 1), [(5, 5, 6, 6)]), [(0, 0, 1, 1)])
+
+    def test_hole_and_overlapping_boxes(self):
+        pieces = geo.bbox_difference((0, 0, 4, 4), [(1, 1, 2, 2), (1.5, 1.5, 3, 3)])
+        self.assertAlmostEqual(self.area(pieces), 16 - 1 - 2.25 + 0.25)
+        for i, (s1, w1, n1, e1) in enumerate(pieces):
+            for s2, w2, n2, e2 in pieces[i + 1:]:
+                self.assertFalse(s1 < n2 and s2 < n1 and w1 < e2 and w2 < e1)
@@ -0,0 +1,307 @@
+import os
+import random
+import tempfile
+from django.test import TestCase, override_settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.utils import timezone
+from io import StringIO
+from main.models import UserProfile, Post, GeocodeCache, Location
+from main.geocoding import (NominatimGeocoder, CachedGeocoder, GazetteerGeocoder, GeocoderChain, GeocodingError,
+                            MAX_CONSECUTIVE_ERRORS, RateLimiter, build_geocoder, default_geocoder,
+                            resolve_pending_locations)
+from main.gazetteer import Gazetteer, KDTree, to_unit_vector
+from main.fake_geocoder import FakeNominatimServer
+from unittest.mock import patch
+
+# run tests with command - python .\manage.py test tests.photoGraph.test_geocoding
+
+class NominatimGeocoderTestCase(TestCase):
+    def setUp(self):
+        self.server = FakeNominatimServer().start()
+        self.geocoder = NominatimGeocoder(url=self.server.url, timeout=2)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_reverse(self):
+        self.assertEqual(self.geocoder.reverse(55.8724, -4.29), "Fake place 55.872, -4.290")
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_reverse_no_result(self):
+        self.server.place_name = lambda latitude, longitude: None
+        self.assertIsNone(self.geocoder.reverse(0.0, 0.0))
+
+    def test_reverse_server_error(self):
+        self.server.status = 503
+        with self.assertRaises(GeocodingError):
+            self.geocoder.reverse(55.8724, -4.29)
+
+    def test_reverse_unreachable(self):
+        self.server.stop()
+        with self.assertRaises(GeocodingError):
+            self.geocoder.reverse(55.8724, -4.29)
+        self.server = FakeNominatimServer().start()
+
+
+class GeocodePostsTestCase(TestCase):
+    def setUp(self):
+        # Posts look up the shared cache when they are saved, don't let earlier tests' entries leak in
+        default_geocoder().lru.clear()
+        self.server = FakeNominatimServer().start()
+        self.geocoder = NominatimGeocoder(url=self.server.url, timeout=2)
+
+        user_profile = UserProfile.objects.create(user=User.objects.create_user(username='testuser'))
+        self.posts = [
+            Post.objects.create(created_by=user_profile, caption=f"Post {i}", photo='test_image.jpg',
+                                latitude=55.8724 + i, longitude=-4.29)
+            for i in range(3)
+        ]
+
+    def tearDown(self):
+        self.server.stop()
+
+    @patch('http.client.HTTPSConnection')
+    def test_save_does_not_geocode(self, mock_connection):
+        post = Post.objects.create(created_by=self.posts[0].created_by, caption="New", photo='test_image.jpg',
+                                   latitude=1.0, longitude=1.0)
+        mock_connection.assert_not_called()
+        self.assertEqual(post.location_status, Post.LOCATION_PENDING)
+
+    def test_resolve_pending_locations(self):
+        self.assertEqual(resolve_pending_locations(self.geocoder, batch_size=2), 2)
+        self.assertEqual(resolve_pending_locations(self.geocoder, batch_size=2), 1)
+
+        self.posts[0].refresh_from_db()
+        self.assertEqual(self.posts[0].location_status, Post.LOCATION_RESOLVED)
+        self.assertEqual(self.posts[0].location_name, "Fake place 55.872, -4.290")
+
+    def test_geocoder_down_leaves_posts_pending(self):
+        self.server.status = 503
+        with self.assertLogs('main.geocoding', 'WARNING'):
+            self.assertEqual(resolve_pending_locations(self.geocoder), 0)
+        self.assertEqual(Post.objects.filter(location_status=Post.LOCATION_PENDING).count(), 3)
+
+    def test_failing_post_backed_off(self):
+        reverse = self.geocoder.reverse
+
+        def fails_first_post(latitude, longitude):
+            if latitude == self.posts[0].latitude:
+                raise GeocodingError("Geocoder responded with HTTP 500")
+            return reverse(latitude, longitude)
+
+        with patch.object(self.geocoder, 'reverse', fails_first_post), self.assertLogs('main.geocoding', 'WARNING'):
+            self.assertEqual(resolve_pending_locations(self.geocoder, batch_size=1), 0)
+            self.assertEqual(resolve_pending_locations(self.geocoder, batch_size=1), 1)
+            self.assertEqual(resolve_pending_locations(self.geocoder, batch_size=1), 1)
+
+        post = Post.objects.get(pk=self.posts[0].pk)
+        self.assertEqual((post.location_status, post.location_attempts), (Post.LOCATION_PENDING, 1))
+        self.assertGreater(post.location_retry_time, timezone.now())
+        self.assertEqual(Post.objects.filter(location_status=Post.LOCATION_RESOLVED).count(), 2)
+
+        # Moving it gives it a fresh start
+        post.latitude = 10.0
+        post.save()
+        self.assertEqual((post.location_attempts, post.location_retry_time), (0, None))
+
+    def test_post_moved_during_lookup_not_overwritten(self):
+        reverse = self.geocoder.reverse
+
+        def moved_during_lookup(latitude, longitude):
+            moved = Post.objects.get(pk=self.posts[0].pk)
+            moved.latitude = 10.0
+            moved.save()
+            return reverse(latitude, longitude)
+
+        with patch.object(self.geocoder, 'reverse', moved_during_lookup):
+            self.assertEqual(resolve_pending_locations(self.geocoder, batch_size=1), 0)
+
+        post = Post.objects.get(pk=self.posts[0].pk)
+        self.assertEqual((post.latitude, post.location_status), (10.0, Post.LOCATION_PENDING))
+        self.assertFalse(Location.objects.filter(post_count__gt=0).exists())
+
+    def test_geocoder_down_stops_batch(self):
+        for i in range(3):
+            Post.objects.create(created_by=self.posts[0].created_by, caption="New", photo='test_image.jpg',
+                                latitude=20.0 + i, longitude=1.0)
+        self.server.status = 503
+        with self.assertLogs('main.geocoding', 'WARNING'):
+            resolve_pending_locations(self.geocoder)
+        self.assertEqual(len(self.server.requests), MAX_CONSECUTIVE_ERRORS)
+
+    def test_no_place_found(self):
+        self.server.place_name = lambda latitude, longitude: None
+        resolve_pending_locations(self.geocoder)
+        self.posts[0].refresh_from_db()
+        self.assertEqual(self.posts[0].location_status, Post.LOCATION_FAILED)
+        self.assertEqual(self.posts[0].location_name, "55.8724, -4.29")
+
+    def test_moving_post_geocodes_it_again(self):
+        resolve_pending_locations(self.geocoder)
+        post = Post.objects.get(pk=self.posts[0].pk)
+        post.caption = "Edited"
+        post.save()
+        self.assertEqual(post.location_status, Post.LOCATION_RESOLVED)
+
+        post.latitude = 10.0
+        post.save()
+        self.assertEqual(post.location_status, Post.LOCATION_PENDING)
+
+    def test_moved_post_counted_at_its_new_location(self):
+        resolve_pending_locations(self.geocoder)
+        post = Post.objects.get(pk=self.posts[0].pk)
+        old_location = post.location
+
+        post.latitude = 10.0
+        post.save()
+        old_location.refresh_from_db()
+        self.assertEqual(old_location.post_count, 0)
+
+        resolve_pending_locations(self.geocoder)
+        post.refresh_from_db()
+        self.assertNotEqual(post.location, old_location)
+        self.assertEqual((post.location.post_count, post.location.latitude), (1, 10.0))
+
+    def test_geocode_posts_command(self):
+        call_command('geocode_posts', url=self.server.url, min_interval=0, batch_size=2, stdout=StringIO())
+        self.assertFalse(Post.objects.filter(location_status=Post.LOCATION_PENDING).exists())
+
+    def test_rate_limiter(self):
+        rate_limiter = RateLimiter(0.05)
+        with patch('main.geocoding.time.sleep') as mock_sleep:
+            rate_limiter.wait()
+            rate_limiter.wait()
+        mock_sleep.assert_called_once()
+        self.assertGreater(mock_sleep.call_args[0][0], 0)
+
+
+class CachedGeocoderTestCase(TestCase):
+    def setUp(self):
+        default_geocoder().lru.clear()
+        self.server = FakeNominatimServer().start()
+        self.geocoder = CachedGeocoder(NominatimGeocoder(url=self.server.url, timeout=2), precision=4)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_nearby_coordinates_share_an_entry(self):
+        self.assertEqual(self.geocoder.reverse(55.87241, -4.29), "Fake place 55.872, -4.290")
+        self.assertEqual(self.geocoder.reverse(55.87239, -4.29001), "Fake place 55.872, -4.290")
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(self.geocoder.stats, {"memory_hits": 1, "database_hits": 0, "misses": 1})
+        self.assertEqual(self.geocoder.hit_rate(), 0.5)
+
+    def test_database_hit(self):
+        self.geocoder.reverse(55.8724, -4.29)
+
+        geocoder = CachedGeocoder(NominatimGeocoder(url=self.server.url, timeout=2), precision=4)
+        self.assertEqual(geocoder.reverse(55.8724, -4.29), "Fake place 55.872, -4.290")
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(geocoder.stats["database_hits"], 1)
+
+    def test_no_place_found_is_cached(self):
+        self.server.place_name = lambda latitude, longitude: None
+        self.assertIsNone(self.geocoder.reverse(0.0, 0.0))
+        self.assertIsNone(self.geocoder.reverse(0.0, 0.0))
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_expired_entry_is_looked_up_again(self):
+        geocoder = CachedGeocoder(NominatimGeocoder(url=self.server.url, timeout=2), precision=4, ttl=0)
+        geocoder.reverse(55.8724, -4.29)
+        geocoder.reverse(55.8724, -4.29)
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(GeocodeCache.objects.count(), 1)
+
+    def test_geocoder_error_is_not_cached(self):
+        self.server.status = 503
+        with self.assertRaises(GeocodingError):
+            self.geocoder.reverse(55.8724, -4.29)
+        self.assertFalse(GeocodeCache.objects.exists())
+
+    def test_save_uses_cached_location(self):
+        GeocodeCache.objects.create(key=default_geocoder().key(55.8724, -4.29), location_name="Glasgow")
+        user_profile = UserProfile.objects.create(user=User.objects.create_user(username='testuser'))
+        post = Post.objects.create(created_by=user_profile, caption="Post", photo='test_image.jpg',
+                                   latitude=55.87242, longitude=-4.29)
+        self.assertEqual(post.location_status, Post.LOCATION_RESOLVED)
+        self.assertEqual(post.location_name, "Glasgow")
+        default_geocoder().lru.clear()
+
+
+GAZETTEER_ROWS = [
+    # geonameid, name, asciiname, alternatenames, latitude, longitude, feature class, feature code, country code
+    ["2648579", "Glasgow", "Glasgow", "", "55.86515", "-4.25763", "P", "PPLA2", "GB"],
+    ["2650225", "Edinburgh", "Edinburgh", "", "55.95206", "-3.19648", "P", "PPLA", "GB"],
+    ["2643743", "London", "London", "", "51.50853", "-0.12574", "P", "PPLC", "GB"],
+    ["4030656", "Suva", "Suva", "", "-18.14161", "178.44149", "P", "PPLC", "FJ"],
+]
+
+
+class GazetteerGeocoderTestCase(TestCase):
+    def setUp(self):
+        f = tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False, encoding="utf-8")
+        with f:
+            f.write("\n".join("\t".join(row) for row in GAZETTEER_ROWS))
+        self.path = f.name
+        self.geocoder = GazetteerGeocoder(self.path, max_distance=25)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_nearest_place(self):
+        self.assertEqual(self.geocoder.reverse(55.8724, -4.29), "Glasgow, GB")
+        self.assertEqual(self.geocoder.reverse(55.94, -3.2), "Edinburgh, GB")
+
+    def test_across_the_antimeridian(self):
+        self.assertEqual(GazetteerGeocoder(self.path, max_distance=300).reverse(-18.2, -179.9), "Suva, FJ")
+
+    def test_too_far_from_any_place(self):
+        self.assertIsNone(self.geocoder.reverse(0.0, 0.0))
+
+    def test_missing_file(self):
+        with self.assertRaises(GeocodingError):
+            GazetteerGeocoder(self.path + ".missing").reverse(55.8724, -4.29)
+
+    def test_kd_tree_matches_brute_force(self):
+        rng = random.Random(10)
+        places = [(f"Place {i}", rng.uniform(-90, 90), rng.uniform(-180, 180)) for i in range(500)]
+        gazetteer = Gazetteer(places)
+        points = [to_unit_vector(latitude, longitude) for _, latitude, longitude in places]
+
+        for _ in range(200):
+            query = to_unit_vector(rng.uniform(-90, 90), rng.uniform(-180, 180))
+            expected = min(range(len(points)), key=lambda i: sum((a - b) ** 2 for a, b in zip(points[i], query)))
+            self.assertEqual(gazetteer.tree.nearest(query)[0], expected)
+
+    def test_empty_tree(self):
+        self.assertIsNone(KDTree([]).nearest((1.0, 0.0, 0.0))[0])
+
+    def test_chain_falls_back_when_geocoder_is_down(self):
+        with FakeNominatimServer() as server:
+            server.status = 429
+            chain = GeocoderChain([NominatimGeocoder(url=server.url, timeout=2), self.geocoder])
+            self.assertEqual(chain.reverse(55.8724, -4.29), "Glasgow, GB")
+
+            # Nothing found nearby, the lookup should be retried once the geocoder is back
+            with self.assertRaises(GeocodingError):
+                chain.reverse(0.0, 0.0)
+
+    def test_backends_setting(self):
+        with override_settings(GEOCODER_BACKENDS=["gazetteer"], GEOCODER_GAZETTEER_PATH=self.path):
+            self.assertIsInstance(build_geocoder(), GazetteerGeocoder)
+        with override_settings(GEOCODER_BACKENDS=["nominatim", "gazetteer"], GEOCODER_GAZETTEER_PATH=self.path):
+            self.assertIsInstance(build_geocoder(), GeocoderChain)
+
+    def test_geocode_posts_command_with_gazetteer(self):
+        default_geocoder().lru.clear()
+        user_profile = UserProfile.objects.create(user=User.objects.create_user(username='testuser'))
+        post = Post.objects.create(created_by=user_profile, caption="Post", photo='test_image.jpg',
+                                   latitude=55.8724, longitude=-4.29)
+
+        with override_settings(GEOCODER_GAZETTEER_PATH=self.path):
+            call_command('geocode_posts', backends=["gazetteer"], stdout=StringIO())
+
+        post.refresh_from_db()
+        self.assertEqual(post.location_name, "Glasgow, GB")
+        default_geocoder().lru.clear()
@@ -1,11 +1,28 @@
 import json
-from django.test import TestCase, RequestFactory
+from django.test import TestCase, TransactionTestCase, RequestFactory
+from django.db import connection, IntegrityError, OperationalError
+import threading
+import time
 from django.urls import reverse
 from django.core.exceptions import ValidationError
 from django.contrib.auth.models import User
 from main.models import *
+from main import geo, processing, renditions, storage
+from django.db import transaction
+from django.templatetags.static import static
+from datetime import timedelta
+from django.core.files.storage import default_storage
+from django.test import override_settings
+from PIL import ExifTags, Image
+import os
+import shutil
+import tempfile
+from django.core.management import call_command, CommandError
+from io import BytesIO, StringIO
 from django.core.files.uploadedfile import SimpleUploadedFile
-from unittest.mock import patch
+from unittest.mock import Mock, patch
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
 
 # run tests with command - python .\manage.py test tests.photoGraph.test_models
 # all test cases pass as of 22/03/2024 14:30
@@ -57,6 +74,367 @@ class PostModelTestCase(TestCase):
         self.assertEqual(self.post.latitude, 55.00)
         self.assertEqual(self.post.longitude, -4.00)
 
+class PostSpatialIndexTestCase(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username='testuser', password='testpass123')
+        self.user_profile = UserProfile.objects.create(user=user)
+        self.glasgow = Post.objects.create(created_by=self.user_profile, caption="Glasgow", photo="glasgow.jpg",
+                                           latitude=55.8724, longitude=-4.2900)
+        self.edinburgh = Post.objects.create(created_by=self.user_profile, caption="Edinburgh", photo="edinburgh.jpg",
+                                             latitude=55.9533, longitude=-3.1883)
+
+    def test_geohash_set_on_save(self):
+        self.assertEqual(self.glasgow.geohash, geo.encode(55.8724, -4.2900))
+
+    def test_in_bbox(self):
+        posts = Post.objects.in_bbox(55.86, -4.30, 55.88, -4.27)
+        self.assertEqual(list(posts), [self.glasgow])
+
+    def test_backfill_geohash_command(self):
+        Post.objects.update(geohash="")
+        call_command('backfill_geohash', stdout=StringIO())
+        self.glasgow.refresh_from_db()
+        self.assertEqual(self.glasgow.geohash, geo.encode(55.8724, -4.2900))
+
+class LocationModelTestCase(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username='testuser', password='testpass123')
+        self.user_profile = UserProfile.objects.create(user=user)
+
+    def create_post(self, latitude, longitude, location_name):
+        post = Post(created_by=self.user_profile, caption="Post", photo="post.jpg", latitude=latitude,
+                    longitude=longitude)
+        post.set_location(location_name)
+        post.save()
+        return post
+
+    def test_posts_share_a_location(self):
+        first = self.create_post(55.0, -4.0, "Glasgow")
+        second = self.create_post(56.0, -5.0, "Glasgow")
+        self.assertEqual(first.location_id, second.location_id)
+
+        location = Location.objects.get(name="Glasgow")
+        self.assertEqual(location.post_count, 2)
+        self.assertAlmostEqual(location.latitude, 55.5)
+        self.assertAlmostEqual(location.longitude, -4.5)
+
+    def test_relocating_a_post(self):
+        post = self.create_post(55.0, -4.0, "Glasgow")
+        self.create_post(56.0, -5.0, "Glasgow")
+
+        post = Post.objects.get(pk=post.pk)
+        post.latitude, post.longitude = 51.5, -0.1
+        post.set_location("London")
+        post.save()
+
+        glasgow = Location.objects.get(name="Glasgow")
+        self.assertEqual(glasgow.post_count, 1)
+        self.assertAlmostEqual(glasgow.latitude, 56.0)
+        self.assertEqual(Location.objects.get(name="London").post_count, 1)
+
+    def test_moving_a_post_to_an_unknown_place(self):
+        post = self.create_post(55.0, -4.0, "Glasgow")
+        self.create_post(56.0, -5.0, "Glasgow")
+
+        post = Post.objects.get(pk=post.pk)
+        post.latitude, post.longitude = 10.0, 10.0
+        post.save()
+        self.assertEqual(post.location_status, Post.LOCATION_PENDING)
+        self.assertIsNone(post.location)
+
+        glasgow = Location.objects.get(name="Glasgow")
+        self.assertEqual(glasgow.post_count, 1)
+        self.assertAlmostEqual(glasgow.latitude, 56.0)
+
+    def test_editing_a_post_keeps_the_count(self):
+        post = self.create_post(55.0, -4.0, "Glasgow")
+        post = Post.objects.get(pk=post.pk)
+        post.caption = "Edited"
+        post.save()
+        self.assertEqual(Location.objects.get(name="Glasgow").post_count, 1)
+
+    def test_deleting_a_post(self):
+        post = self.create_post(55.0, -4.0, "Glasgow")
+        self.create_post(56.0, -5.0, "Glasgow")
+        Post.objects.get(pk=post.pk).delete()
+
+        location = Location.objects.get(name="Glasgow")
+        self.assertEqual(location.post_count, 1)
+        self.assertAlmostEqual(location.latitude, 56.0)
+
+        self.user_profile.delete()
+        self.assertEqual(Location.objects.get(name="Glasgow").post_count, 0)
+
+    def test_failed_geocode_location(self):
+        post = self.create_post(55.0, -4.0, None)
+        self.assertEqual(post.location.name, "55.0, -4.0")
+
+class UploadTestMixin:
+    # Uploads are processed once the transaction saving them commits, so these can't run inside one
+    def setUp(self):
+        self.media_root, self.upload_dir = tempfile.mkdtemp(), tempfile.mkdtemp()
+        for directory in (self.media_root, self.upload_dir):
+            self.addCleanup(shutil.rmtree, directory)
+        media = override_settings(MEDIA_ROOT=self.media_root, UPLOAD_PROCESSING_DIR=self.upload_dir,
+                                  UPLOAD_PROCESSING_WORKERS=0)
+        media.enable()
+        self.addCleanup(media.disable)
+
+        self.user_profile = UserProfile.objects.create(user=User.objects.create_user(username='testuser', password='testpass123'))
+        with open('tests/photoGraph/test_images/test_image.jpg', 'rb') as image_file:
+            self.image = image_file.read()
+
+    def create_post(self, photo, user_profile=None):
+        post = Post.objects.create(created_by=user_profile or self.user_profile, caption="Post", photo=photo,
+                                   latitude=55.8724, longitude=-4.2900)
+        post.refresh_from_db()
+        return post
+
+    def upload(self, name='test_image.jpg', image=None):
+        return SimpleUploadedFile(name, image or self.image, content_type='image/jpeg')
+
+
+class PhotoRenditionTestCase(UploadTestMixin, TransactionTestCase):
+    def test_upload_rendered(self):
+        post = self.create_post(self.upload())
+        self.assertEqual(post.photo_status, renditions.STATUS_RENDERED)
+        self.assertTrue(default_storage.exists(post.photo.name))
+        self.assertEqual(os.listdir(os.path.join(self.upload_dir, 'post_photos')), [])
+        for size, pixels in renditions.RENDITIONS.items():
+            name = renditions.rendition_name(post.photo.name, size)
+            self.assertEqual(post.rendition_url(size), default_storage.url(name))
+            with default_storage.open(name) as f:
+                self.assertEqual(max(Image.open(f).size), pixels)
+            with default_storage.open(renditions.variant_name(name, '.webp')) as f:
+                image = Image.open(f)
+                self.assertEqual((image.format, max(image.size)), ('WEBP', pixels))
+
+    def test_public_copy_upright_without_metadata(self):
+        exif = Image.Exif()
+        exif[ExifTags.Base.Orientation] = 6
+        exif[ExifTags.Base.GPSInfo] = {ExifTags.GPS.GPSLatitudeRef: 'N', ExifTags.GPS.GPSLatitude: (55.0, 52.0, 20.0)}
+        buffer = BytesIO()
+        Image.new('RGB', (400, 300), 'red').save(buffer, 'JPEG', exif=exif)
+
+        post = self.create_post(self.upload('sideways.jpg', buffer.getvalue()))
+        for name in [post.photo.name, renditions.rendition_name(post.photo.name, 'card')]:
+            with default_storage.open(name) as f:
+                image = Image.open(f)
+                self.assertEqual(image.size, (300, 400))
+                self.assertEqual(dict(image.getexif()), {})
+
+    def test_processing_until_committed(self):
+        with transaction.atomic():
+            post = Post.objects.create(created_by=self.user_profile, caption="Post", photo=self.upload(),
+                                       latitude=55.8724, longitude=-4.2900)
+            self.assertEqual(post.photo_status, renditions.STATUS_PROCESSING)
+            self.assertEqual(post.rendition_url('card'), static(renditions.PROCESSING_PLACEHOLDER))
+            self.assertFalse(default_storage.exists(post.photo.name))
+
+        post.refresh_from_db()
+        self.assertEqual(post.photo_status, renditions.STATUS_RENDERED)
+
+    def test_processed_in_worker_process(self):
+        self.addCleanup(setattr, processing, '_pool', None)
+        with override_settings(UPLOAD_PROCESSING_WORKERS=1):
+            post = Post.objects.create(created_by=self.user_profile, caption="Post", photo=self.upload(),
+                                       latitude=55.8724, longitude=-4.2900)
+            processing.pool().shutdown(wait=True)
+
+        # The result is saved by a thread of this process once the worker is done
+        for _ in range(50):
+            post.refresh_from_db()
+            if post.photo_status != renditions.STATUS_PROCESSING:
+                break
+            time.sleep(0.1)
+        self.assertEqual(post.photo_status, renditions.STATUS_RENDERED)
+        self.assertTrue(default_storage.exists(renditions.rendition_name(post.photo.name, 'icon')))
+
+    def test_failed_worker_keeps_upload_private(self):
+        failed = Future()
+        failed.set_exception(RuntimeError("Worker died"))
+        with override_settings(UPLOAD_PROCESSING_WORKERS=1), patch('main.processing.pool') as pool, \
+                self.assertLogs('main.processing', 'ERROR'):
+            pool.return_value.submit.return_value = failed
+            post = self.create_post(self.upload())
+
+        post.refresh_from_db()
+        self.assertEqual(post.photo_status, renditions.STATUS_FAILED)
+        self.assertEqual(post.rendition_url('card'), static(renditions.FAILED_PLACEHOLDER))
+        self.assertFalse(default_storage.exists(post.photo.name))
+        self.assertTrue(processing.upload_storage().exists(post.photo.name))
+
+    def test_broken_pool_replaced(self):
+        broken = Future()
+        broken.set_exception(BrokenProcessPool("A worker died"))
+        broken_pool, new_pool = Mock(), Mock()
+        broken_pool.submit.return_value = broken
+
+        def submit(fn, *args):
+            future = Future()
+            future.set_result(fn(*args))
+            return future
+        new_pool.submit.side_effect = submit
+
+        with override_settings(UPLOAD_PROCESSING_WORKERS=1), \
+                patch('main.processing.pool', side_effect=[broken_pool, new_pool]):
+            post = self.create_post(self.upload())
+
+        broken_pool.shutdown.assert_called_once_with(wait=False)
+        post.refresh_from_db()
+        self.assertEqual(post.photo_status, renditions.STATUS_RENDERED)
+
+    def test_profile_picture_rendered(self):
+        self.user_profile.profile_picture = self.upload()
+        self.user_profile.save()
+        self.user_profile.refresh_from_db()
+        self.assertEqual(self.user_profile.profile_picture_status, renditions.STATUS_RENDERED)
+        self.assertTrue(default_storage.exists(renditions.rendition_name(self.user_profile.profile_picture.name, 'full')))
+
+    def test_unrendered_photos_shown_as_they_are(self):
+        post = self.create_post('post_photos/test_image.jpg')
+        self.assertEqual(post.photo_status, renditions.STATUS_ORIGINAL)
+        self.assertEqual(post.rendition_url('card'), post.photo.url)
+
+        self.assertEqual(self.user_profile.rendition_url('icon'), self.user_profile.profile_picture.url)
+
+    def test_undecodable_upload_kept_private(self):
+        post = self.create_post(self.upload('broken.jpg', b'not an image'))
+        self.assertEqual(post.photo_status, renditions.STATUS_FAILED)
+        self.assertEqual(post.rendition_url('card'), static(renditions.FAILED_PLACEHOLDER))
+        self.assertFalse(default_storage.exists(post.photo.name))
+
+    def test_render_photos_command(self):
+        default_storage.save('post_photos/test_image.jpg', SimpleUploadedFile('test_image.jpg', self.image))
+        post = self.create_post('post_photos/test_image.jpg')
+
+        out = StringIO()
+        call_command('render_photos', stdout=out)
+        post.refresh_from_db()
+        self.assertEqual(post.photo_status, renditions.STATUS_RENDERED)
+        self.assertTrue(default_storage.exists(renditions.rendition_name(post.photo.name, 'icon')))
+        self.assertIn("Rendered 1 posts.", out.getvalue())
+
+    def test_render_photos_command_processes_stuck_uploads(self):
+        with patch('main.processing.transaction.on_commit'):
+            post = self.create_post(self.upload())
+        self.assertEqual(post.photo_status, renditions.STATUS_PROCESSING)
+
+        call_command('render_photos', stdout=StringIO())
+        post.refresh_from_db()
+        self.assertEqual(post.photo_status, renditions.STATUS_PROCESSING)
+
+        with patch('main.management.commands.render_photos.Command.STUCK_AFTER', timedelta(0)):
+            call_command('render_photos', stdout=StringIO())
+        post.refresh_from_db()
+        self.assertEqual(post.photo_status, renditions.STATUS_RENDERED)
+
+class ContentAddressedStorageTestCase(UploadTestMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        # Unused files are deleted straight away unless a test says otherwise
+        grace = patch('main.storage.UNUSED_CONTENT_GRACE', timedelta(0))
+        grace.start()
+        self.addCleanup(grace.stop)
+
+    def stored_files(self):
+        return sorted(os.path.relpath(os.path.join(directory, name), self.media_root)
+                      for directory, _, names in os.walk(os.path.join(self.media_root, 'content')) for name in names)
+
+    def test_identical_uploads_stored_once(self):
+        first, second = self.create_post(self.upload()), self.create_post(self.upload('copy.jpg'))
+        self.assertEqual(first.photo.name, second.photo.name)
+        self.assertRegex(first.photo.name, r'^content/([0-9a-f]{2})/([0-9a-f]{2})/\1\2[0-9a-f]{60}\.jpg$')
+        self.assertEqual(self.stored_files(), [first.photo.name])
+        self.assertEqual(StoredFile.objects.get(name=first.photo.name).references, 2)
+
+        other = self.create_post(self.upload('other.png', b'not an image'))
+        self.assertNotEqual(other.photo.name, first.photo.name)
+        self.assertTrue(other.photo.name.endswith('.png'))
+
+    def test_unused_files_collected(self):
+        first, second = self.create_post(self.upload()), self.create_post(self.upload())
+        name = first.photo.name
+
+        first.delete()
+        self.assertTrue(default_storage.exists(name))
+        self.assertEqual(StoredFile.objects.get(name=name).references, 1)
+
+        second.delete()
+        self.assertFalse(StoredFile.objects.filter(name=name).exists())
+        self.assertEqual(self.stored_files(), [])
+        self.assertFalse(default_storage.exists(renditions.rendition_name(name, 'card')))
+        self.assertFalse(default_storage.exists(renditions.variant_name(renditions.rendition_name(name, 'card'), '.webp')))
+
+    def test_replaced_profile_picture_collected(self):
+        self.user_profile.profile_picture = self.upload()
+        self.user_profile.save()
+        self.user_profile.refresh_from_db()
+        old_name = self.user_profile.profile_picture.name
+
+        buffer = BytesIO()
+        Image.new('RGB', (40, 30), 'blue').save(buffer, 'PNG')
+        self.user_profile.profile_picture = self.upload('new.png', buffer.getvalue())
+        self.user_profile.save()
+        self.user_profile.refresh_from_db()
+        self.assertEqual(self.stored_files(), [self.user_profile.profile_picture.name])
+        self.assertFalse(StoredFile.objects.filter(name=old_name).exists())
+
+    def test_deleted_user_files_collected(self):
+        other_profile = UserProfile.objects.create(user=User.objects.create_user(username='other', password='testpass123'))
+        shared = self.create_post(self.upload())
+        self.create_post(self.upload(), other_profile)
+        self.create_post(self.upload('other.png', b'not an image'), other_profile)
+        other_profile.profile_picture = self.upload('picture.gif', b'not an image either')
+        other_profile.save()
+
+        other_profile.user.delete()
+        self.assertEqual(self.stored_files(), [shared.photo.name])
+        self.assertEqual(list(StoredFile.objects.values_list('name', 'references')), [(shared.photo.name, 1)])
+
+    def test_recently_saved_unused_file_kept(self):
+        with patch('main.storage.UNUSED_CONTENT_GRACE', timedelta(minutes=10)):
+            post = self.create_post(self.upload())
+            post.delete()
+            # An identical upload being processed may be about to use it
+            self.assertEqual(self.stored_files(), [post.photo.name])
+            call_command('render_photos', stdout=StringIO())
+            self.assertEqual(self.stored_files(), [post.photo.name])
+
+            # Saving it again counts as using it
+            path = storage.content_storage.path(post.photo.name)
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path, (0, 0))
+            storage.content_storage.save('copy.jpg', BytesIO(data))
+            self.assertGreater(os.path.getmtime(path), 0)
+
+            os.utime(path, (0, 0))
+            out = StringIO()
+            call_command('render_photos', stdout=out)
+        self.assertEqual(self.stored_files(), [])
+        self.assertIn("Deleted 1 unused stored files.", out.getvalue())
+
+    def test_acquire_counts_row_made_concurrently(self):
+        name = 'content/ab/cd/abcd.jpg'
+        StoredFile.objects.create(name=name, references=1)
+        update = StoredFileQuerySet.update
+        calls = []
+
+        def update_before_row_made(queryset, **kwargs):
+            # The first update misses the row, as if another save made it just after
+            calls.append(kwargs)
+            return 0 if len(calls) == 1 else update(queryset, **kwargs)
+
+        with patch.object(StoredFileQuerySet, 'update', update_before_row_made):
+            StoredFile.objects.acquire(name)
+        self.assertEqual(StoredFile.objects.get(name=name).references, 2)
+
+        StoredFile.objects.release(name)
+        StoredFile.objects.release(name)
+        StoredFile.objects.acquire(name)
+        self.assertEqual(StoredFile.objects.get(name=name).references, 1)
+
 class CommentModelTestCase(TestCase):
     def setUp(self):
         user = User.objects.create_user(username='testuser', password='testpass123')
@@ -141,6 +519,114 @@ class LikeModelTestCase(TestCase):
         expected_str = f"{self.user_profile} likes {self.post.slug}"
         self.assertEqual(str(like), expected_str)
 
+    def test_like_count_follows_likes(self):
+        like = Like.objects.create(user=self.user_profile, post=self.post)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 1)
+
+        like.delete()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 0)
+
+    def test_duplicate_like_rejected(self):
+        Like.objects.create(user=self.user_profile, post=self.post)
+        with self.assertRaises(IntegrityError):
+            Like.objects.create(user=self.user_profile, post=self.post)
+
+    def test_toggle(self):
+        self.assertTrue(Like.objects.toggle(self.post, self.user_profile))
+        self.assertFalse(Like.objects.toggle(self.post, self.user_profile))
+        self.assertFalse(Like.objects.filter(post=self.post).exists())
+
+    def test_saving_stale_post_keeps_like_count(self):
+        Like.objects.create(user=self.user_profile, post=self.post)
+        self.post.caption = "Edited caption"
+        self.post.save()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 1)
+
+    def test_rebuild_like_counts_command(self):
+        Like.objects.create(user=self.user_profile, post=self.post)
+        Post.objects.update(like_count=5)
+
+        with self.assertRaises(CommandError):
+            call_command('rebuild_like_counts', '--check', stdout=StringIO())
+
+        call_command('rebuild_like_counts', stdout=StringIO())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 1)
+        call_command('rebuild_like_counts', '--check', stdout=StringIO())
+
+class LikeToggleConcurrencyTestCase(TransactionTestCase):
+    def setUp(self):
+        self.post_creator_profile = UserProfile.objects.create(user=User.objects.create_user(username='postcreator'))
+        self.post = Post.objects.create(
+            created_by=self.post_creator_profile,
+            caption="Sample Post",
+            photo="post_photo.jpg",
+            latitude=0.0,
+            longitude=0.0
+        )
+        self.user_profiles = [
+            UserProfile.objects.create(user=User.objects.create_user(username=f'liker{i}')) for i in range(4)
+        ]
+
+    def hammer(self, user_profiles, toggles_per_thread):
+        barrier = threading.Barrier(len(user_profiles))
+        errors = []
+
+        def toggle(user_profile):
+            try:
+                barrier.wait()
+                for _ in range(toggles_per_thread):
+                    while True:
+                        try:
+                            Like.objects.toggle(self.post, user_profile)
+                            break
+                        except OperationalError as e:
+                            # SQLite's shared in-memory test database reports lock contention rather than waiting
+                            if 'locked' not in str(e):
+                                raise
+                            time.sleep(0.001)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=toggle, args=(user_profile,)) for user_profile in user_profiles]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_concurrent_toggles_leave_no_duplicates(self):
+        # Several threads toggling the same like at once, like a burst of double clicks
+        self.hammer([self.user_profiles[0]] * 8, 25)
+
+        likes = Like.objects.filter(post=self.post, user=self.user_profiles[0]).count()
+        self.assertLessEqual(likes, 1)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, likes)
+
+    def test_concurrent_likes_are_all_counted(self):
+        self.hammer(self.user_profiles, 3)
+
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, len(self.user_profiles))
+        self.assertEqual(Like.objects.filter(post=self.post).count(), len(self.user_profiles))
+
+    def test_concurrent_unlikes_count_once(self):
+        # Two requests unliking the same like, only one of them can delete it
+        for _ in range(10):
+            Like.objects.toggle(self.post, self.user_profiles[0])
+            self.hammer([self.user_profiles[0]] * 2, 1)
+
+            likes = Like.objects.filter(post=self.post, user=self.user_profiles[0]).count()
+            self.post.refresh_from_db()
+            self.assertEqual(self.post.like_count, likes)
+            Like.objects.filter(post=self.post).delete()
+
 class ContactUsModelTestCase(TestCase):
     def setUp(self):
         self.contact_us = ContactUs.objects.create(
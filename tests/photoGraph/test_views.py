@@ -1,5 +1,6 @@
+import json
 import importlib
-from django.test import TestCase, RequestFactory, Client
+from django.test import TestCase, RequestFactory, Client, SimpleTestCase
 
 from django.urls import reverse, resolve
 from django.contrib import messages
@@ -8,12 +9,31 @@ from django.contrib.auth.models import User
 from main.views import *
 from main import urls
 from main.models import *
+from main import geo, nearby, regions, renditions, resizing, storage, tiles
+from django.core.cache import cache
+from unittest import skipUnless
 from unittest.mock import patch
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.storage import default_storage
+from django.test import override_settings
+from django.conf import settings
+from PIL import Image
+from io import BytesIO
+import math
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
 
 # run tests with command - python .\manage.py test tests.photoGraph.test_views
 # all test cases pass as of 22/03/2024 14:30
 
+# Tests counting queries use a local memory cache, so the shared database cache's own queries aren't counted, as do
+# tests using the cache from several threads, which SQLite's in-memory test database can't share a table between
+LOCAL_MEMORY_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
 class IndexViewTestCase(TestCase): 
     def test_index_view(self):
         response = self.client.get(reverse('main:index'))
@@ -641,3 +661,713 @@ class MyAccountViewTestCase(TestCase):
         self.assertIn(post2, response.context['posts'])
 
 
+
+@override_settings(CACHES=LOCAL_MEMORY_CACHES)
+class GetPostsJsonViewTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpassword123')
+        self.user_profile = UserProfile.objects.create(user=self.user)
+        self.glasgow_posts = [
+            Post.objects.create(created_by=self.user_profile, caption=f"Glasgow {i}", photo=f'glasgow_{i}.jpg',
+                                latitude=55.8724 + i * 0.001, longitude=-4.2900)
+            for i in range(3)
+        ]
+        self.edinburgh_post = Post.objects.create(created_by=self.user_profile, caption="Edinburgh", photo='edinburgh.jpg',
+                                                  latitude=55.9533, longitude=-3.1883)
+        Like.objects.create(post=self.glasgow_posts[1], user=self.user_profile)
+
+    def get_posts_json(self, nwLat, nwLon, seLat, seLon, **params):
+        params.update({'nwLat': nwLat, 'nwLon': nwLon, 'seLat': seLat, 'seLon': seLon})
+        return self.client.get(reverse('main:get_posts_json'), params)
+
+    def test_posts_in_bounds(self):
+        response = self.get_posts_json(55.88, -4.30, 55.86, -4.28, zoom=15)
+        self.assertEqual(response.status_code, 200)
+        posts = [post for location in response.json().values() for post in location]
+        self.assertEqual(len(posts), 3)
+
+    def test_clusters_when_zoomed_out(self):
+        response = self.get_posts_json(57.0, -6.0, 55.0, -2.0, zoom=7)
+        self.assertEqual(response.status_code, 200)
+        clusters = response.json()['clusters']
+        self.assertEqual(sorted(cluster['count'] for cluster in clusters), [1, 3])
+
+        glasgow = next(cluster for cluster in clusters if cluster['count'] == 3)
+        self.assertEqual(glasgow['photo_url'], self.glasgow_posts[1].photo.url)
+        self.assertAlmostEqual(glasgow['lat'], 55.8734)
+
+    def test_clusters_bounded_for_wide_viewport(self):
+        rng = random.Random(2)
+        for _ in range(100):
+            Post.objects.create(created_by=self.user_profile, caption="Post", photo='test_image.jpg',
+                                latitude=rng.uniform(-80, 80), longitude=rng.uniform(-179, 179))
+        with patch('main.views.MAX_CLUSTERS', 32):
+            response = self.get_posts_json(85.0, -180.0, -85.0, 180.0, zoom=CLUSTER_ZOOM - 1)
+        clusters = response.json()['clusters']
+        self.assertLessEqual(len(clusters), 32)
+        self.assertEqual(sum(cluster['count'] for cluster in clusters), Post.objects.count())
+
+    def test_invalid_zoom(self):
+        response = self.get_posts_json(57.0, -6.0, 55.0, -2.0, zoom='far')
+        self.assertEqual(response.status_code, 400)
+
+    def page_captions(self, response):
+        return [post['caption'] for location in response.json().values() for post in location]
+
+    def test_pages_by_likes(self):
+        Like.objects.create(post=self.glasgow_posts[2], user=UserProfile.objects.create(
+            user=User.objects.create_user(username='other')))
+        Like.objects.create(post=self.glasgow_posts[2], user=self.user_profile)
+
+        response = self.get_posts_json(57.0, -6.0, 55.0, -2.0, limit=2)
+        self.assertEqual(self.page_captions(response), ["Glasgow 2", "Glasgow 1"])
+
+        response = self.get_posts_json(57.0, -6.0, 55.0, -2.0, limit=2, cursor=response['X-Next-Cursor'])
+        self.assertCountEqual(self.page_captions(response), ["Edinburgh", "Glasgow 0"])
+        self.assertNotIn('X-Next-Cursor', response)
+
+    def test_pages_by_recency(self):
+        captions = []
+        cursor = None
+        while True:
+            params = {'limit': 3, 'order': 'recent'}
+            if cursor:
+                params['cursor'] = cursor
+            response = self.get_posts_json(57.0, -6.0, 55.0, -2.0, **params)
+            captions += self.page_captions(response)
+            cursor = response.get('X-Next-Cursor')
+            if cursor is None:
+                break
+        self.assertEqual(captions, ["Edinburgh", "Glasgow 2", "Glasgow 1", "Glasgow 0"])
+
+    @patch('main.views.POSTS_MAX_LIMIT', 2)
+    def test_limit_is_capped(self):
+        response = self.get_posts_json(57.0, -6.0, 55.0, -2.0, limit=1000)
+        self.assertEqual(len(self.page_captions(response)), 2)
+        self.assertIn('X-Next-Cursor', response)
+
+    def test_only_newly_exposed_posts(self):
+        # The Glasgow posts were loaded with the previous view, panning east to take in Edinburgh
+        response = self.get_posts_json(56.0, -4.4, 55.8, -3.1, loaded='55.8,-4.4,56.0,-4.0')
+        self.assertEqual(self.page_captions(response), ["Edinburgh"])
+
+        response = self.get_posts_json(56.0, -4.4, 55.8, -3.1, loaded=['55.8,-4.4,56.0,-4.0', '55.9,-3.5,56.0,-3.0'])
+        self.assertEqual(self.page_captions(response), [])
+
+    def test_invalid_loaded(self):
+        for loaded in ['55.8,-4.4,56.0', 'a,b,c,d', ['0,0,1,1'] * (MAX_LOADED_BOXES + 1), 'nan,-4.4,56.0,-4.0',
+                       '55.8,-inf,56.0,-4.0', '56.0,-4.4,55.8,-4.0', '55.8,-4.0,56.0,-4.4']:
+            self.assertEqual(self.get_posts_json(56.0, -4.4, 55.8, -3.1, loaded=loaded).status_code, 400)
+
+    def stream(self, **params):
+        response = self.get_posts_json(57.0, -6.0, 55.0, -2.0, format='stream', **params)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(b''.join(response.streaming_content))
+
+    def test_stream_matches_grouped_response(self):
+        grouped = self.get_posts_json(57.0, -6.0, 55.0, -2.0).json()
+        streamed = self.stream()
+        self.assertEqual(streamed['posts'], [post for location in grouped.values() for post in location])
+        self.assertIsNone(streamed['next_cursor'])
+
+    @patch('main.streaming.CHUNK_SIZE', 2)
+    def test_stream_pages(self):
+        for limit in range(1, 5):
+            first = self.stream(limit=limit, order='recent')
+            self.assertEqual(len(first['posts']), limit)
+            if limit < 4:
+                rest = self.stream(order='recent', cursor=first['next_cursor'])
+                self.assertEqual(len(rest['posts']), 4 - limit)
+            else:
+                self.assertIsNone(first['next_cursor'])
+
+    def test_columnar_matches_grouped_response(self):
+        grouped = [post for location in self.get_posts_json(57.0, -6.0, 55.0, -2.0).json().values() for post in location]
+        data = self.get_posts_json(57.0, -6.0, 55.0, -2.0, format='columnar').json()
+        templates, columns = data['url_templates'], data['posts']
+        self.assertEqual(data['users'], [self.user_profile.slug])
+        self.assertIsNone(data['next_cursor'])
+
+        for i, post in enumerate(grouped):
+            user, location = data['users'][columns['user'][i]], data['locations'][columns['location'][i]]
+            self.assertEqual(post['caption'], columns['caption'][i])
+            self.assertEqual(post['likes'], columns['likes'][i])
+            self.assertEqual(post['location_name'], location)
+            self.assertEqual(post['location_url'], templates['location'].format(location=location))
+            self.assertEqual(post['post_url'], templates['post'].format(user=user, slug=columns['slug'][i]))
+            self.assertEqual(post['user_url'], templates['user'].format(user=user))
+            self.assertEqual(post['photo_url'], templates['photo'].format(photo=columns['photo'][i]))
+
+    def test_columnar_pages(self):
+        first = self.get_posts_json(57.0, -6.0, 55.0, -2.0, format='columnar', limit=3).json()
+        rest = self.get_posts_json(57.0, -6.0, 55.0, -2.0, format='columnar', cursor=first['next_cursor']).json()
+        self.assertEqual(len(first['posts']['id']), 3)
+        self.assertEqual(len(rest['posts']['id']), 1)
+        self.assertNotIn(rest['posts']['id'][0], first['posts']['id'])
+
+    def test_invalid_paging(self):
+        response = self.get_posts_json(57.0, -6.0, 55.0, -2.0, limit=2, order='recent')
+        for params in [{'cursor': 'not a cursor'}, {'cursor': response['X-Next-Cursor']}, {'limit': 0},
+                       {'limit': 'all'}, {'order': 'random'}, {'format': 'xml'},
+                       {'format': 'stream', 'cursor': response['X-Next-Cursor']}]:
+            self.assertEqual(self.get_posts_json(57.0, -6.0, 55.0, -2.0, **params).status_code, 400)
+
+    def test_photos_at_rendition_sizes(self):
+        Post.objects.update(photo_status='rendered')
+        self.glasgow_posts[0].refresh_from_db()
+        card, icon = self.glasgow_posts[0].rendition_url('card'), self.glasgow_posts[0].rendition_url('icon')
+        self.assertIn('/renditions/card/', card)
+
+        grouped = [post for location in self.get_posts_json(55.88, -4.30, 55.86, -4.28, order='recent').json().values() for post in location]
+        streamed = self.stream(order='recent')['posts']
+        self.assertEqual((grouped[-1]['photo_url'], grouped[-1]['icon_url']), (card, icon))
+        self.assertEqual((streamed[-1]['photo_url'], streamed[-1]['icon_url']), (card, icon))
+
+        data = self.get_posts_json(57.0, -6.0, 55.0, -2.0, format='columnar', order='recent').json()
+        self.assertEqual(data['url_templates']['photo'].format(photo=data['posts']['icon'][-1]), icon)
+
+    def test_not_modified(self):
+        etag = self.get_posts_json(55.88, -4.30, 55.86, -4.28)['ETag']
+        response = self.client.get(reverse('main:get_posts_json'), {'nwLat': 55.88, 'nwLon': -4.30, 'seLat': 55.86,
+                                                                    'seLon': -4.28}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_repeat_request_served_from_cache(self):
+        first = self.get_posts_json(55.88, -4.30, 55.86, -4.28, limit=2)
+        with self.assertNumQueries(0):
+            repeat = self.get_posts_json(55.88, -4.30, 55.86, -4.28, limit=2)
+        self.assertEqual(repeat.content, first.content)
+        self.assertEqual(repeat['X-Next-Cursor'], first['X-Next-Cursor'])
+
+        # Nearly the same viewport snaps to the same cached response
+        self.assertEqual(self.get_posts_json(55.8795, -4.2995, 55.8605, -4.2805, limit=2)['ETag'], first['ETag'])
+
+    def test_changes_in_view_change_etag(self):
+        etag = self.get_posts_json(55.88, -4.30, 55.86, -4.28)['ETag']
+        Post.objects.create(created_by=self.user_profile, caption="Far away", photo='far.jpg', latitude=-33.9, longitude=18.4)
+        self.assertEqual(self.get_posts_json(55.88, -4.30, 55.86, -4.28)['ETag'], etag)
+
+        Like.objects.create(post=self.glasgow_posts[0], user=self.user_profile)
+        response = self.get_posts_json(55.88, -4.30, 55.86, -4.28)
+        self.assertNotEqual(response['ETag'], etag)
+        likes = {post['caption']: post['likes'] for location in response.json().values() for post in location}
+        self.assertEqual(likes["Glasgow 0"], 1)
+
+        etag = response['ETag']
+        Post.objects.create(created_by=self.user_profile, caption="Glasgow new", photo='new.jpg', latitude=55.87, longitude=-4.29)
+        response = self.get_posts_json(55.88, -4.30, 55.86, -4.28)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertIn("Glasgow new", self.page_captions(response))
+
+    def test_non_finite_viewport_bad_request(self):
+        for value in ['inf', '-inf', 'nan']:
+            response = self.client.get(reverse('main:get_posts_json'), {'nwLat': value, 'nwLon': -4.30, 'seLat': 55.86,
+                                                                        'seLon': -4.28})
+            self.assertEqual(response.status_code, 400)
+
+    def test_stream_not_cached(self):
+        response = self.get_posts_json(55.88, -4.30, 55.86, -4.28, format='stream')
+        self.assertFalse(response.has_header('ETag'))
+
+
+class SharedCacheTestCase(TestCase):
+    def test_cache_shared_between_processes(self):
+        # Region versions and tiles are invalidated from other processes, see CACHES
+        backend = settings.CACHES['default']['BACKEND']
+        self.assertNotIn(backend, ['django.core.cache.backends.locmem.LocMemCache',
+                                   'django.core.cache.backends.dummy.DummyCache'])
+
+        cache.set('region-version:gcuvy', 'other process')
+        self.assertEqual(regions.versions(['gcuvy']), ['other process'])
+
+@override_settings(CACHES=LOCAL_MEMORY_CACHES)
+class GetTileJsonViewTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpassword123')
+        self.user_profile = UserProfile.objects.create(user=self.user)
+        self.post = Post.objects.create(created_by=self.user_profile, caption="Glasgow", photo='glasgow.jpg',
+                                        latitude=55.8724, longitude=-4.2900)
+        self.tile = geo.tile_for(55.8724, -4.2900, 15)
+        self.url = reverse('main:get_tile_json', args=[15, *self.tile])
+
+    def tile_posts(self):
+        return [post for location in self.client.get(self.url).json().values() for post in location]
+
+    def test_tile_contains_post(self):
+        posts = self.tile_posts()
+        self.assertEqual(len(posts), 1)
+        self.assertEqual(posts[0]['caption'], "Glasgow")
+
+    def test_tile_served_from_cache(self):
+        self.client.get(self.url)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+
+    def test_new_post_invalidates_only_its_tile(self):
+        self.tile_posts()
+        other_tile = geo.tile_for(55.9533, -3.1883, 15)
+        self.client.get(reverse('main:get_tile_json', args=[15, *other_tile]))
+
+        Post.objects.create(created_by=self.user_profile, caption="Glasgow 2", photo='glasgow_2.jpg',
+                            latitude=55.8725, longitude=-4.2901)
+        self.assertIsNone(cache.get(tiles.tile_cache_key(15, *self.tile)))
+        self.assertIsNotNone(cache.get(tiles.tile_cache_key(15, *other_tile)))
+        self.assertEqual(len(self.tile_posts()), 2)
+
+    def test_like_keeps_tile_cached(self):
+        self.tile_posts()
+        with self.assertNumQueries(2):
+            # The like and the post's like count, the post isn't loaded again
+            Like.objects.create(post=self.post, user=self.user_profile)
+        self.assertIsNotNone(cache.get(tiles.tile_cache_key(15, *self.tile)))
+
+    def test_moved_post_invalidates_old_tile(self):
+        self.tile_posts()
+        post = Post.objects.get(pk=self.post.pk)
+        post.latitude, post.longitude = 55.9533, -3.1883
+        with patch('main.models.Post.objects.filter', side_effect=AssertionError("old position queried")):
+            post.save()
+        self.assertEqual(self.tile_posts(), [])
+
+    def test_dense_tile_paged(self):
+        for i in range(2):
+            Post.objects.create(created_by=self.user_profile, caption=f"Glasgow {i}", photo='glasgow.jpg',
+                                latitude=55.8724, longitude=-4.2900)
+        with patch('main.views.POSTS_MAX_LIMIT', 2):
+            first = self.client.get(self.url)
+            second = self.client.get(self.url, {'cursor': first['X-Next-Cursor']})
+        self.assertFalse(second.has_header('X-Next-Cursor'))
+        captions = [post['caption'] for page in (first, second)
+                    for location in page.json().values() for post in location]
+        self.assertEqual(sorted(captions), ["Glasgow", "Glasgow 0", "Glasgow 1"])
+
+        # The cursor is cached with the first page
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.url)['X-Next-Cursor'], first['X-Next-Cursor'])
+
+    def test_invalid_tile_cursor(self):
+        self.assertEqual(self.client.get(self.url, {'cursor': 'not a cursor'}).status_code, 400)
+
+    def test_zoom_out_of_range(self):
+        response = self.client.get(reverse('main:get_tile_json', args=[5, 0, 0]))
+        self.assertEqual(response.status_code, 404)
+
+class NearbyPostsViewTestCase(TestCase):
+    def setUp(self):
+        user_profile = UserProfile.objects.create(user=User.objects.create_user(username='testuser'))
+        # Posts 0, 100, ..., 2400m north of the search centre
+        self.posts = [
+            Post.objects.create(created_by=user_profile, caption=f"Post {i}", photo=f'post_{i}.jpg',
+                                latitude=55.8724 + i * 100 / 111195, longitude=-4.2900)
+            for i in range(25)
+        ]
+        self.edinburgh_post = Post.objects.create(created_by=user_profile, caption="Edinburgh", photo='edinburgh.jpg',
+                                                  latitude=55.9533, longitude=-3.1883)
+
+    def test_show_location_radius(self):
+        response = self.client.get(reverse('main:show_location'), {'lat': 55.8724, 'lon': -4.29, 'radius_m': 1050})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['posts'], self.posts[:11])
+        self.assertContains(response, '1000m away')
+
+    def test_show_location_pages(self):
+        params = {'lat': 55.8724, 'lon': -4.29, 'radius_m': 5000}
+        response = self.client.get(reverse('main:show_location'), dict(params, page=2))
+        self.assertEqual(response.context['posts'], self.posts[NEAR_PAGE_SIZE:])
+        self.assertEqual(response.context['page'].paginator.count, 25)
+
+    def test_posts_near_json(self):
+        response = self.client.get(reverse('main:get_posts_near_json'), {'lat': 55.8724, 'lon': -4.29, 'radius_m': 250})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['count'], 3)
+        self.assertEqual([post['caption'] for post in data['posts']], ["Post 0", "Post 1", "Post 2"])
+        self.assertAlmostEqual(data['posts'][2]['distance'], 200, delta=1)
+
+    def test_invalid_query(self):
+        for params in [{'lat': 55.8724}, {'lat': 'x', 'lon': 0}, {'lat': 0, 'lon': 0, 'radius_m': 10 ** 9},
+                       {'lat': 0, 'lon': 0, 'radius_m': -1}]:
+            self.assertEqual(self.client.get(reverse('main:get_posts_near_json'), params).status_code, 400)
+            self.assertEqual(self.client.get(reverse('main:show_location'), params).status_code, 400)
+
+@override_settings(CACHES=LOCAL_MEMORY_CACHES)
+class NearbyPostsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user_profile = UserProfile.objects.create(user=User.objects.create_user(username='testuser'))
+        # Posts 0, 50, ..., 450m north of the first one
+        self.posts = [self.create_post(55.8724 + i * 50 / 111195, -4.2900) for i in range(10)]
+        self.url = reverse('main:view_post', args=[self.user_profile.slug, self.posts[0].slug])
+
+    def create_post(self, latitude, longitude):
+        return Post.objects.create(created_by=self.user_profile, caption="Post", photo='post.jpg',
+                                   latitude=latitude, longitude=longitude)
+
+    def test_nearest_posts(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.context['nearby_posts'], self.posts[1:1 + nearby.NEARBY_COUNT])
+        self.assertContains(response, 'Nearby photos')
+
+    def test_expands_search_in_sparse_areas(self):
+        far_post = self.create_post(56.8724, -4.2900)
+        posts = nearby.nearby_posts(far_post)
+        self.assertEqual(posts, self.posts[::-1][:nearby.NEARBY_COUNT])
+        self.assertAlmostEqual(posts[0].distance, 111195 - 450, delta=200)
+
+    def test_cached(self):
+        nearby.nearby_posts(self.posts[0])
+        with self.assertNumQueries(1):
+            nearby.nearby_posts(self.posts[0])
+
+    def test_new_post_nearby_invalidates_cache(self):
+        nearby.nearby_posts(self.posts[0])
+        new_post = self.create_post(55.8725, -4.2900)
+        self.assertEqual(nearby.nearby_posts(self.posts[0])[0], new_post)
+
+    def test_deleted_post_invalidates_cache(self):
+        nearby.nearby_posts(self.posts[0])
+        self.posts[1].delete()
+        self.assertEqual(nearby.nearby_posts(self.posts[0]), self.posts[2:2 + nearby.NEARBY_COUNT])
+
+    def test_post_far_away_keeps_cache(self):
+        nearby.nearby_posts(self.posts[0])
+        self.create_post(-33.8688, 151.2093)
+        with self.assertNumQueries(1):
+            nearby.nearby_posts(self.posts[0])
+
+@skipUnless(nearby.numpy, "NumPy isn't installed")
+class NearbyDistancesTestCase(SimpleTestCase):
+    def test_vectorised_distances_match_haversine(self):
+        rng = random.Random(1)
+        count = nearby.NUMPY_MIN_CANDIDATES
+        latitudes = [rng.uniform(-90, 90) for _ in range(count)] + [55.8724, -55.8724]
+        longitudes = [rng.uniform(-180, 180) for _ in range(count)] + [-4.2900, 175.71]
+
+        with patch.object(nearby.numpy, 'arcsin', wraps=nearby.numpy.arcsin) as arcsin:
+            distances = nearby.distances_m(55.8724, -4.2900, latitudes, longitudes)
+        arcsin.assert_called_once()
+
+        for distance, latitude, longitude in zip(distances, latitudes, longitudes):
+            self.assertAlmostEqual(distance, geo.haversine_m(55.8724, -4.2900, latitude, longitude), delta=1e-3)
+        # The same point, and the far side of the world
+        self.assertEqual(distances[-2], 0)
+        self.assertAlmostEqual(distances[-1], math.pi * geo.EARTH_RADIUS_M, delta=1)
+
+class LikeToggleViewTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword123')
+        self.user_profile = UserProfile.objects.create(user=self.user)
+        self.post = Post.objects.create(created_by=self.user_profile, caption="Test Post", photo='test_image.jpg',
+                                        latitude=1.1, longitude=1.1)
+        self.url = reverse('main:like_toggle')
+
+    def test_like_then_unlike(self):
+        self.client.login(username='testuser', password='testpassword123')
+        response = self.client.get(self.url, {'post_id': self.post.id})
+        self.assertEqual(response.content, b'1')
+        response = self.client.get(self.url, {'post_id': self.post.id})
+        self.assertEqual(response.content, b'0')
+        self.assertFalse(Like.objects.exists())
+
+    def test_unknown_post(self):
+        self.client.login(username='testuser', password='testpassword123')
+        response = self.client.get(self.url, {'post_id': self.post.id + 1})
+        self.assertEqual(response.status_code, 404)
+
+    def test_requires_login(self):
+        response = self.client.get(self.url, {'post_id': self.post.id})
+        self.assertEqual(response.status_code, 403)
+
+@override_settings(CACHES=LOCAL_MEMORY_CACHES)
+class ListingQueryCountTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpassword123')
+        self.user_profile = UserProfile.objects.create(user=self.user)
+        self.group = Group.objects.create(name="Test Group", created_by=self.user_profile)
+        self.posts = []
+        self.add_posts(3)
+
+    def add_posts(self, count):
+        for i in range(count):
+            author = UserProfile.objects.create(user=User.objects.create_user(username=f'author{len(self.posts)}'))
+            post = Post.objects.create(created_by=author, group=self.group, caption="Test Post", photo='test_image.jpg',
+                                       latitude=55.8724, longitude=-4.2900)
+            post.set_location("Location A")
+            post.save()
+            Comment.objects.create(created_by=author, post=self.posts[0] if self.posts else post, comment="Test Comment")
+            self.posts.append(post)
+
+    def assert_constant_queries(self, url, expected):
+        with self.assertNumQueries(expected):
+            self.client.get(url)
+        self.add_posts(3)
+        with self.assertNumQueries(expected):
+            self.client.get(url)
+
+    def test_show_user_profile(self):
+        author = self.posts[0].created_by
+        for post in Post.objects.all():
+            post.created_by = author
+            post.save()
+        self.assert_constant_queries(reverse('main:show_user_profile', args=[author.slug]), 2)
+
+    def test_show_location(self):
+        self.assert_constant_queries(reverse('main:show_location') + '?location_name=Location A', 2)
+        self.assertEqual(len(self.client.get(reverse('main:show_location') + '?location_name=Location A').context['posts']), 6)
+
+    def test_show_group(self):
+        self.assert_constant_queries(reverse('main:show_group', args=[self.group.slug]), 4)
+
+    def test_view_post(self):
+        post = self.posts[0]
+        url = reverse('main:view_post', args=[post.created_by.slug, post.slug])
+        for _ in range(2):
+            # The first view fills the nearby posts cache, then it's the post, its comments and the nearby posts
+            self.client.get(url)
+            with self.assertNumQueries(3):
+                self.client.get(url)
+            self.add_posts(3)
+
+    def test_my_account(self):
+        self.client.login(username='testuser', password='testpassword123')
+        for post in Post.objects.all():
+            post.created_by = self.user_profile
+            post.save()
+        Like.objects.create(post=self.posts[0], user=self.user_profile)
+        self.assert_constant_queries(reverse('main:my_account'), 5)
+
+    def test_liked_state_loaded_once_per_listing(self):
+        self.client.login(username='testuser', password='testpassword123')
+        Like.objects.create(post=self.posts[1], user=self.user_profile)
+        url = reverse('main:show_location') + '?location_name=Location A'
+        # session, user, location and one query for the liked state of every post on the page
+        self.assert_constant_queries(url, 5)
+
+        response = self.client.get(url)
+        self.assertContains(response, '&#9829;', count=1)
+
+    def test_view_post_liked_state(self):
+        self.client.login(username='testuser', password='testpassword123')
+        Like.objects.create(post=self.posts[0], user=self.user_profile)
+        response = self.client.get(reverse('main:view_post', args=[self.posts[0].created_by.slug, self.posts[0].slug]))
+        self.assertTrue(response.context['has_user_liked'])
+
+    def test_get_posts_json(self):
+        self.assert_constant_queries(
+            reverse('main:get_posts_json') + '?nwLat=55.88&nwLon=-4.30&seLat=55.86&seLon=-4.28&zoom=15', 1)
+
+
+@override_settings(CACHES=LOCAL_MEMORY_CACHES)
+class ResizedMediaViewTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.media_root, self.cache_dir = tempfile.mkdtemp(), tempfile.mkdtemp()
+        for directory in (self.media_root, self.cache_dir):
+            self.addCleanup(shutil.rmtree, directory)
+        media = override_settings(MEDIA_ROOT=self.media_root, RESIZED_MEDIA_CACHE_DIR=self.cache_dir,
+                                  RESIZED_MEDIA_SIZES=[(140, 140), (500, 500)])
+        media.enable()
+        self.addCleanup(media.disable)
+
+        with open('tests/photoGraph/test_images/test_image.jpg', 'rb') as image_file:
+            self.name = default_storage.save('post_photos/test_image.jpg', image_file)
+
+    def get(self, width, height, path):
+        return self.client.get(reverse('resized_media', args=[width, height, path]))
+
+    def resize(self, width, height):
+        with resizing.open_resized(width, height, self.name) as f:
+            return f.name
+
+    def test_resized(self):
+        response = self.get(500, 500, self.name)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertIn('max-age=31536000', response['Cache-Control'])
+        image = Image.open(BytesIO(b''.join(response.streaming_content)))
+        # The fixture is a portrait photo stored on its side with an EXIF orientation
+        self.assertEqual(image.size, (375, 500))
+
+        # Later requests are served from the cache
+        with patch('main.renditions.open_scaled') as open_scaled:
+            self.assertEqual(self.get(500, 500, self.name).status_code, 200)
+        open_scaled.assert_not_called()
+
+    def test_not_found(self):
+        self.assertEqual(self.get(501, 501, self.name).status_code, 404)
+        self.assertEqual(self.get(500, 500, 'post_photos/missing.jpg').status_code, 404)
+        self.assertEqual(self.get(500, 500, '../manage.py').status_code, 404)
+
+        default_storage.save('post_photos/notes.txt', BytesIO(b'not an image'))
+        self.assertEqual(self.get(500, 500, 'post_photos/notes.txt').status_code, 404)
+
+    def test_least_recently_used_evicted(self):
+        small, large = self.resize(140, 140), self.resize(500, 500)
+        os.utime(small, (0, 0))
+        resizing.evict(os.path.getsize(large))
+        self.assertFalse(os.path.exists(small))
+        self.assertTrue(os.path.exists(large))
+
+    def test_cache_only_walked_when_full(self):
+        self.resize(140, 140)
+        with patch('main.resizing.os.walk') as walk:
+            self.resize(500, 500)
+        walk.assert_not_called()
+
+        with override_settings(RESIZED_MEDIA_CACHE_MAX_BYTES=1), patch('main.resizing.evict') as evict:
+            os.remove(self.resize(140, 140))
+            self.resize(140, 140)
+        evict.assert_called_once_with(0)
+
+    def test_image_evicted_while_served(self):
+        evict = resizing.evict
+
+        def evict_everything(max_bytes):
+            evict(0)
+
+        with patch('main.resizing.evict', evict_everything):
+            response = self.get(500, 500, self.name)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Image.open(BytesIO(b''.join(response.streaming_content))).size, (375, 500))
+        self.assertEqual(os.listdir(os.path.join(self.cache_dir, '500x500', 'post_photos')), ['test_image.jpg.lock'])
+
+    def test_concurrent_requests_resize_once(self):
+        open_scaled = renditions.open_scaled
+        calls = []
+
+        def slow_open_scaled(*args):
+            calls.append(args)
+            time.sleep(0.2)
+            return open_scaled(*args)
+
+        with patch('main.renditions.open_scaled', slow_open_scaled):
+            threads = [threading.Thread(target=self.resize, args=(500, 500)) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(calls), 1)
+
+    def test_lock_left_by_dead_process_ignored(self):
+        path = resizing.cache_path(500, 500, self.name)
+        os.makedirs(os.path.dirname(path))
+        open(path + '.lock', 'w').close()
+        self.assertEqual(self.get(500, 500, self.name).status_code, 200)
+
+    def test_held_lock_waited_for(self):
+        path = resizing.cache_path(500, 500, self.name)
+        with resizing.lock(path):
+            thread = threading.Thread(target=self.resize, args=(500, 500))
+            thread.start()
+            thread.join(0.2)
+            self.assertTrue(thread.is_alive())
+            self.assertFalse(os.path.exists(path))
+        thread.join()
+        self.assertTrue(os.path.exists(path))
+
+
+class ServeMediaViewTestCase(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+        self.data = bytes(range(256)) * 4
+        self.name = default_storage.save('post_photos/photo.jpg', BytesIO(self.data))
+
+    def get(self, path, **headers):
+        return self.client.get(reverse('media', args=[path]), **headers)
+
+    def test_file(self):
+        response = self.get(self.name)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.data)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(response['Content-Length'], str(len(self.data)))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('Last-Modified', response)
+        self.assertIn('max-age=3600', response['Cache-Control'])
+        self.assertNotIn('immutable', response['Cache-Control'])
+
+    def test_content_addressed_file_immutable(self):
+        name = storage.content_storage.save('photo.jpg', BytesIO(self.data))
+        response = self.get(name)
+        self.assertEqual(response['ETag'], '"%s"' % os.path.splitext(os.path.basename(name))[0])
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn('max-age=31536000', response['Cache-Control'])
+
+        rendition = default_storage.save(renditions.rendition_name(name, 'card'), BytesIO(self.data))
+        default_storage.save(renditions.variant_name(rendition, '.webp'), BytesIO(b'webp'))
+        digest = os.path.splitext(os.path.basename(name))[0]
+        response = self.get(rendition)
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(response['ETag'], f'"{digest}-card-jpg"')
+        self.assertEqual(self.get(rendition, HTTP_ACCEPT='image/webp')['ETag'], f'"{digest}-card-webp"')
+
+    def test_not_modified(self):
+        response = self.get(self.name)
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        response.close()
+
+        response = self.get(self.name, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertIn('Cache-Control', response)
+        self.assertEqual(self.get(self.name, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+        self.assertEqual(self.get(self.name, HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+
+    def test_range(self):
+        response = self.get(self.name, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.data[10:20])
+        self.assertEqual(response['Content-Length'], '10')
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/1024')
+
+        response = self.get(self.name, HTTP_RANGE='bytes=1000-')
+        self.assertEqual(b''.join(response.streaming_content), self.data[1000:])
+        response = self.get(self.name, HTTP_RANGE='bytes=-24')
+        self.assertEqual(b''.join(response.streaming_content), self.data[-24:])
+        self.assertEqual(response['Content-Range'], 'bytes 1000-1023/1024')
+
+    def test_unsatisfiable_range(self):
+        response = self.get(self.name, HTTP_RANGE='bytes=1024-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */1024')
+
+    def test_range_ignored(self):
+        # Several ranges, and ranges of a file changed since If-Range, get the whole file
+        self.assertEqual(self.get(self.name, HTTP_RANGE='bytes=0-1,5-6').status_code, 200)
+        self.assertEqual(self.get(self.name, HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE='"other"').status_code, 200)
+        etag = self.get(self.name)['ETag']
+        self.assertEqual(self.get(self.name, HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE=etag).status_code, 206)
+
+    def test_not_found(self):
+        self.assertEqual(self.get('post_photos/missing.jpg').status_code, 404)
+        self.assertEqual(self.get('post_photos').status_code, 404)
+        self.assertEqual(self.get('../manage.py').status_code, 404)
+
+    def test_rendition_variant_negotiated(self):
+        rendition = default_storage.save('renditions/card/post_photos/photo.jpg', BytesIO(self.data))
+        default_storage.save('renditions/card/post_photos/photo.webp', BytesIO(b'webp'))
+        chrome = 'image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8'
+
+        response = self.get(rendition, HTTP_ACCEPT=chrome)
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertEqual(b''.join(response.streaming_content), b'webp')
+        self.assertEqual(response['Vary'], 'Accept')
+        self.assertEqual(self.get(rendition, HTTP_ACCEPT=chrome, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        for accept in ['*/*', 'image/*', 'image/webp;q=0', '']:
+            response = self.get(rendition, HTTP_ACCEPT=accept)
+            self.assertEqual(response['Content-Type'], 'image/jpeg')
+            self.assertEqual(response['Vary'], 'Accept')
+        self.assertNotIn('Vary', self.get(self.name, HTTP_ACCEPT=chrome))
+
+        default_storage.save('renditions/card/post_photos/photo.avif', BytesIO(b'avif'))
+        self.assertEqual(self.get(rendition, HTTP_ACCEPT=chrome)['Content-Type'], 'image/avif')